@@ -1,12 +1,32 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Response, redirect, render_template, request, send_file, jsonify, url_for
 import pandas as pd
 from sqlalchemy import create_engine, text
-from datetime import datetime, timedelta
+from datetime import datetime
+import io
 import os
-from dateutil.relativedelta import relativedelta
+import shutil
+import tempfile
 import traceback
+import uuid
 from openpyxl.utils import get_column_letter
 from report_generator import ReportGenerator
+from report_cache import FILE_PARAMS, ReportCache
+from timetable_cache import TimetableCache, describe_timetable
+from event_store import EventStore
+from jobs import CANCELLED, DONE, FAILED, JobManager, JobQueueFull, SQLiteJobStore
+from metrics import CONTENT_TYPE, ReportMetrics
+from pipeline import StageTimings, report_date_range
+from batch import BATCH_LAYOUTS, filter_sets
+from report_formats import (
+    CONTENT_TYPES,
+    STREAMED_FORMATS,
+    check_output_format,
+    content_type,
+    csv_chunks,
+)
+from live_daily import LiveDaily
+from event_frame import expand_events
+from werkzeug.utils import secure_filename
 from functools import wraps
 app = Flask(__name__)
 
@@ -17,27 +37,65 @@ DB_CONFIG = {
     "user": "postgres",
     "password": "postgres",
     "port": "5432",
+    # Connection pool, shared by all requests of a worker process
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "statement_timeout": 300000,
+    # Stream events in chunks of this many rows instead of loading the range
+    "fetch_chunksize": 50000,
 }
 
-report_generator = ReportGenerator(DB_CONFIG)
+report_cache = ReportCache(
+    os.path.join(os.getcwd(), "cache", "reports"),
+    max_bytes=2 * 1024**3,
+    max_age=7 * 24 * 3600,
+)
 
+# Parsed work timetables by upload content hash, so repeat uploads skip Excel
+timetable_cache = TimetableCache(
+    os.path.join(os.getcwd(), "cache", "timetables"),
+    max_entries=200,
+)
 
-@app.route("/")
-def index():
-    return render_template("index.html")
+# Parquet mirror of closed days; reports only query the database for the rest
+event_store = EventStore(os.path.join(os.getcwd(), "cache", "events"))
 
+report_generator = ReportGenerator(
+    DB_CONFIG,
+    cache=report_cache,
+    timetable_cache=timetable_cache,
+    event_store=event_store,
+    # Long ranges are split into weekly partitions fetched by this many
+    # processes; the cores are shared by the two job processes below
+    parallel_workers=max(1, (os.cpu_count() or 1) // 2),
+)
 
-def validate_dates(start_str, end_str):
-    try:
-        start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
-        end_date = datetime.strptime(end_str, "%Y-%m-%d").date()
+# Stage times, row counts, output sizes and peak RSS of finished reports,
+# served on /metrics; the app workers share their totals through this directory
+report_metrics = ReportMetrics(directory=os.path.join(os.getcwd(), "cache", "metrics"))
 
-        if start_date > end_date:
-            raise ValueError("Дата начала не может быть позже даты окончания.")
+# Today's events tailed by id, so daily reports skip the full-day query;
+# each app worker process starts its own tail on the first daily request
+live_daily = LiveDaily(DB_CONFIG, poll_interval=30)
 
-        return start_date, end_date
-    except ValueError as e:
-        raise ValueError(f"Неверный формат даты: {str(e)}")
+# Filters a live daily report supports (see Filter.apply_filters)
+LIVE_FILTERS = ("device_name", "person_group")
+
+# Reports run in a process pool; job state is shared by all app workers
+job_manager = JobManager(
+    report_generator,
+    store=SQLiteJobStore(os.path.join(os.getcwd(), "cache", "jobs.sqlite3")),
+    max_workers=2,
+    max_pending=20,
+    metrics=report_metrics,
+)
+
+
+@app.route("/")
+def index():
+    return render_template("index.html")
 
 
 @app.route("/generate", methods=["POST"])
@@ -52,77 +110,99 @@ def generate():
         today = datetime.now().date()
 
         # Handle date range selection
-        if report_type == "custom":
-            if "start_date" not in request.form or "end_date" not in request.form:
-                return (
-                    jsonify(
-                        {
-                            "error": "Для пользовательских отчетов необходимы дата начала и окончания."
-                        }
-                    ),
-                    400,
-                )
-
+        timings = StageTimings()
+        with timings.stage("parse"):
             try:
-                start_date, end_date = validate_dates(
-                    request.form["start_date"], request.form["end_date"]
+                start_date, end_date = report_date_range(
+                    report_type,
+                    today,
+                    request.form.get("start_date"),
+                    request.form.get("end_date"),
                 )
             except ValueError as e:
                 return jsonify({"error": str(e)}), 400
-        else:
-            if report_type == "daily":
-                start_date = end_date = today
-            elif report_type == "weekly":
-                start_date = today - timedelta(days=today.weekday())
-                end_date = start_date + timedelta(days=6)
-            elif report_type == "monthly":
-                start_date = today.replace(day=1)
-                end_date = today.replace(day=1) + relativedelta(months=1, days=-1)
-            elif report_type == "quarterly":
-                current_quarter = (today.month - 1) // 3
-                quarter_month = current_quarter * 3 + 1
-                start_date = today.replace(month=quarter_month, day=1)
-                end_date = start_date + relativedelta(months=3, days=-1)
-            else:
-                return jsonify({"error": f"Неверный тип отчета: {report_type}"}), 400
 
         app.logger.info(f"Диапазон дат: {start_date} to {end_date}")
 
-        additional_params = request.form.to_dict()
-        output_file = report_generator.generate_report(
-            report_type, start_date, end_date, additional_params
+        additional_params = client_params(request.form.to_dict())
+        # Profiling is a property of the job, not of the report
+        profile = request.args.get("profile") == "1" or bool(
+            additional_params.pop("profile", None)
         )
+        output_format = additional_params.get("output_format") or "xlsx"
+        try:
+            check_output_format(output_format, summary_only="summary_only" in request.form)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Today's standard report is answered from the live event tail
+        if (
+            report_type == "daily"
+            and "use_timetable" not in request.form
+            and "summary_only" not in request.form
+            and output_format != "parquet"
+            and not profile
+            and live_daily_ready()
+        ):
+            filters = live_filters(additional_params)
+            if output_format in STREAMED_FORMATS:
+                return live_report(output_format, filters)
+            return jsonify(
+                {
+                    "status": DONE,
+                    "live": True,
+                    "download_url": url_for(
+                        "live_daily_report", output_format=output_format, **filters
+                    ),
+                }
+            )
 
-        # Handle work timetable file if provided
-        if "use_timetable" in request.form and "work_timetable" in request.files:
+        # The timetable is parsed (or found) in the timetable cache and the job
+        # refers to it by content hash
+        if "use_timetable" in request.form and request.form.get("timetable_sha256"):
+            try:
+                entry = timetable_cache.get(request.form["timetable_sha256"])
+            except ValueError:
+                entry = None
+            if entry is None:
+                return (
+                    jsonify({"error": "Расписание не найдено, загрузите файл снова."}),
+                    404,
+                )
+        elif "use_timetable" in request.form and "work_timetable" in request.files:
             timetable_file = request.files["work_timetable"]
-            if timetable_file:
-                # Save uploaded file temporarily
-                temp_path = os.path.join(os.getcwd(), "temp", timetable_file.filename)
-                os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-                timetable_file.save(temp_path)
-                additional_params["work_timetable"] = temp_path
-
-                try:
-                    output_file = report_generator.generate_report(
-                        report_type, start_date, end_date, additional_params
-                    )
-                finally:
-                    # Clean up temporary file
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-            else:
+            if not timetable_file:
                 return jsonify({"error": "Требуется файл расписания работы."}), 400
-        else:
-            output_file = report_generator.generate_report(
-                report_type, start_date, end_date, additional_params
-            )
+            try:
+                with timings.stage("parse"):
+                    entry = cache_timetable(timetable_file)
+            except ValueError as e:
+                return jsonify({"error": f"Ошибка в расписании работы: {str(e)}"}), 400
+            additional_params["timetable_sha256"] = entry["sha256"]
 
-        if not os.path.exists(output_file):
-            app.logger.error(f"Сгенерированный файл не найден: {output_file}")
-            return jsonify({"error": "Не удалось создать отчет"}), 500
+        # Streamed from a GET, which the ASGI entry point serves without a thread
+        if output_format in STREAMED_FORMATS:
+            return redirect(url_for("stream_download", **additional_params), code=303)
 
-        return send_file(output_file, as_attachment=True)
+        try:
+            job, created = job_manager.submit(
+                report_type,
+                start_date,
+                end_date,
+                additional_params,
+                timings=timings,
+                profile=profile,
+            )
+        except JobQueueFull:
+            return (
+                jsonify({"error": "Слишком много отчетов в очереди, попробуйте позже."}),
+                429,
+            )
+
+        app.logger.info(
+            f"Задание {job['id']} {'создано' if created else 'уже выполняется'}"
+        )
+        return jsonify(describe_job(job)), 202
 
     except Exception as e:
         app.logger.error(f"Ошибка создания отчета: {str(e)}")
@@ -130,6 +210,381 @@ def generate():
         return jsonify({"error": f"Ошибка сервера: {str(e)}"}), 500
 
 
+@app.route("/batch", methods=["POST"])
+def generate_batch():
+    """Queue one standard report per department (or filter set) of a range.
+
+    Takes JSON or form fields: report_type, start_date, end_date,
+    departments (person_group values), filter_sets (JSON only) and
+    layout ("zip" or "sheets").
+    """
+    try:
+        data = request.get_json(silent=True)
+        if data is None:
+            data = request.form.to_dict()
+            departments = request.form.getlist("departments")
+            if len(departments) == 1:
+                # A textarea with one department per line
+                departments = departments[0].splitlines()
+            data["departments"] = departments
+
+        report_type = data.get("report_type")
+        if not report_type:
+            return jsonify({"error": "Тип отчета не указан"}), 400
+        layout = data.get("layout") or "zip"
+        if layout not in BATCH_LAYOUTS:
+            return jsonify({"error": f"Неверный формат пакета: {layout}"}), 400
+
+        timings = StageTimings()
+        with timings.stage("parse"):
+            try:
+                start_date, end_date = report_date_range(
+                    report_type,
+                    datetime.now().date(),
+                    data.get("start_date"),
+                    data.get("end_date"),
+                )
+                sets = filter_sets(
+                    [d.strip() for d in data.get("departments") or []],
+                    [client_params(s) for s in data.get("filter_sets") or []],
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        try:
+            job, created = job_manager.submit(
+                report_type,
+                start_date,
+                end_date,
+                {"batch": sets, "batch_layout": layout},
+                timings=timings,
+            )
+        except JobQueueFull:
+            return (
+                jsonify({"error": "Слишком много отчетов в очереди, попробуйте позже."}),
+                429,
+            )
+        return jsonify(describe_job(job)), 202
+
+    except Exception as e:
+        app.logger.error(f"Ошибка создания пакета отчетов: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": f"Ошибка сервера: {str(e)}"}), 500
+
+
+def client_params(params):
+    """Request params without FILE_PARAMS; server file paths only come from uploads"""
+    return {k: v for k, v in params.items() if k not in FILE_PARAMS}
+
+
+def stream_request(params):
+    """(report_type, start_date, end_date, params) of a streamed report request.
+
+    ``params`` are the /generate form fields as a dict; raises ValueError
+    with a user message.
+    """
+    report_type = params.get("report_type")
+    if not report_type:
+        raise ValueError("Тип отчета не указан")
+    start_date, end_date = report_date_range(
+        report_type,
+        datetime.now().date(),
+        params.get("start_date"),
+        params.get("end_date"),
+    )
+    params = client_params(params)
+    output_format = params.get("output_format") or "xlsx"
+    if output_format not in STREAMED_FORMATS:
+        raise ValueError(f"Формат {output_format} не передается потоком")
+    check_output_format(output_format, summary_only="summary_only" in params)
+    return report_type, start_date, end_date, params
+
+
+@app.route("/reports/stream")
+def stream_download():
+    """Stream a CSV report; the query args are the /generate form fields"""
+    try:
+        report_type, start_date, end_date, params = stream_request(request.args.to_dict())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return stream_report(report_type, start_date, end_date, params)
+    except ValueError:
+        # A timetable that is no longer in the timetable cache
+        return jsonify({"error": "Расписание не найдено, загрузите файл снова."}), 404
+
+
+def stream_report(report_type, start_date, end_date, additional_params):
+    """Send a CSV report as it is read from the event store and database cursor.
+
+    No job, report file or cleanup thread is involved: rows are encoded
+    chunk by chunk straight into the chunked response.
+    """
+    plan = report_generator.plan_report(
+        report_type, start_date, end_date, additional_params
+    )
+    app.logger.info(f"Потоковая выгрузка отчета: {plan.describe()}")
+    filename = report_generator.flat_filename(plan)
+    return Response(
+        observe_stream(report_generator.stream_report(plan)),
+        content_type=CONTENT_TYPES[plan.output_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def observe_stream(chunks, mode="stream"):
+    """Pass a streamed report through, recording it into report_metrics.
+
+    The timings are active only while the next block is produced, since
+    the response generator runs between requests handled by the thread.
+    """
+    timings = StageTimings()
+    blocks = timings.timed("stream", chunks)
+    status = FAILED
+    try:
+        while True:
+            with timings.activate():
+                block = next(blocks, None)
+            if block is None:
+                break
+            timings.count("output_bytes", len(block))
+            yield block
+        status = DONE
+    except GeneratorExit:
+        # The client went away before the end of the report
+        status = CANCELLED
+        raise
+    finally:
+        report_metrics.observe(status, timings.as_dict(), mode=mode)
+
+
+def live_filters(params):
+    """Filters of a live daily request that have a value"""
+    return {name: params[name] for name in LIVE_FILTERS if params.get(name)}
+
+
+def live_daily_ready():
+    """Start the live tail and bring it up to date; False if the database failed"""
+    try:
+        live_daily.start()
+        live_daily.ensure_fresh()
+        return True
+    except Exception as e:
+        app.logger.warning(f"Оперативные данные недоступны: {str(e)}")
+        return False
+
+
+def live_report(output_format, filters):
+    """Today's standard report from the live event tail.
+
+    CSV is streamed from the held events; workbooks are cached under the
+    tail's version, so repeated clicks without new events reuse the file.
+    """
+    day = live_daily.day
+    if output_format in STREAMED_FORMATS:
+        events = live_daily.events(filters)
+        size = report_generator.flat_chunksize
+        frames = (
+            expand_events(events.iloc[i : i + size]) for i in range(0, len(events), size)
+        )
+        filename = report_generator.report_filename(
+            "daily", day, day, extension=output_format
+        )
+        return Response(
+            observe_stream(
+                csv_chunks(frames, compress=output_format == "csv.gz"), mode="live"
+            ),
+            content_type=CONTENT_TYPES[output_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    timings = StageTimings()
+    with timings.activate():
+        # Taken before the events, so a key never names rows it lacks
+        key = report_cache.make_key(
+            "daily", day, day, dict(filters, live=True), live_daily.version()
+        )
+        output_file = report_cache.get(key)
+        if output_file:
+            timings.count("cache_hits")
+        else:
+            # Rendered under a unique directory, so concurrent requests for
+            # the same day never write or delete each other's file
+            work_dir = tempfile.mkdtemp(prefix="live-")
+            try:
+                rendered = report_generator.generate_excel(
+                    live_daily.events(), "daily", day, day, filters, output_dir=work_dir
+                )
+                output_file = report_cache.put(key, rendered)
+                if output_file is None:
+                    # Evicted at once, being larger than the whole cache
+                    with open(rendered, "rb") as f:
+                        output_file = io.BytesIO(f.read())
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    if isinstance(output_file, io.BytesIO):
+        timings.count("output_bytes", output_file.getbuffer().nbytes)
+    else:
+        timings.count("output_bytes", os.path.getsize(output_file))
+    report_metrics.observe(DONE, timings.as_dict(), mode="live")
+    return send_file(
+        output_file,
+        as_attachment=True,
+        download_name=report_generator.report_filename("daily", day, day),
+        mimetype=CONTENT_TYPES["xlsx"],
+    )
+
+def cache_timetable(timetable_file):
+    """Parse an uploaded timetable into the timetable cache unless it is there"""
+    # Saved under a unique name just long enough to hash (and maybe parse) it
+    temp_path = os.path.join(
+        os.getcwd(),
+        "temp",
+        f"{uuid.uuid4().hex}_{secure_filename(timetable_file.filename)}",
+    )
+    os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+    timetable_file.save(temp_path)
+    try:
+        return timetable_cache.load(
+            temp_path,
+            report_generator.parse_timetable,
+            filename=timetable_file.filename,
+        )
+    finally:
+        os.remove(temp_path)
+
+
+@app.route("/timetables", methods=["GET"])
+def list_timetables():
+    return jsonify([describe_timetable(e) for e in timetable_cache.entries()])
+
+
+@app.route("/timetables", methods=["POST"])
+def upload_timetable():
+    timetable_file = request.files.get("work_timetable")
+    if not timetable_file:
+        return jsonify({"error": "Требуется файл расписания работы."}), 400
+    try:
+        entry = cache_timetable(timetable_file)
+    except ValueError as e:
+        return jsonify({"error": f"Ошибка в расписании работы: {str(e)}"}), 400
+    response = describe_timetable(entry)
+    response["url"] = url_for("get_timetable", sha256=entry["sha256"])
+    return jsonify(response), 201
+
+
+@app.route("/timetables/<sha256>")
+def get_timetable(sha256):
+    try:
+        entry = timetable_cache.get(sha256)
+    except ValueError:
+        entry = None
+    if entry is None:
+        return jsonify({"error": "Расписание не найдено"}), 404
+    return jsonify(describe_timetable(entry))
+
+
+def describe_job(job):
+    response = job_manager.describe(job)
+    response["status_url"] = url_for("job_status", job_id=job["id"])
+    response["download_url"] = url_for("job_download", job_id=job["id"])
+    if response["profiled"]:
+        response["profile_url"] = url_for("job_profile", job_id=job["id"])
+    return response
+
+
+@app.route("/live/daily")
+def live_daily_status():
+    """Who has arrived today, from the live event tail; filters as query args"""
+    if not live_daily_ready():
+        return jsonify({"error": "Оперативные данные недоступны, попробуйте позже."}), 503
+    return jsonify(live_daily.snapshot(live_filters(request.args)))
+
+
+@app.route("/live/daily/report")
+def live_daily_report():
+    """Today's standard report (xlsx, csv or csv.gz) from the live event tail"""
+    output_format = request.args.get("output_format") or "xlsx"
+    try:
+        check_output_format(output_format)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if output_format == "parquet":
+        return (
+            jsonify({"error": "Оперативный отчет формируется в xlsx или csv."}),
+            400,
+        )
+    if not live_daily_ready():
+        return jsonify({"error": "Оперативные данные недоступны, попробуйте позже."}), 503
+    try:
+        return live_report(output_format, live_filters(request.args))
+    except Exception as e:
+        app.logger.error(f"Ошибка оперативного отчета: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": f"Ошибка сервера: {str(e)}"}), 500
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    return jsonify(describe_job(job))
+
+
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    if job["status"] != DONE:
+        return jsonify({"error": "Отчет еще не готов", "status": job["status"]}), 409
+    if not os.path.exists(job["output_file"]):
+        app.logger.error(f"Сгенерированный файл не найден: {job['output_file']}")
+        return jsonify({"error": "Файл отчета больше не доступен"}), 410
+    return send_file(
+        job["output_file"],
+        as_attachment=True,
+        mimetype=content_type(job["output_file"]),
+    )
+
+
+@app.route("/jobs/<job_id>/profile")
+def job_profile(job_id):
+    """cProfile summary of a job submitted with ?profile=1; ?format=pstats for the dump"""
+    if job_manager.get(job_id) is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    text = request.args.get("format") != "pstats"
+    path = job_manager.profile_path(job_id, text=text)
+    if path is None:
+        return jsonify({"error": "Профиль задания не найден"}), 404
+    if text:
+        return send_file(path, mimetype="text/plain")
+    return send_file(path, as_attachment=True, download_name=f"{job_id}.prof")
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    return jsonify(describe_job(job))
+
+
+@app.route("/metrics")
+def metrics():
+    """Report pipeline metrics in the Prometheus text format"""
+    return Response(
+        report_metrics.render(report_generator.db_metrics()),
+        content_type=CONTENT_TYPE,
+    )
+
+
+@app.route("/metrics/db")
+def db_metrics():
+    return jsonify(report_generator.db_metrics())
+
+
 if __name__ == "__main__":
     app.debug = True
     app.run()
@@ -0,0 +1,134 @@
+"""ASGI entry point for production serving:
+
+    uvicorn asgi:application --workers 4
+
+Routes that mostly wait are served on the event loop. Streamed CSV
+reports read events through the async engine (asyncpg, or aiosqlite for
+the SQLite stand-in), and job downloads are sent from disk in chunks, so
+a slow query or a large file holds no thread. The pandas work on each
+fetched chunk runs in the default thread executor; workbooks are still
+rendered by the job process pool. Every other route is the Flask app,
+run in a thread pool by a2wsgi.
+
+Each worker is its own process: job state is shared through
+cache/jobs.sqlite3 and the /metrics report totals through cache/metrics,
+so any worker answers for all of them. Database pool metrics are labelled
+with the pid of the worker that answered the scrape.
+
+Needs starlette, uvicorn, a2wsgi, greenlet and asyncpg or aiosqlite.
+"""
+import asyncio
+import os
+import traceback
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app,
+    job_manager,
+    live_daily,
+    report_generator,
+    report_metrics,
+    stream_request,
+)
+from db import dispose_async_engines
+from jobs import CANCELLED, DONE, FAILED
+from pipeline import StageTimings
+from report_formats import CONTENT_TYPES, content_type
+
+# Threads running Flask requests; each holds one only until its response is built
+WSGI_WORKERS = 20
+
+
+async def observe_stream(chunks):
+    """app.observe_stream for an async stream of report blocks"""
+    timings = StageTimings()
+    status = FAILED
+    try:
+        while True:
+            with timings.activate(), timings.stage("stream"):
+                block = await anext(chunks, None)
+            if block is None:
+                break
+            timings.count("output_bytes", len(block))
+            yield block
+        status = DONE
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away before the end of the report
+        status = CANCELLED
+        raise
+    finally:
+        report_metrics.observe(status, timings.as_dict(), mode="stream")
+        await chunks.aclose()
+
+
+async def stream_download(request):
+    """Async twin of app.stream_download"""
+    try:
+        report_type, start_date, end_date, params = stream_request(
+            dict(request.query_params)
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        # Planning may parse a timetable, so it runs off the loop
+        plan = await asyncio.to_thread(
+            report_generator.plan_report, report_type, start_date, end_date, params
+        )
+    except ValueError:
+        return JSONResponse(
+            {"error": "Расписание не найдено, загрузите файл снова."}, status_code=404
+        )
+    print(f"Потоковая выгрузка отчета: {plan.describe()}")
+    filename = report_generator.flat_filename(plan)
+    return StreamingResponse(
+        observe_stream(report_generator.stream_report_async(plan)),
+        media_type=CONTENT_TYPES[plan.output_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+async def job_download(request):
+    """Async twin of app.job_download, sending the file in chunks"""
+    job = await asyncio.to_thread(job_manager.get, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "Задание не найдено"}, status_code=404)
+    if job["status"] != DONE:
+        return JSONResponse(
+            {"error": "Отчет еще не готов", "status": job["status"]}, status_code=409
+        )
+    if not os.path.exists(job["output_file"]):
+        print(f"Сгенерированный файл не найден: {job['output_file']}")
+        return JSONResponse({"error": "Файл отчета больше не доступен"}, status_code=410)
+    return FileResponse(
+        job["output_file"],
+        media_type=content_type(job["output_file"]),
+        filename=os.path.basename(job["output_file"]),
+    )
+
+
+@asynccontextmanager
+async def lifespan(application):
+    yield
+    try:
+        await asyncio.to_thread(live_daily.stop)
+        await asyncio.to_thread(job_manager.shutdown)
+        await dispose_async_engines()
+    except Exception as e:
+        print(f"Error shutting down: {str(e)}")
+        print(traceback.format_exc())
+        raise
+
+
+application = Starlette(
+    routes=[
+        Route("/reports/stream", stream_download, methods=["GET"]),
+        Route("/jobs/{job_id}/download", job_download, methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from utils import load_work_timetable, process_person_groups
+
+ATTENDANCE_COLUMNS = [
+    "Date",
+    "Person",
+    "person_group",
+    "Shift Start",
+    "Shift End",
+    "First In",
+    "Last Out",
+    "Presence (h)",
+    "Late (min)",
+    "Early Departure (min)",
+    "Records",
+]
+
+PRESENCE_COLUMNS = [
+    "date",
+    "person_name",
+    "person_group",
+    "first_in",
+    "last_out",
+    "records",
+]
+
+
+def read_shifts(work_timetable_path):
+    """Shift start/end offsets per processed group from the work timetable.
+
+    Returns a DataFrame indexed by processed group with ``start`` and ``end``
+    as Timedeltas from midnight; shifts ending at or before their start end
+    on the next day. Groups with unparseable times are left out.
+    """
+    timetable = load_work_timetable(work_timetable_path)
+    shifts = pd.DataFrame.from_dict(timetable, orient="index")
+    shifts = shifts[["start_time", "end_time"]].dropna()
+    shifts.index = process_person_groups(pd.Series(shifts.index)).astype(str).to_numpy()
+    # Several full paths can share a last segment; the first row wins
+    shifts = shifts[~shifts.index.duplicated(keep="first")]
+
+    start = pd.to_timedelta(shifts["start_time"].astype(str))
+    end = pd.to_timedelta(shifts["end_time"].astype(str))
+    end = end.where(end > start, end + pd.Timedelta(days=1))
+    return pd.DataFrame({"start": start, "end": end}, index=shifts.index)
+
+
+def crosses_midnight(shifts):
+    """Whether any shift of read_shifts ends on the day after it starts"""
+    return bool(len(shifts)) and bool((shifts["end"] >= pd.Timedelta(days=1)).any())
+
+
+def _spread(values, codes):
+    """Categorical of per-category ``values`` spread over the rows' ``codes``.
+
+    Python objects (dates, times) are built once per distinct value instead
+    of once per row.
+    """
+    value_codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    return pd.Categorical.from_codes(value_codes[codes], categories=uniques)
+
+
+def _time_of_day(offset):
+    if pd.isna(offset):
+        return None
+    return (pd.Timestamp(0) + offset % pd.Timedelta(days=1)).time()
+
+
+def _minutes(delta):
+    return (delta / pd.Timedelta(minutes=1)).round(0)
+
+
+def attendance_sheet(presence, shifts):
+    """Attendance rows: presence, lateness and early departure per person and day.
+
+    Lateness is the first event past the shift start and early departure the
+    last event before the shift end, both in minutes and 0 when on time.
+    People whose group has no shift in the timetable get presence only.
+    """
+    if presence.empty:
+        return pd.DataFrame(columns=ATTENDANCE_COLUMNS)
+
+    presence = presence.sort_values(["date", "person_name"], ignore_index=True)
+    day = pd.to_datetime(presence["date"])
+    first_in = pd.to_datetime(presence["first_in"])
+    last_out = pd.to_datetime(presence["last_out"])
+
+    # One lookup per distinct group, then spread over the rows by code
+    groups = process_person_groups(presence["person_group"])
+    categories = groups.cat.categories
+    codes = groups.cat.codes.to_numpy()
+    start = shifts["start"].reindex(categories)
+    end = shifts["end"].reindex(categories)
+
+    planned_start = day + pd.to_timedelta(start.to_numpy()[codes])
+    planned_end = day + pd.to_timedelta(end.to_numpy()[codes])
+    zero = pd.Timedelta(0)
+
+    day_codes, days = pd.factorize(day)
+
+    return pd.DataFrame(
+        {
+            "Date": _spread([d.date() for d in days], day_codes),
+            "Person": presence["person_name"].astype("category"),
+            "person_group": presence["person_group"].astype("category"),
+            "Shift Start": _spread([_time_of_day(t) for t in start], codes),
+            "Shift End": _spread([_time_of_day(t) for t in end], codes),
+            "First In": first_in,
+            "Last Out": last_out,
+            "Presence (h)": ((last_out - first_in) / pd.Timedelta(hours=1)).round(2),
+            "Late (min)": _minutes((first_in - planned_start).clip(lower=zero)),
+            "Early Departure (min)": _minutes(
+                (planned_end - last_out).clip(lower=zero)
+            ),
+            "Records": presence["records"].astype(np.int64),
+        }
+    )
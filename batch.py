@@ -0,0 +1,122 @@
+import argparse
+import os
+import re
+import shutil
+from datetime import datetime
+
+from filter import read_person_groups
+from pipeline import report_date_range
+
+BATCH_LAYOUTS = ("zip", "sheets")
+
+# Filter.apply_filters keys a batch filter set may use
+FILTER_KEYS = ("device_name", "person_group", "person_group_excel")
+
+# Characters Excel does not allow in sheet names, plus path separators
+INVALID_NAME_CHARS = re.compile(r'[\[\]:*?/\\<>|"]')
+
+MAX_SHEET_TITLE = 31
+
+
+def filter_sets(departments=(), sets=()):
+    """Batch filter sets: dicts with a unique ``name`` plus Filter keys.
+
+    ``departments`` are person_group values, each its own set; ``sets``
+    are dicts of FILTER_KEYS with an optional name. Raises ValueError with a
+    user message for an empty batch or a set without filters.
+    """
+    result = [{"name": d, "person_group": d} for d in departments if str(d).strip()]
+    for filter_set in sets:
+        filters = {k: filter_set[k] for k in FILTER_KEYS if filter_set.get(k)}
+        if not filters:
+            raise ValueError(f"Пустой набор фильтров: {filter_set}")
+        name = filter_set.get("name") or " ".join(str(v) for v in filters.values())
+        result.append(dict(filters, name=str(name)))
+    if not result:
+        raise ValueError("Не указаны отделы или наборы фильтров.")
+
+    names = set()
+    for filter_set in result:
+        if filter_set["name"] in names:
+            raise ValueError(f"Повторяющееся имя в пакете: {filter_set['name']}")
+        names.add(filter_set["name"])
+    return result
+
+
+def fetch_filters(sets):
+    """Filters for the single batch fetch: the union of the sets where it is exact"""
+    if all(set(s) == {"name", "person_group"} for s in sets):
+        return {"person_groups": sorted({s["person_group"] for s in sets})}
+    return None
+
+
+def unique_titles(names, max_length=MAX_SHEET_TITLE, reserved=()):
+    """Excel-safe, unique titles (sheet names or file stems) for ``names``"""
+    used = {r.lower() for r in reserved}
+    titles = []
+    for name in names:
+        base = INVALID_NAME_CHARS.sub("_", str(name)).strip().strip("'") or "_"
+        title = base[:max_length]
+        suffix = 1
+        while title.lower() in used:
+            suffix += 1
+            tail = f" ({suffix})"
+            title = base[: max_length - len(tail)] + tail
+        used.add(title.lower())
+        titles.append(title)
+    return titles
+
+
+def main(argv=None):
+    from report_generator import ReportGenerator
+
+    parser = argparse.ArgumentParser(
+        description="Generate one report per department from a single fetch"
+    )
+    parser.add_argument("report_type")
+    parser.add_argument("--start", help="YYYY-MM-DD, for custom reports")
+    parser.add_argument("--end", help="YYYY-MM-DD, for custom reports")
+    parser.add_argument(
+        "--department", action="append", default=[], help="person_group, repeatable"
+    )
+    parser.add_argument(
+        "--departments-file", help="Excel file with a person_group column"
+    )
+    parser.add_argument("--layout", choices=BATCH_LAYOUTS, default="zip")
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--workers", type=int, default=None, help="render processes")
+    parser.add_argument("--output", help="where to copy the zip or workbook")
+    args = parser.parse_args(argv)
+
+    departments = list(args.department)
+    if args.departments_file:
+        departments.extend(read_person_groups(args.departments_file))
+    try:
+        start_date, end_date = report_date_range(
+            args.report_type, datetime.now().date(), args.start, args.end
+        )
+        sets = filter_sets(departments)
+    except ValueError as e:
+        parser.error(str(e))
+
+    generator = ReportGenerator({"url": args.url}, parallel_workers=args.workers)
+    generator.cleanup_delay = None
+    try:
+        output_file = generator.generate_report(
+            args.report_type,
+            start_date,
+            end_date,
+            {"batch": sets, "batch_layout": args.layout},
+        )
+    finally:
+        if args.workers:
+            generator.partition_pool().shutdown()
+
+    if args.output:
+        shutil.copyfile(output_file, args.output)
+        output_file = args.output
+    print(f"{len(sets)} reports written to {os.path.abspath(output_file)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Time the attendance engine on synthetic employees × days.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_attendance --people 100000 --days 90
+    python -m benchmarks.bench_attendance --engine sessions
+
+"daily" groups events by calendar day; "sessions" pairs entry/exit scans
+into shifts (sessions.build_sessions) and matches them with merge_asof.
+
+Events are generated directly in the compact frame layout (categoricals and
+one datetime64 column), as ReportGenerator.fetch_data returns them.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from attendance import PRESENCE_COLUMNS, attendance_sheet
+from sessions import build_sessions, match_shifts, session_presence
+
+
+def make_events(people, days, events_per_day=4, groups=300, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = people * days * events_per_day
+    person = np.tile(np.repeat(np.arange(people), events_per_day), days)
+    day = np.repeat(np.arange(days), people * events_per_day)
+    # Arrivals around 08:00-10:00, departures around 16:00-19:00
+    arrival = rng.integers(8 * 3600, 10 * 3600, rows)
+    departure = rng.integers(16 * 3600, 19 * 3600, rows)
+    second = np.where(np.arange(rows) % events_per_day == 0, arrival, departure)
+    stamps = np.datetime64("2025-01-01") + (day * 86400 + second).astype("timedelta64[s]")
+
+    person_names = [f"Сотрудник {i}" for i in range(people)]
+    group_names = [f"Компания > Отдел {i % 40} > Должность {i}" for i in range(groups)]
+    return pd.DataFrame(
+        {
+            "date_and_time": stamps,
+            "reader_name": pd.Categorical.from_codes(
+                (np.arange(rows) % events_per_day != 0).astype(np.int8),
+                categories=["Reader In", "Reader Out"],
+            ),
+            "person_name": pd.Categorical.from_codes(person, categories=person_names),
+            "person_group": pd.Categorical.from_codes(
+                person % groups, categories=group_names
+            ),
+        }
+    )
+
+
+def make_shifts(groups=300):
+    index = [f"Должность {i}" for i in range(groups)]
+    return pd.DataFrame(
+        {"start": pd.Timedelta(hours=9), "end": pd.Timedelta(hours=18)}, index=index
+    )
+
+
+def daily_presence(events):
+    """First/last event and event count per person and calendar day.
+
+    The in-memory baseline the sessions engine is measured against; partial
+    results of consecutive chunks are merged with combine_presence.
+    """
+    events = events[events["person_name"].notna()]
+    if events.empty:
+        return pd.DataFrame(columns=PRESENCE_COLUMNS)
+
+    presence = (
+        events.assign(date=events["date_and_time"].dt.normalize())
+        .groupby(["date", "person_name"], observed=True, sort=False)
+        .agg(
+            person_group=("person_group", "first"),
+            first_in=("date_and_time", "min"),
+            last_out=("date_and_time", "max"),
+            records=("date_and_time", "size"),
+        )
+        .reset_index()
+    )
+    return presence[PRESENCE_COLUMNS]
+
+
+def combine_presence(partials):
+    """Merge daily_presence results of consecutive chunks"""
+    partials = [p for p in partials if len(p)]
+    if not partials:
+        return pd.DataFrame(columns=PRESENCE_COLUMNS)
+    if len(partials) == 1:
+        return partials[0]
+
+    combined = pd.concat(partials, ignore_index=True)
+    combined["person_name"] = combined["person_name"].astype("category")
+    combined["person_group"] = combined["person_group"].astype("category")
+    return (
+        combined.groupby(["date", "person_name"], observed=True, sort=False)
+        .agg(
+            person_group=("person_group", "first"),
+            first_in=("first_in", "min"),
+            last_out=("last_out", "max"),
+            records=("records", "sum"),
+        )
+        .reset_index()[PRESENCE_COLUMNS]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--people", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--events-per-day", type=int, default=4)
+    parser.add_argument(
+        "--chunks", type=int, default=1, help="split events like a streamed fetch"
+    )
+    parser.add_argument("--engine", choices=["daily", "sessions"], default="daily")
+    args = parser.parse_args()
+
+    events = make_events(args.people, args.days, args.events_per_day)
+    shifts = make_shifts()
+    print(f"{len(events)} events, {args.people * args.days} person-days")
+
+    started = time.perf_counter()
+    if args.engine == "sessions":
+        presence = session_presence(match_shifts(build_sessions(events), shifts))
+    else:
+        bounds = np.linspace(0, len(events), args.chunks + 1).astype(int)
+        parts = [
+            daily_presence(events.iloc[start:stop])
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        presence = combine_presence(parts)
+    presence_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sheet = attendance_sheet(presence, shifts)
+    sheet_seconds = time.perf_counter() - started
+
+    print(
+        {
+            "events": len(events),
+            "attendance_rows": len(sheet),
+            "presence_seconds": round(presence_seconds, 3),
+            "sheet_seconds": round(sheet_seconds, 3),
+            "total_seconds": round(presence_seconds + sheet_seconds, 3),
+        }
+    )
+
+
+if __name__ == "__main__":
+    main()
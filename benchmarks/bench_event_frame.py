@@ -0,0 +1,65 @@
+"""Bytes per event of the fetched events frame, as fetched and compacted.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_event_frame --rows 100000 1000000
+
+"fetched" is the frame pandas builds from the driver rows (object strings,
+separate date and time columns); "compact" is event_frame.compact_events of it.
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from benchmarks.bench_excel_writers import make_events
+from event_frame import bytes_per_event, compact_events, expand_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        fetched = make_events(rows)
+        # Driver rows hold Python objects, not numpy datetimes
+        fetched["date_and_time"] = fetched["date_and_time"].astype(object)
+
+        started = time.perf_counter()
+        compact = compact_events(fetched.copy())
+        compact_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        expand_events(compact)
+        expand_seconds = time.perf_counter() - started
+
+        before = float(bytes_per_event(fetched))
+        after = float(bytes_per_event(compact))
+        results.append(
+            {
+                "rows": rows,
+                "fetched_bytes_per_event": round(before, 1),
+                "compact_bytes_per_event": round(after, 1),
+                "ratio": round(before / after, 1),
+                "compact_seconds": round(compact_seconds, 3),
+                "expand_seconds": round(expand_seconds, 3),
+            }
+        )
+        print(results[-1])
+        print(
+            pd.DataFrame(
+                {
+                    "fetched": fetched.memory_usage(deep=True, index=False) / rows,
+                    "compact": compact.memory_usage(deep=True, index=False) / rows,
+                }
+            ).round(1)
+        )
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
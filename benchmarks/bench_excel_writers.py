@@ -0,0 +1,119 @@
+"""Compare Excel writer backends on a synthetic "Detailed Data" sheet.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_excel_writers --rows 10000 100000 500000
+
+Each case runs in a fresh process so peak RSS is per backend.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from excel_writer import ExcelReportWriter
+
+
+def make_events(rows, seed=0):
+    """Events frame shaped like the result of ReportGenerator.fetch_data"""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2025-01-01T00:00:00")
+    stamps = np.sort(start + rng.integers(0, 90 * 86400, rows).astype("timedelta64[s]"))
+    stamps = pd.Series(stamps)
+    groups = [f"Компания > Отдел {i % 40} > Должность {i}" for i in range(300)]
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, rows + 1),
+            "date_and_time": stamps,
+            "date": stamps.dt.date,
+            "time": stamps.dt.time,
+            "device_name": rng.choice([f"Терминал {i}" for i in range(20)], rows),
+            "reader_name": rng.choice(["Reader In", "Reader Out"], rows),
+            "person_name": rng.choice([f"Сотрудник {i}" for i in range(5000)], rows),
+            "person_group": rng.choice(groups, rows),
+        }
+    )
+
+
+def write_legacy(df, path):
+    """The original writer: pandas + openpyxl, then a pass over every cell"""
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        df.to_excel(writer, sheet_name="Detailed Data", index=False)
+        for sheet_name in writer.sheets:
+            worksheet = writer.sheets[sheet_name]
+            for col in worksheet.columns:
+                max_length = 0
+                column = col[0].column_letter
+                for cell in col:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(cell.value)
+                    except:
+                        pass
+                worksheet.column_dimensions[column].width = max_length + 2
+
+
+def write_backend(backend):
+    def write(df, path):
+        with ExcelReportWriter(path, backend) as writer:
+            writer.write_frame("Detailed Data", df, wide_columns=3)
+
+    return write
+
+
+WRITERS = {
+    "legacy": write_legacy,
+    "openpyxl": write_backend("openpyxl"),
+    "xlsxwriter": write_backend("xlsxwriter"),
+}
+
+
+def run_case(name, rows, queue):
+    df = make_events(rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "report.xlsx")
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        WRITERS[name](df, path)
+        elapsed = time.perf_counter() - started
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put(
+            {
+                "writer": name,
+                "rows": rows,
+                "seconds": round(elapsed, 3),
+                "peak_rss_mb": round(peak_rss / 1024, 1),
+                "rss_growth_mb": round((peak_rss - baseline_rss) / 1024, 1),
+                "file_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+            }
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--writers", nargs="+", default=list(WRITERS), choices=list(WRITERS))
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for rows in args.rows:
+        for name in args.writers:
+            queue = context.Queue()
+            process = context.Process(target=run_case, args=(name, rows, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+            print(results[-1])
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Time serial vs partitioned parallel report generation on a SQLite stand-in.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parallel --people 2000 --days 28 --workers 1 2 4 8
+    python -m benchmarks.bench_parallel --store
+
+Workers fetch and pre-aggregate date partitions (see partitions.py); the
+workbook is still written by one process, so with the Detailed Data sheet
+the render stage bounds the speedup.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from event_store import EventStore
+from excel_writer import ExcelReportWriter
+from pipeline import StageTimings
+from report_generator import ReportGenerator
+
+START_DATE = date(2025, 1, 1)
+
+
+def make_database(path, people, days, events_per_day=4, groups=300, seed=0):
+    """``users`` table with an entry and exit scan pair per person and shift half"""
+    rng = np.random.default_rng(seed)
+    rows = people * days * events_per_day
+    person = np.tile(np.repeat(np.arange(people), events_per_day), days)
+    day = np.repeat(np.arange(days), people * events_per_day)
+    arrival = rng.integers(8 * 3600, 10 * 3600, rows)
+    departure = rng.integers(16 * 3600, 19 * 3600, rows)
+    entry = np.arange(rows) % 2 == 0
+    second = np.where(entry, arrival, departure)
+    stamps = pd.to_datetime(
+        np.datetime64(START_DATE) + (day * 86400 + second).astype("timedelta64[s]")
+    )
+
+    events = pd.DataFrame(
+        {
+            "id": np.arange(1, rows + 1),
+            "date_and_time": stamps.strftime("%Y-%m-%d %H:%M:%S"),
+            "date": stamps.strftime("%Y-%m-%d"),
+            "time": stamps.strftime("%H:%M:%S"),
+            "device_name": [f"Турникет {i % 12}" for i in person],
+            "reader_name": np.where(entry, "Reader In", "Reader Out"),
+            "person_name": [f"Сотрудник {i}" for i in person],
+            "person_group": [
+                f"Компания > Отдел {i % 40} > Должность {i % groups}" for i in person
+            ],
+        }
+    ).sort_values("date_and_time", kind="stable")
+
+    conn = sqlite3.connect(path)
+    events.to_sql("users", conn, index=False)
+    conn.execute("CREATE INDEX users_date ON users (date)")
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def make_timetable(path, groups=300):
+    timetable = pd.DataFrame(
+        {
+            "person_group": [f"Должность {i}" for i in range(0, groups, 2)],
+            "start_time": "9-00",
+            "end_time": "18-00",
+        }
+    )
+    with ExcelReportWriter(path) as writer:
+        writer.write_frame("Timetable", timetable)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--people", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--partition-days", type=int, default=7)
+    parser.add_argument(
+        "--store", action="store_true", help="read closed days from the event store"
+    )
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "events.db")
+        rows = make_database(db_path, args.people, args.days)
+        timetable = os.path.join(tmp, "timetable.xlsx")
+        make_timetable(timetable)
+        db_config = {"url": f"sqlite:///{db_path}"}
+        end_date = START_DATE + timedelta(days=args.days - 1)
+
+        store = None
+        if args.store:
+            store = EventStore(os.path.join(tmp, "store"))
+            generator = ReportGenerator(db_config)
+            store.sync(generator.engine, max_days=args.days + 1)
+
+        for workers in args.workers:
+            generator = ReportGenerator(
+                db_config,
+                event_store=store,
+                parallel_workers=workers,
+                partition_days=args.partition_days,
+            )
+            generator.output_dir = os.path.join(tmp, f"reports_{workers}")
+            generator.cleanup_delay = None
+            if workers > 1:
+                # Start the pool outside the timed run
+                list(generator.partition_pool().executor.map(int, range(workers)))
+
+            timings = StageTimings()
+            started = time.perf_counter()
+            generator.generate_report(
+                "custom",
+                START_DATE,
+                end_date,
+                {"work_timetable": timetable},
+                timings=timings,
+            )
+            elapsed = time.perf_counter() - started
+            if workers > 1:
+                generator.partition_pool().shutdown()
+
+            stages = timings.as_dict()["stages"]
+            results.append(
+                {
+                    "workers": workers,
+                    "events": rows,
+                    "seconds": round(elapsed, 2),
+                    "render_s": round(stages.get("render", 0.0), 2),
+                    "worker_cpu_s": round(
+                        sum(v for k, v in stages.items() if k.startswith("partition_")),
+                        2,
+                    ),
+                }
+            )
+            print(results[-1])
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare per-row and vectorized person group processing and timetable matching.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_person_groups --rows 1000000 10000000
+
+"legacy" is the original ``apply`` over every row followed by one boolean
+scan per unmatched group; "vectorized" is utils.process_person_groups with a
+single ``value_counts``.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import group_value_counts, process_person_group, process_person_groups
+
+
+def make_groups(rows, seed=0, distinct=300):
+    """person_group column shaped like the events table"""
+    rng = np.random.default_rng(seed)
+    groups = [f"Компания > Отдел {i % 40} > Должность {i} " for i in range(distinct)]
+    groups.append(None)
+    return pd.Series(rng.choice(np.array(groups, dtype=object), rows))
+
+
+def timetable_groups(distinct=300):
+    # Half the groups are in the timetable, the rest end up on "Unmatched Groups"
+    return {f"Должность {i}" for i in range(0, distinct, 2)}
+
+
+def match_legacy(groups, timetable):
+    processed = groups.apply(process_person_group)
+    matched = processed[processed.isin(timetable)]
+    unmatched = sorted(set(processed.unique()) - timetable)
+    counts = [len(processed[processed == group]) for group in unmatched]
+    return len(matched), dict(zip(unmatched, counts))
+
+
+def match_vectorized(groups, timetable):
+    processed = process_person_groups(groups)
+    counts = group_value_counts(processed)
+    matched = int(counts[counts.index.isin(timetable)].sum())
+    unmatched = sorted(set(counts.index) - timetable)
+    return matched, {group: int(counts[group]) for group in unmatched}
+
+
+MATCHERS = {
+    "legacy": match_legacy,
+    "vectorized": match_vectorized,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument(
+        "--matchers", nargs="+", default=list(MATCHERS), choices=list(MATCHERS)
+    )
+    args = parser.parse_args()
+
+    timetable = timetable_groups()
+    results = []
+    for rows in args.rows:
+        groups = make_groups(rows)
+        outputs = {}
+        for name in args.matchers:
+            started = time.perf_counter()
+            outputs[name] = MATCHERS[name](groups, timetable)
+            elapsed = time.perf_counter() - started
+            results.append(
+                {
+                    "matcher": name,
+                    "rows": rows,
+                    "seconds": round(elapsed, 3),
+                    "rows_per_second": int(rows / elapsed),
+                }
+            )
+            print(results[-1])
+
+        if len(outputs) > 1 and len({repr(o) for o in outputs.values()}) != 1:
+            raise AssertionError(f"Matchers disagree at {rows} rows")
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
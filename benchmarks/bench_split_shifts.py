@@ -0,0 +1,125 @@
+"""Compare the original and vectorized work_shift_separator.split_shifts.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_split_shifts --rows 10000 100000
+
+Each case runs in a fresh process so peak RSS is per implementation.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from excel_writer import ExcelReportWriter
+from work_shift_separator import split_shifts, split_shifts_streaming
+
+
+def make_timetable(rows, seed=0, shift2_share=0.3):
+    """Timetable where about ``shift2_share`` of the rows are shift 2 continuations"""
+    rng = np.random.default_rng(seed)
+    shift2 = rng.random(rows) < shift2_share
+    shift2[0] = False
+    groups = np.array([f"Должность {i % 500}" for i in range(rows)], dtype=object)
+    groups[shift2] = None
+    numbers = np.arange(1, rows + 1, dtype=float)
+    numbers[shift2] = np.nan
+    return pd.DataFrame(
+        {
+            "number": numbers,
+            "person_group": groups,
+            "start_time": rng.choice(["8-00", "9-00", "20-00"], rows),
+            "end_time": rng.choice(["17-00", "18-00", "8-00"], rows),
+        }
+    )
+
+
+def split_legacy(input_file, output_file):
+    """The original implementation: iterrows and per-row copies"""
+    df = pd.read_excel(input_file)
+    shift1_records = []
+    shift2_records = []
+    prev_row = None
+    for idx, row in df.iterrows():
+        if pd.isna(row["person_group"]) and prev_row is not None:
+            shift2_row = row.copy()
+            shift2_row["number"] = prev_row["number"]
+            shift2_row["person_group"] = prev_row["person_group"]
+            shift2_records.append(shift2_row)
+        else:
+            shift1_records.append(row)
+            prev_row = row
+
+    shift1_df = pd.DataFrame(shift1_records)
+    shift2_df = pd.DataFrame(shift2_records)
+    with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
+        shift1_df.to_excel(writer, sheet_name="Shift 1", index=False)
+        if not shift2_df.empty:
+            shift2_df.to_excel(writer, sheet_name="Shift 2", index=False)
+
+
+SPLITTERS = {
+    "legacy": split_legacy,
+    "vectorized": split_shifts,
+    "streaming": split_shifts_streaming,
+}
+
+
+def run_case(name, input_file, rows, queue):
+    if name == "legacy":
+        # Row-wise copies break on pandas' string dtype
+        pd.set_option("future.infer_string", False)
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "output.xlsx")
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        SPLITTERS[name](input_file, output_file)
+        elapsed = time.perf_counter() - started
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put(
+            {
+                "splitter": name,
+                "rows": rows,
+                "seconds": round(elapsed, 3),
+                "rss_growth_mb": round((peak_rss - baseline_rss) / 1024, 1),
+            }
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument(
+        "--splitters", nargs="+", default=list(SPLITTERS), choices=list(SPLITTERS)
+    )
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            input_file = os.path.join(tmp, f"timetable_{rows}.xlsx")
+            with ExcelReportWriter(input_file) as writer:
+                writer.write_frame("Timetable", make_timetable(rows))
+
+            for name in args.splitters:
+                queue = context.Queue()
+                process = context.Process(
+                    target=run_case, args=(name, input_file, rows, queue)
+                )
+                process.start()
+                results.append(queue.get())
+                process.join()
+                print(results[-1])
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Time the report pipeline end to end on synthetic event tables and save JSON.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_suite --events 10000 1000000 --output bench.json
+    python -m benchmarks.bench_suite --events 10000000 --cases fetch_data generate_csv
+    python -m benchmarks.bench_suite --baseline main.json --tolerance 0.2
+
+Tables come from benchmarks.synthetic and are cached as SQLite files in
+--data-dir, so repeated runs time the same rows. With --url the table
+is loaded into that database (a scratch Postgres) instead. Each case
+runs in a fresh process; peak_rss_bytes is the process's peak during
+the case. With --baseline, cases slower or bigger than the baseline by
+more than --tolerance are listed and the exit status is 1.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.synthetic import (
+    GENERATOR_VERSION,
+    employees_for,
+    event_range,
+    iter_events,
+    load_events,
+    make_split_input,
+    make_timetable,
+    make_workforce,
+    sqlite_database,
+)
+from excel_writer import MAX_ROWS
+
+# Rows an xlsx sheet holds below its header
+EXCEL_MAX_ROWS = MAX_ROWS - 1
+
+CASES = (
+    "fetch_data",
+    "generate_excel",
+    "generate_custom_excel",
+    "generate_csv",
+    "split_shifts",
+)
+
+# Cases whose Detailed Data sheet holds every fetched row
+EXCEL_CASES = ("generate_excel", "generate_custom_excel")
+
+
+def run_case(case, db_config, start_date, end_date, files, queue):
+    """Child process entry point: run one case and put its result on the queue"""
+    from db import get_engine
+    from metrics import peak_rss_bytes, reset_peak_rss
+    from pipeline import StageTimings
+    from report_generator import ReportGenerator
+    from work_shift_separator import split_shifts
+
+    result = {"case": case}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            generator = ReportGenerator(db_config)
+            generator.output_dir = tmp
+            generator.cleanup_delay = None
+            get_engine(db_config)
+            timings = StageTimings()
+
+            reset_peak_rss()
+            started = time.perf_counter()
+            if case == "fetch_data":
+                data = generator.fetch_data(
+                    start_date, end_date, chunksize=generator.chunksize
+                )
+                if generator.chunksize:
+                    result["rows"] = sum(len(chunk) for chunk in data)
+                else:
+                    result["rows"] = len(data)
+            elif case == "split_shifts":
+                shift1, shift2 = split_shifts(
+                    files["split_input"], os.path.join(tmp, "split.xlsx")
+                )
+                result["rows"] = shift1 + shift2
+            else:
+                params = {
+                    "generate_excel": {},
+                    "generate_custom_excel": {"work_timetable": files["timetable"]},
+                    "generate_csv": {"output_format": "csv"},
+                }[case]
+                generator.generate_report(
+                    "custom", start_date, end_date, params, timings=timings
+                )
+                counters = timings.as_dict()["counters"]
+                result["rows"] = counters.get("rows_fetched", 0)
+                result["output_bytes"] = counters.get("output_bytes", 0)
+                result["stages"] = timings.as_dict()["stages"]
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            result["peak_rss_bytes"] = peak_rss_bytes()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    queue.put(result)
+
+
+def prepare(args, events, work_dir):
+    """Database config, date range and input files for one table size"""
+    from db import get_engine
+
+    if args.url:
+        db_config = {"url": args.url}
+        if not args.skip_load:
+            workforce = make_workforce(employees_for(events), args.seed)
+            load_events(
+                get_engine(db_config),
+                iter_events(workforce, events, args.seed),
+                replace=args.replace,
+            )
+    else:
+        path = sqlite_database(args.data_dir, events, args.seed)
+        db_config = {"url": f"sqlite:///{path}"}
+    if args.chunksize:
+        db_config["fetch_chunksize"] = args.chunksize
+
+    start_date, end_date = event_range(get_engine(db_config))
+    workforce = make_workforce(employees_for(events), args.seed)
+    files = {
+        "timetable": os.path.join(work_dir, f"timetable_{events}.xlsx"),
+        "split_input": os.path.join(work_dir, f"split_input_{events}.xlsx"),
+    }
+    make_timetable(files["timetable"], workforce, seed=args.seed)
+    make_split_input(files["split_input"], workforce, seed=args.seed)
+    return db_config, start_date, end_date, files
+
+
+def environment():
+    """Where the numbers were taken, for comparing runs"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "generator_version": GENERATOR_VERSION,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """(case, events, metric, old, new) rows where results exceed the baseline"""
+    previous = {
+        (r["case"], r["events"]): r for r in baseline["results"] if "seconds" in r
+    }
+    found = []
+    for result in results:
+        old = previous.get((result["case"], result["events"]))
+        if old is None or "seconds" not in result:
+            continue
+        for metric in ("seconds", "peak_rss_bytes"):
+            if result[metric] > old[metric] * (1 + tolerance):
+                found.append(
+                    (result["case"], result["events"], metric, old[metric], result[metric])
+                )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, nargs="+", default=[10000, 1000000])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "attendance-benchmarks"),
+        help="where generated SQLite tables are cached",
+    )
+    parser.add_argument("--url", help="load into this scratch database instead of SQLite")
+    parser.add_argument(
+        "--replace", action="store_true", help="drop an existing users table at --url"
+    )
+    parser.add_argument(
+        "--skip-load", action="store_true", help="use the users table already at --url"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=None, help="stream fetches in chunks of this many rows"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.url and len(args.events) > 1 and args.skip_load:
+        parser.error("--skip-load takes a single --events size")
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for events in args.events:
+            started = time.perf_counter()
+            db_config, start_date, end_date, files = prepare(args, events, work_dir)
+            print(
+                f"{events} events, {start_date} to {end_date}, "
+                f"ready in {time.perf_counter() - started:.1f}s"
+            )
+
+            for case in args.cases:
+                if case in EXCEL_CASES and events > EXCEL_MAX_ROWS:
+                    result = {"case": case, "skipped": "over the xlsx sheet row limit"}
+                else:
+                    queue = context.Queue()
+                    process = context.Process(
+                        target=run_case,
+                        args=(case, db_config, start_date, end_date, files, queue),
+                    )
+                    process.start()
+                    result = queue.get()
+                    process.join()
+                result["events"] = events
+                results.append(result)
+                print(result)
+
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print()
+    print(
+        pd.DataFrame(results)
+        .reindex(columns=["case", "events", "rows", "seconds", "peak_rss_bytes", "error"])
+        .to_string(index=False)
+    )
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for case, events, metric, old, new in found:
+            print(f"REGRESSION {case} at {events} events: {metric} {old} -> {new}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
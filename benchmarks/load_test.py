@@ -0,0 +1,189 @@
+"""Load test a running report server: requests/sec and latency under concurrent users.
+
+Start the server under test, then run from the repository root:
+
+    python app.py                                            # Flask, port 5000
+    uvicorn asgi:application --port 8000 --workers 2          # ASGI entry point
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 \\
+        --start 2025-01-06 --end 2025-01-31 --users 50 --duration 30
+
+Each user repeats its requests back to back over one keep-alive
+connection for --duration seconds. In the "mixed" scenario users are
+split between streamed CSV reports, job downloads, the live daily
+snapshot and job status polls, so the status and live latencies show
+how much the heavy requests hold up the cheap ones. A finished xlsx
+job over the range is created first for the download requests.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import pandas as pd
+
+SCENARIOS = ("mixed", "csv", "download", "live", "status")
+
+# Request kinds of the mixed scenario, assigned to users round robin
+MIXED = ("csv", "download", "live", "status", "status")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+class Server:
+    """Requests against the server under test, one keep-alive connection per user"""
+
+    def __init__(self, url, timeout=300):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+
+    def connection(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, conn, method, path, body=None):
+        """(status, body bytes) of one request; the body is read to the end"""
+        headers = {}
+        if body is not None:
+            body = urlencode(body)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+
+
+def prepare_job(server, start_date, end_date):
+    """Download path of a finished xlsx job over the range"""
+    conn = server.connection()
+    status, body = server.request(
+        conn,
+        "POST",
+        "/generate",
+        {"report_type": "custom", "start_date": start_date, "end_date": end_date},
+    )
+    job = json.loads(body)
+    if status >= 400:
+        raise RuntimeError(f"Job not created: {job}")
+    while job["status"] in ("queued", "running"):
+        time.sleep(1)
+        job = json.loads(server.request(conn, "GET", job["status_url"])[1])
+    if job["status"] != "done":
+        raise RuntimeError(f"Job {job['job_id']} {job['status']}: {job.get('error')}")
+    conn.close()
+    return job
+
+
+def user_loop(server, kind, paths, deadline, results):
+    """Repeat one kind of request until the deadline, appending (kind, status, s, bytes)"""
+    conn = server.connection()
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, body = server.request(conn, "GET", paths[kind])
+                size = len(body)
+            except (OSError, http.client.HTTPException):
+                status, size = None, 0
+                conn.close()
+                conn = server.connection()
+            results.append((kind, status, time.perf_counter() - started, size))
+    finally:
+        conn.close()
+
+
+def summarize(results, seconds):
+    """Per request kind: count, errors, requests/sec, latency percentiles and MB"""
+    rows = []
+    kinds = sorted({kind for kind, _, _, _ in results})
+    for kind in kinds + ["all"]:
+        selected = [r for r in results if kind in ("all", r[0])]
+        latencies = sorted(r[2] * 1000 for r in selected)
+        rows.append(
+            {
+                "kind": kind,
+                "requests": len(selected),
+                "errors": sum(1 for r in selected if r[1] is None or r[1] >= 400),
+                "rps": round(len(selected) / seconds, 2),
+                "p50_ms": round(percentile(latencies, 50), 1),
+                "p95_ms": round(percentile(latencies, 95), 1),
+                "p99_ms": round(percentile(latencies, 99), 1),
+                "max_ms": round(latencies[-1], 1),
+                "mb": round(sum(r[3] for r in selected) / 1024**2, 1),
+            }
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="server under test")
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD, first day of the reports")
+    parser.add_argument("--end", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--scenario", default="mixed", choices=SCENARIOS)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--output", help="write the summary and settings as JSON")
+    args = parser.parse_args(argv)
+
+    server = Server(args.url)
+    kinds = MIXED if args.scenario == "mixed" else (args.scenario,)
+    paths = {
+        "csv": "/reports/stream?"
+        + urlencode(
+            {
+                "report_type": "custom",
+                "start_date": args.start,
+                "end_date": args.end,
+                "output_format": "csv",
+            }
+        ),
+        "live": "/live/daily",
+    }
+    if "download" in kinds or "status" in kinds:
+        job = prepare_job(server, args.start, args.end)
+        paths["download"] = job["download_url"]
+        paths["status"] = job["status_url"]
+
+    results = []
+    deadline = time.perf_counter() + args.duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=user_loop,
+            args=(server, kinds[i % len(kinds)], paths, deadline, results),
+        )
+        for i in range(args.users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Requests in flight at the deadline finish, so the run is a bit longer
+    elapsed = time.perf_counter() - started
+
+    if not results:
+        parser.error("no request finished; is the server running?")
+    rows = summarize(results, elapsed)
+    print(
+        f"{args.url}, {args.scenario}, {args.users} users, {elapsed:.1f}s, "
+        f"{args.start} to {args.end}"
+    )
+    print(pd.DataFrame(rows).to_string(index=False))
+    if args.output:
+        settings = {k: v for k, v in vars(args).items() if k != "output"}
+        settings["elapsed"] = round(elapsed, 3)
+        with open(args.output, "w") as f:
+            json.dump({"settings": settings, "results": rows}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Synthetic Hikvision access events, timetables and ``users`` tables for benchmarks.
+
+The workforce is a company tree of "Компания > Отдел > Должность" groups
+with uneven department sizes. Positions work a day, early or night
+(20:00-08:00, across midnight) shift. Events are entry/exit scans at
+turnstiles near each person's own entrance:
+
+- day and early shifts skip most weekends;
+- night shifts work two nights on, two off;
+- some days have a lunch exit and re-entry, a double scan or a missing
+  exit.
+
+Everything is drawn from a seeded generator, so the same arguments give
+the same table.
+"""
+import io
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from excel_writer import ExcelReportWriter
+
+# Bump when the generated data changes so cached databases are rebuilt
+GENERATOR_VERSION = 2
+
+START_DATE = date(2025, 1, 6)
+
+# Shift name -> (start hour, length in hours)
+SHIFTS = {"day": (9, 9), "early": (7, 9), "night": (20, 12)}
+
+USERS_COLUMNS = [
+    "id",
+    "date_and_time",
+    "date",
+    "time",
+    "device_name",
+    "reader_name",
+    "person_name",
+    "person_group",
+]
+
+USERS_DDL = {
+    "sqlite": """
+        CREATE TABLE users (
+            id INTEGER, date_and_time TEXT, date TEXT, time TEXT,
+            device_name TEXT, reader_name TEXT, person_name TEXT, person_group TEXT
+        )
+    """,
+    "postgresql": """
+        CREATE TABLE users (
+            id BIGINT, date_and_time TIMESTAMP, date DATE, time TIME,
+            device_name TEXT, reader_name TEXT, person_name TEXT, person_group TEXT
+        )
+    """,
+}
+
+# Created after loading, which is faster than maintaining them row by row
+USERS_INDEXES = [
+    "CREATE UNIQUE INDEX users_id ON users (id)",
+    "CREATE INDEX users_date ON users (date)",
+]
+
+
+def make_workforce(employees, seed=0):
+    """One row per employee: name, group path, position, shift and home entrance"""
+    rng = np.random.default_rng(seed)
+    departments = max(5, employees // 60)
+    positions_per_department = 12
+    devices = max(4, departments // 3)
+
+    # A few large departments and a long tail of small ones
+    weights = 1 / np.arange(1, departments + 1) ** 0.8
+    department = rng.choice(departments, employees, p=weights / weights.sum())
+    # Most people hold one of the first positions of their department
+    position = np.minimum(
+        rng.geometric(0.3, employees) - 1, positions_per_department - 1
+    )
+    company = department % 3
+
+    # Shifts are a property of the position alone, as in the work timetable,
+    # which has one row per position whatever the department
+    position_shift = rng.choice(
+        list(SHIFTS), positions_per_department, p=[0.7, 0.15, 0.15]
+    )
+    shift = position_shift[position]
+
+    workforce = pd.DataFrame(
+        {
+            "person_name": [f"Сотрудник {i:06d}" for i in range(employees)],
+            "person_group": [
+                f"Компания {c + 1} > Отдел {d + 1} > Должность {p + 1}"
+                for c, d, p in zip(company, department, position)
+            ],
+            "position": [f"Должность {p + 1}" for p in position],
+            "shift": shift,
+            "home_device": department % devices,
+            "rotation": rng.integers(0, 4, employees),
+        }
+    )
+    workforce.attrs["devices"] = devices
+    return workforce
+
+
+def _jitter(rng, size, minutes):
+    return (rng.normal(0, minutes * 60, size)).astype("int64")
+
+
+def _day_events(workforce, days, first_day_index, rng):
+    """Scans of the given consecutive days as (person, second offset, is_entry)"""
+    people = len(workforce)
+    shift = workforce["shift"].to_numpy()
+    weekday = np.array([d.weekday() for d in days])
+    day_index = first_day_index + np.arange(len(days))
+
+    # person x day grid of worked shifts
+    weekend = weekday >= 5
+    present = rng.random((people, len(days)))
+    works = np.where(weekend[None, :], present < 0.05, present < 0.93)
+    night = shift == "night"
+    rotation = (day_index[None, :] + workforce["rotation"].to_numpy()[:, None]) % 4 < 2
+    works[night] = rotation[night] & (present[night] < 0.95)
+
+    person, day = np.nonzero(works)
+    start_hour = np.array([SHIFTS[s][0] for s in shift])[person]
+    length = np.array([SHIFTS[s][1] for s in shift])[person]
+    day_start = day.astype("int64") * 86400
+    n = len(person)
+
+    entry = day_start + start_hour * 3600 + _jitter(rng, n, 12)
+    exit_ = entry + length * 3600 + _jitter(rng, n, 20)
+    parts = [(person, entry, True)]
+
+    has_exit = rng.random(n) >= 0.03
+    parts.append((person[has_exit], exit_[has_exit], False))
+
+    lunch = rng.random(n) < 0.35
+    lunch_out = entry[lunch] + 4 * 3600 + _jitter(rng, lunch.sum(), 30)
+    lunch_back = lunch_out + rng.integers(30 * 60, 60 * 60, lunch.sum())
+    parts.append((person[lunch], lunch_out, False))
+    parts.append((person[lunch], lunch_back, True))
+
+    double = rng.random(n) < 0.04
+    parts.append((person[double], entry[double] + rng.integers(3, 40, double.sum()), True))
+
+    return (
+        np.concatenate([p for p, _, _ in parts]),
+        np.concatenate([s for _, s, _ in parts]),
+        np.concatenate([np.full(len(p), e) for p, _, e in parts]),
+    )
+
+
+def iter_events(workforce, events, seed=0, start_date=START_DATE, block_days=7):
+    """``users`` rows in blocks of ``block_days`` days until ``events`` rows are made.
+
+    Rows are in date_and_time order within a block; a night shift's exit
+    belongs to the block of its entry, like a scan stored late.
+    """
+    rng = np.random.default_rng(seed + 1)
+    devices = workforce.attrs["devices"]
+    device_names = [f"Турникет {i + 1}" for i in range(devices)]
+    readers = [f"{name} Вход" for name in device_names] + [
+        f"{name} Выход" for name in device_names
+    ]
+    person_names = workforce["person_name"].to_numpy()
+    person_groups = workforce["person_group"].to_numpy()
+    home = workforce["home_device"].to_numpy()
+
+    made = 0
+    first_day = 0
+    while made < events:
+        days = [start_date + timedelta(days=first_day + i) for i in range(block_days)]
+        person, seconds, is_entry = _day_events(workforce, days, first_day, rng)
+        order = np.argsort(seconds, kind="stable")[: events - made]
+        person, seconds, is_entry = person[order], seconds[order], is_entry[order]
+
+        # Mostly the home entrance, sometimes another one
+        device = np.where(
+            rng.random(len(person)) < 0.85,
+            home[person],
+            rng.integers(0, devices, len(person)),
+        )
+        stamps = pd.to_datetime(
+            np.datetime64(days[0]) + seconds.astype("timedelta64[s]")
+        )
+        reader = device + np.where(is_entry, 0, devices)
+        yield pd.DataFrame(
+            {
+                "id": np.arange(made + 1, made + len(person) + 1),
+                "date_and_time": stamps.strftime("%Y-%m-%d %H:%M:%S"),
+                "date": stamps.strftime("%Y-%m-%d"),
+                "time": stamps.strftime("%H:%M:%S"),
+                "device_name": np.array(device_names, dtype=object)[device],
+                "reader_name": np.array(readers, dtype=object)[reader],
+                "person_name": person_names[person],
+                "person_group": person_groups[person],
+            }
+        )
+        made += len(person)
+        first_day += block_days
+
+
+def employees_for(events):
+    """Workforce size for a table of ``events`` rows (about 4 scans a working day)"""
+    return int(min(20000, max(50, events // 500)))
+
+
+def make_timetable(path, workforce, coverage=0.8, seed=0):
+    """Work timetable (person_group, start_time, end_time) for most positions"""
+    rng = np.random.default_rng(seed + 2)
+    positions = workforce.drop_duplicates("position").sort_values("position")
+    positions = positions[rng.random(len(positions)) < coverage]
+    timetable = pd.DataFrame(
+        {
+            "person_group": positions["position"].to_numpy(),
+            "start_time": [f"{SHIFTS[s][0]}-00" for s in positions["shift"]],
+            "end_time": [
+                f"{(SHIFTS[s][0] + SHIFTS[s][1]) % 24}-00" for s in positions["shift"]
+            ],
+        }
+    )
+    with ExcelReportWriter(path) as writer:
+        writer.write_frame("Timetable", timetable)
+    return len(timetable)
+
+
+def make_split_input(path, workforce, seed=0):
+    """Personal timetable for work_shift_separator: one row per employee.
+
+    People on a rotating schedule get a second row without a person_group,
+    which split_shifts moves to the "Shift 2" sheet.
+    """
+    rng = np.random.default_rng(seed + 3)
+    rows = []
+    for number, person in enumerate(workforce.itertuples(index=False), start=1):
+        start, length = SHIFTS[person.shift]
+        rows.append(
+            (number, person.position, f"{start}-00", f"{(start + length) % 24}-00")
+        )
+        if person.shift == "night" or rng.random() < 0.1:
+            rows.append((None, None, "8-00", "20-00"))
+    frame = pd.DataFrame(rows, columns=["number", "person_group", "start_time", "end_time"])
+    with ExcelReportWriter(path) as writer:
+        writer.write_frame("Timetable", frame)
+    return len(frame)
+
+
+def _copy_postgres(engine, frame):
+    """Bulk load a frame with COPY (psycopg2 or psycopg 3)"""
+    buffer = io.StringIO()
+    frame[USERS_COLUMNS].to_csv(buffer, index=False, header=False)
+    statement = f"COPY users ({', '.join(USERS_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if hasattr(cursor, "copy_expert"):
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+        else:
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def load_events(engine, chunks, replace=False):
+    """Create ``users`` and load the chunks into it; returns the row count.
+
+    An existing table is only dropped with ``replace``, so pointing the
+    benchmark at a real database by mistake fails instead of wiping it.
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if inspect(conn).has_table("users"):
+            if not replace:
+                raise ValueError(
+                    "Table users already exists; use a scratch database or replace it"
+                )
+            conn.execute(text("DROP TABLE users"))
+        conn.execute(text(USERS_DDL.get(dialect, USERS_DDL["sqlite"])))
+
+    rows = 0
+    for chunk in chunks:
+        if dialect == "postgresql":
+            _copy_postgres(engine, chunk)
+        else:
+            with engine.begin() as conn:
+                chunk.to_sql("users", conn, if_exists="append", index=False)
+        rows += len(chunk)
+
+    with engine.begin() as conn:
+        for statement in USERS_INDEXES:
+            conn.execute(text(statement))
+        conn.execute(text("ANALYZE"))
+    return rows
+
+
+def sqlite_database(directory, events, seed=0):
+    """Path of a cached SQLite database with ``events`` synthetic rows, built if missing"""
+    from db import get_engine
+
+    path = os.path.join(
+        directory, f"events_{events}_seed{seed}_v{GENERATOR_VERSION}.sqlite3"
+    )
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.partial"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    workforce = make_workforce(employees_for(events), seed)
+    engine = get_engine({"url": f"sqlite:///{tmp_path}"})
+    load_events(engine, iter_events(workforce, events, seed))
+    engine.dispose()
+    os.replace(tmp_path, path)
+    return path
+
+
+def event_range(engine):
+    """First and last date of the loaded events"""
+    with engine.connect() as conn:
+        low, high = conn.execute(text("SELECT MIN(date), MAX(date) FROM users")).one()
+    return pd.Timestamp(low).date(), pd.Timestamp(high).date()
@@ -0,0 +1,278 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # optional, only the ASGI entry point needs it
+    create_async_engine = None
+
+from utils import cached_process_person_group
+
+# Pool settings used when the db config does not override them
+DEFAULT_POOL_OPTIONS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "statement_timeout": None,  # milliseconds, None disables it
+}
+
+# Async drivers standing in for the sync driver of each dialect
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+_engines = {}
+_async_engines = {}
+_engines_lock = threading.Lock()
+
+
+class DBMetrics:
+    """Thread-safe counters for pool checkout waits and query times"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_wait_total = 0.0
+            self.checkout_wait_max = 0.0
+            self.queries = 0
+            self.query_time_total = 0.0
+            self.query_time_max = 0.0
+
+    def record_checkout(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def record_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_time_total += seconds
+            self.query_time_max = max(self.query_time_max, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_wait_total": round(self.checkout_wait_total, 6),
+                "checkout_wait_avg": round(
+                    self.checkout_wait_total / self.checkouts, 6
+                )
+                if self.checkouts
+                else 0.0,
+                "checkout_wait_max": round(self.checkout_wait_max, 6),
+                "queries": self.queries,
+                "query_time_total": round(self.query_time_total, 6),
+                "query_time_avg": round(self.query_time_total / self.queries, 6)
+                if self.queries
+                else 0.0,
+                "query_time_max": round(self.query_time_max, 6),
+            }
+
+
+def connection_string(db_config):
+    """Build the SQLAlchemy URL for the db config"""
+    if db_config.get("url"):
+        return db_config["url"]
+    return f"postgresql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+
+
+def async_connection_string(db_config):
+    """The SQLAlchemy URL of the db config with its dialect's async driver"""
+    url = connection_string(db_config)
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+")[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {dialect}")
+    return f"{ASYNC_DRIVERS[dialect]}://{rest}"
+
+
+def pool_options(db_config):
+    """Merge pool settings from the db config over the defaults"""
+    options = dict(DEFAULT_POOL_OPTIONS)
+    for key in DEFAULT_POOL_OPTIONS:
+        if key in db_config:
+            options[key] = db_config[key]
+    return options
+
+
+def _engine_key(db_config):
+    options = pool_options(db_config)
+    return (os.getpid(), connection_string(db_config), tuple(sorted(options.items())))
+
+
+def _instrument(engine, metrics):
+    """Attach query timing listeners to the engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        metrics.record_query(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute; a timed out
+        # one is still worth counting
+        if context.connection is None or context.execution_context is None:
+            return
+        starts = context.connection.info.get("query_start")
+        if starts:
+            metrics.record_query(time.perf_counter() - starts.pop())
+
+
+def _create_engine(db_config, asynchronous=False):
+    if asynchronous:
+        if create_async_engine is None:
+            raise RuntimeError("SQLAlchemy asyncio support is not installed")
+        url = async_connection_string(db_config)
+    else:
+        url = connection_string(db_config)
+    options = pool_options(db_config)
+    kwargs = {}
+    connect_args = {}
+
+    if url.startswith("postgresql"):
+        kwargs.update(
+            pool_size=options["pool_size"],
+            max_overflow=options["max_overflow"],
+            pool_timeout=options["pool_timeout"],
+        )
+        if options["statement_timeout"] and asynchronous:
+            # asyncpg takes server settings instead of libpq options
+            connect_args["server_settings"] = {
+                "statement_timeout": str(int(options["statement_timeout"]))
+            }
+        elif options["statement_timeout"]:
+            connect_args["options"] = (
+                f"-c statement_timeout={int(options['statement_timeout'])}"
+            )
+
+    if connect_args:
+        kwargs["connect_args"] = connect_args
+
+    engine = (create_async_engine if asynchronous else create_engine)(
+        url,
+        pool_pre_ping=options["pool_pre_ping"],
+        pool_recycle=options["pool_recycle"],
+        **kwargs,
+    )
+    # Events and metrics live on the sync engine an async engine wraps
+    sync_engine = engine.sync_engine if asynchronous else engine
+    sync_engine.metrics = DBMetrics()
+    _instrument(sync_engine, sync_engine.metrics)
+
+    if url.startswith("sqlite"):
+
+        @event.listens_for(sync_engine, "connect")
+        def register_functions(dbapi_connection, connection_record):
+            # Stand-in for the Postgres expression in query_builder
+            dbapi_connection.create_function(
+                "last_group_segment", 1, cached_process_person_group
+            )
+
+    return engine
+
+
+def get_engine(db_config):
+    """Return the process-wide pooled engine for the db config.
+
+    Engines are keyed by pid, so a forked worker (e.g. gunicorn) never reuses
+    the sockets of its parent and builds its own pool on first use.
+    """
+    key = _engine_key(db_config)
+    engine = _engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = _create_engine(db_config)
+                _engines[key] = engine
+    return engine
+
+
+def get_async_engine(db_config):
+    """Return the process-wide async engine (asyncpg or aiosqlite) for the db config.
+
+    Its pool belongs to the event loop that first uses it, which is the
+    one loop of an ASGI worker process.
+    """
+    key = _engine_key(db_config)
+    engine = _async_engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _async_engines.get(key)
+            if engine is None:
+                engine = _create_engine(db_config, asynchronous=True)
+                _async_engines[key] = engine
+    return engine
+
+
+@contextmanager
+def connect(engine):
+    """Check out a pooled connection, recording how long the checkout took"""
+    started = time.perf_counter()
+    conn = engine.connect()
+    engine.metrics.record_checkout(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def pool_status(engine):
+    """Current pool usage next to the accumulated timing metrics"""
+    pool = engine.pool
+    status = {"pool": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        attr = getattr(pool, name, None)
+        if callable(attr):
+            status[name] = attr()
+    status.update(engine.metrics.snapshot())
+    return status
+
+
+def dispose_engines():
+    """Dispose all engines owned by this process"""
+    with _engines_lock:
+        for key, engine in list(_engines.items()):
+            if key[0] == os.getpid():
+                engine.dispose()
+            del _engines[key]
+
+
+async def dispose_async_engines():
+    """Dispose the async engines owned by this process"""
+    with _engines_lock:
+        engines = list(_async_engines.items())
+        _async_engines.clear()
+    for key, engine in engines:
+        if key[0] == os.getpid():
+            await engine.dispose()
+
+
+def _after_fork_in_child():
+    # Drop inherited pools without closing the parent's connections
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    for engine in list(_engines.values()):
+        engine.dispose(close=False)
+    _engines.clear()
+    for engine in list(_async_engines.values()):
+        engine.sync_engine.dispose(close=False)
+    _async_engines.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pandas as pd
+
+from query_builder import EVENT_COLUMNS
+
+# Low-cardinality text columns stored as categoricals
+CATEGORY_COLUMNS = ["device_name", "reader_name", "person_name", "person_group"]
+
+
+def wall_clock(values):
+    """Event times as naive datetime64 local (wall-clock) times.
+
+    A ``timestamptz`` column arrives tz-aware in the database session's time
+    zone, with mixed offsets when a range spans a DST change. The offsets are
+    dropped, so the times compare with the naive report bounds and agree
+    with the ``date`` column.
+    """
+    try:
+        times = pd.to_datetime(values)
+    except (TypeError, ValueError):
+        # Mixed offsets can not share one tz-aware dtype
+        times = pd.to_datetime(
+            values.map(
+                lambda v: v.replace(tzinfo=None) if isinstance(v, datetime) else v
+            )
+        )
+    if isinstance(times.dtype, pd.DatetimeTZDtype):
+        times = times.dt.tz_localize(None)
+    return times
+
+
+def compact_events(df):
+    """Compact in-memory form of fetched events.
+
+    Text columns become categoricals, ``date_and_time`` a naive datetime64
+    column (see wall_clock) and ``id`` the narrowest integer type that holds
+    it. ``date`` and ``time`` are not kept; expand_events derives them when
+    the rows are written.
+    """
+    df = df.drop(columns=["date", "time"], errors="ignore")
+    if "id" in df.columns and len(df):
+        df["id"] = pd.to_numeric(df["id"], downcast="integer")
+    if "date_and_time" in df.columns:
+        df["date_and_time"] = wall_clock(df["date_and_time"])
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def expand_events(df):
+    """Events in the report layout (EVENT_COLUMNS), with date/time derived"""
+    if "date" in df.columns:
+        return df
+    df = df.copy()
+    df["date"] = df["date_and_time"].dt.date
+    df["time"] = df["date_and_time"].dt.time
+    columns = [c for c in EVENT_COLUMNS if c in df.columns]
+    return df[columns + [c for c in df.columns if c not in columns]]
+
+
+def bytes_per_event(df):
+    """Deep memory footprint of a frame divided by its row count"""
+    if not len(df):
+        return 0.0
+    return df.memory_usage(deep=True).sum() / len(df)
+
+
+def events_in_range(df, start_date, end_date):
+    """Events of a (padded) fetch whose date_and_time falls on start_date..end_date"""
+    low = pd.Timestamp(start_date)
+    high = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    return df[(df["date_and_time"] >= low) & (df["date_and_time"] < high)]
+
+
+def concat_events(parts):
+    """Concatenate compact frames, keeping categorical columns categorical"""
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    df = pd.concat(parts, ignore_index=True)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.api.types.union_categoricals(
+                [p[column].astype("category") for p in parts]
+            )
+    return df
@@ -0,0 +1,445 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # optional, events are then always read from the database
+    pa = None
+
+from db import connect, get_engine
+from event_frame import CATEGORY_COLUMNS, compact_events
+from filter import read_person_groups
+from query_builder import FETCH_COLUMNS, EventQueryBuilder
+from utils import process_person_groups
+
+STATE_FILE = "state.json"
+PARTITION_FILE = "events.parquet"
+
+
+def event_schema():
+    """Layout of a stored day: FETCH_COLUMNS plus the processed group"""
+    strings = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("date_and_time", pa.timestamp("us")),
+            ("device_name", strings),
+            ("reader_name", strings),
+            ("person_name", strings),
+            ("person_group", strings),
+            # Stored so timetable matching can be pushed into the read
+            ("processed_group", strings),
+        ]
+    )
+
+
+def filter_expression(filters=None, timetable_groups=None):
+    """pyarrow filter with the same meaning as EventQueryBuilder's WHERE clauses"""
+    conditions = []
+    filters = filters or {}
+    if "device_name" in filters:
+        conditions.append(pc.field("device_name") == filters["device_name"])
+    if "person_group" in filters:
+        conditions.append(pc.field("person_group") == filters["person_group"])
+    if "person_group_excel" in filters:
+        groups = read_person_groups(filters["person_group_excel"])
+        conditions.append(pc.field("person_group").isin(groups))
+    if "person_groups" in filters:
+        conditions.append(pc.field("person_group").isin(list(filters["person_groups"])))
+    if timetable_groups:
+        conditions.append(pc.field("processed_group").isin(sorted(timetable_groups)))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+class EventStore:
+    """Local Parquet mirror of closed days of ``users``, partitioned by date.
+
+    Each day with events is written once, after it closes, to
+    ``<directory>/date=YYYY-MM-DD/events.parquet``, and ``state.json``
+    records the last mirrored day. ``sync`` copies the days closed since
+    then, one query per day, so reports over closed ranges can be read
+    locally without touching the database.
+
+    Devices can upload events days late, so ``sync`` also compares the row
+    count and highest id of the last ``recheck_days`` stored days with the
+    database (at most every ``recheck_interval`` seconds) and copies the days
+    that differ again. ``verify`` does the same for any range, e.g. the
+    whole store from a nightly ``python event_store.py DIR --url URL
+    --verify``.
+    """
+
+    def __init__(
+        self,
+        directory,
+        closed_after_days=1,
+        sync_max_days=31,
+        recheck_days=7,
+        recheck_interval=300,
+    ):
+        self.directory = directory
+        # Days ending this many days before today no longer receive events
+        self.closed_after_days = closed_after_days
+        # Days copied per sync call, so a first sync does not stall a report
+        self.sync_max_days = sync_max_days
+        # Trailing stored days compared with the database on sync
+        self.recheck_days = recheck_days
+        self.recheck_interval = recheck_interval
+        self._rechecked = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """Whether pyarrow is installed"""
+        return pa is not None
+
+    def _state(self):
+        try:
+            with open(os.path.join(self.directory, STATE_FILE)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {key: date.fromisoformat(value) for key, value in state.items()}
+
+    def _write_state(self, first_day, synced_through):
+        path = os.path.join(self.directory, STATE_FILE)
+        tmp_path = f"{path}.{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "first_day": first_day.isoformat(),
+                    "synced_through": synced_through.isoformat(),
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    def synced_through(self):
+        """Last day held by the store, or None"""
+        return self._state().get("synced_through")
+
+    def stored_range(self, start_date, end_date):
+        """The part of start_date..end_date the store can serve, or None.
+
+        Days without a partition had no events when they were synced, so they
+        count as covered too.
+        """
+        synced_through = self.synced_through()
+        if not self.available or synced_through is None or start_date > synced_through:
+            return None
+        return start_date, min(end_date, synced_through)
+
+    def _partition_dir(self, day):
+        return os.path.join(self.directory, f"date={day.isoformat()}")
+
+    def _write_day(self, day, df):
+        df = compact_events(df)
+        df["id"] = df["id"].astype("int64")
+        df["date_and_time"] = df["date_and_time"].astype("datetime64[us]")
+        df["processed_group"] = process_person_groups(df["person_group"])
+        table = pa.Table.from_pandas(
+            df[event_schema().names], schema=event_schema(), preserve_index=False
+        )
+
+        partition_dir = self._partition_dir(day)
+        if os.path.isdir(partition_dir):
+            # A day copied again: the file is swapped, readers keep the one they opened
+            tmp_path = os.path.join(partition_dir, f".tmp-{uuid.uuid4().hex}")
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, os.path.join(partition_dir, PARTITION_FILE))
+            return
+
+        tmp_dir = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        pq.write_table(table, os.path.join(tmp_dir, PARTITION_FILE))
+        try:
+            os.rename(tmp_dir, partition_dir)
+        except OSError:
+            # Another worker mirrored the same day first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _copy_day(self, engine, day):
+        """Copy one day from the database, replacing what the store holds for it"""
+        query, params = EventQueryBuilder(day, day, dialect=engine.dialect.name).build()
+        with connect(engine) as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+        if len(df):
+            self._write_day(day, df)
+        else:
+            shutil.rmtree(self._partition_dir(day), ignore_errors=True)
+
+    def _stored_fingerprint(self, day):
+        """(rows, highest id) of a stored day, (0, None) without a partition"""
+        path = os.path.join(self._partition_dir(day), PARTITION_FILE)
+        if not os.path.exists(path):
+            return 0, None
+        metadata = pq.read_metadata(path)
+        column = metadata.schema.to_arrow_schema().get_field_index("id")
+        max_id = None
+        for group in range(metadata.num_row_groups):
+            statistics = metadata.row_group(group).column(column).statistics
+            if statistics is not None and statistics.has_min_max:
+                max_id = statistics.max if max_id is None else max(max_id, statistics.max)
+        return metadata.num_rows, max_id
+
+    def stale_days(self, engine, start_date, end_date):
+        """Days of start_date..end_date whose rows in the store and database differ.
+
+        Compared by row count and highest id per day, which the Parquet
+        footers hold, so no stored rows are read.
+        """
+        with connect(engine) as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT date, COUNT(*), MAX(id) FROM users "
+                    "WHERE date BETWEEN :low AND :high GROUP BY date"
+                ),
+                {
+                    "low": start_date.strftime("%Y-%m-%d"),
+                    "high": end_date.strftime("%Y-%m-%d"),
+                },
+            )
+            database = {pd.Timestamp(row[0]).date(): (row[1], row[2]) for row in rows}
+
+        stale = []
+        day = start_date
+        while day <= end_date:
+            if self._stored_fingerprint(day) != database.get(day, (0, None)):
+                stale.append(day)
+            day += timedelta(days=1)
+        return stale
+
+    def verify(self, engine, start_date=None, end_date=None):
+        """Copy again the stored days of the range that differ from the database.
+
+        The range defaults to everything the store holds; returns the days
+        copied.
+        """
+        if not self.available:
+            return []
+        state = self._state()
+        if not state:
+            return []
+        start_date = max(start_date or state["first_day"], state["first_day"])
+        end_date = min(end_date or state["synced_through"], state["synced_through"])
+        if start_date > end_date:
+            return []
+
+        try:
+            with self._lock:
+                stale = self.stale_days(engine, start_date, end_date)
+                for day in stale:
+                    self._copy_day(engine, day)
+                if stale:
+                    print(
+                        f"Event store copied {len(stale)} changed days again: "
+                        f"{', '.join(str(d) for d in stale)}"
+                    )
+                return stale
+
+        except Exception as e:
+            print(f"Error verifying event store: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def _days_with_events(self, engine, low, high):
+        """Dates in low..high (low may be None) that have events, ascending"""
+        condition = "date <= :high" if low is None else "date BETWEEN :low AND :high"
+        params = {"high": high.strftime("%Y-%m-%d")}
+        if low is not None:
+            params["low"] = low.strftime("%Y-%m-%d")
+        with connect(engine) as conn:
+            rows = conn.execute(
+                text(f"SELECT DISTINCT date FROM users WHERE {condition} ORDER BY date"),
+                params,
+            )
+            return [pd.Timestamp(row[0]).date() for row in rows]
+
+    def sync(self, engine, today=None, max_days=None):
+        """Mirror newly closed days, then recheck the last ones; returns the days written"""
+        if not self.available:
+            return 0
+        written = self._sync_closed_days(engine, today, max_days)
+        return written + len(self.recheck(engine))
+
+    def recheck(self, engine):
+        """Verify the last ``recheck_days`` stored days, at most every ``recheck_interval`` s"""
+        now = time.monotonic()
+        if self._rechecked is not None and now - self._rechecked < self.recheck_interval:
+            return []
+        self._rechecked = now
+        synced_through = self.synced_through()
+        if synced_through is None or not self.recheck_days:
+            return []
+        return self.verify(
+            engine,
+            synced_through - timedelta(days=self.recheck_days - 1),
+            synced_through,
+        )
+
+    def _sync_closed_days(self, engine, today, max_days):
+        today = today or date.today()
+        last_closed = today - timedelta(days=self.closed_after_days)
+        max_days = max_days or self.sync_max_days
+
+        try:
+            with self._lock:
+                state = self._state()
+                first_day = state.get("first_day")
+                synced_through = state.get("synced_through")
+                low = synced_through + timedelta(days=1) if synced_through else None
+                if low is not None and low > last_closed:
+                    return 0
+
+                # Only days that have events are queried and written
+                days = self._days_with_events(engine, low, last_closed)
+                if first_day is None:
+                    if not days:
+                        return 0
+                    first_day = days[0]
+
+                for day in days[:max_days]:
+                    self._copy_day(engine, day)
+                    self._write_state(first_day, day)
+
+                written = min(len(days), max_days)
+                if written < len(days):
+                    synced_through = days[written - 1]
+                else:
+                    synced_through = last_closed
+                self._write_state(first_day, synced_through)
+                if written:
+                    print(f"Event store synced through {synced_through}")
+                return written
+
+        except Exception as e:
+            print(f"Error syncing event store: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def _paths(self, start_date, end_date):
+        """Partition files of the range in date order"""
+        paths = []
+        day = start_date
+        while day <= end_date:
+            path = os.path.join(self._partition_dir(day), PARTITION_FILE)
+            if os.path.exists(path):
+                paths.append(path)
+            day += timedelta(days=1)
+        return paths
+
+    def _read_table(self, path, columns, expression):
+        return pq.read_table(
+            path,
+            columns=columns,
+            filters=expression,
+            memory_map=True,
+            read_dictionary=[c for c in columns if c in CATEGORY_COLUMNS],
+        )
+
+    def read(
+        self,
+        start_date,
+        end_date,
+        filters=None,
+        timetable_groups=None,
+        columns=FETCH_COLUMNS,
+    ):
+        """Events of the range as a compact frame, in date_and_time order"""
+        expression = filter_expression(filters, timetable_groups)
+        tables = [
+            self._read_table(path, columns, expression)
+            for path in self._paths(start_date, end_date)
+        ]
+        if not tables:
+            return compact_events(pd.DataFrame(columns=columns))
+        return compact_events(pa.concat_tables(tables).to_pandas())
+
+    def read_chunks(
+        self,
+        start_date,
+        end_date,
+        chunksize,
+        filters=None,
+        timetable_groups=None,
+        columns=FETCH_COLUMNS,
+    ):
+        """Events of the range as compact frames of at most ``chunksize`` rows"""
+        expression = filter_expression(filters, timetable_groups)
+        for path in self._paths(start_date, end_date):
+            table = self._read_table(path, columns, expression)
+            for offset in range(0, table.num_rows, chunksize):
+                yield compact_events(table.slice(offset, chunksize).to_pandas())
+
+    def group_counts(self, start_date, end_date):
+        """Events per processed group, read from the processed_group column only"""
+        counts = Counter()
+        for path in self._paths(start_date, end_date):
+            column = pq.read_table(
+                path, columns=["processed_group"], memory_map=True
+            ).column("processed_group")
+            for value in pc.value_counts(column).to_pylist():
+                counts[value["values"]] += value["counts"]
+        return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Mirror closed days of access events into the Parquet event store"
+    )
+    parser.add_argument("directory", help="event store directory")
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument(
+        "--max-days", type=int, default=None, help="days to copy, all closed days if unset"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="then compare every stored day with the database and copy changed days again",
+    )
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.directory)
+    if not store.available:
+        parser.error("pyarrow is required for the event store")
+    engine = get_engine({"url": args.url})
+    total = 0
+    while True:
+        written = store.sync(engine, max_days=args.max_days or store.sync_max_days)
+        total += written
+        if not written or args.max_days:
+            break
+    print(f"{total} days written, synced through {store.synced_through()}")
+    if args.verify:
+        print(f"{len(store.verify(engine))} changed days copied again")
+
+
+if __name__ == "__main__":
+    main()
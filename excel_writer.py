@@ -0,0 +1,196 @@
+import datetime
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+try:
+    import xlsxwriter
+except ImportError:  # optional, openpyxl write-only mode is the fallback
+    xlsxwriter = None
+
+# Rows of an xlsx sheet, the header included
+MAX_ROWS = 1048576
+
+# Rows sampled per column when sizing columns
+WIDTH_SAMPLE_SIZE = 10000
+
+
+def column_widths(df, wide_columns=0, sample_size=WIDTH_SAMPLE_SIZE):
+    """Column widths from the header and the string length of the values.
+
+    Computed per column with vectorized string ops on at most ``sample_size``
+    rows; the first ``wide_columns`` columns get 5 extra characters.
+    """
+    if len(df) > sample_size:
+        df = df.sample(n=sample_size, random_state=0)
+
+    widths = []
+    for idx, column in enumerate(df.columns):
+        max_length = len(str(column))
+        # Missing values are written as empty cells, so they take no width
+        values = df[column].dropna()
+        if len(values):
+            max_length = max(max_length, int(values.astype(str).str.len().max()))
+        width = max_length + 2
+        if idx < wide_columns:
+            width += 5
+        widths.append(width)
+    return widths
+
+
+# Rows converted to Python objects at a time while writing
+ROW_BATCH_SIZE = 10000
+
+
+def _rows(df):
+    """Row tuples with missing values as None, converted batch by batch"""
+    for start in range(0, len(df), ROW_BATCH_SIZE):
+        batch = df.iloc[start : start + ROW_BATCH_SIZE]
+        values = batch.astype(object).where(batch.notna(), None)
+        yield from values.itertuples(index=False, name=None)
+
+
+class OpenpyxlWriter:
+    """openpyxl in write-only mode: rows are serialized as they are appended"""
+
+    name = "openpyxl"
+
+    def __init__(self, path):
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+
+    def add_sheet(self, sheet_name, columns, widths):
+        worksheet = self.workbook.create_sheet(sheet_name)
+        # Widths must be set before the first row in write-only mode
+        for idx, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(idx)].width = width
+        worksheet.append(list(columns))
+        return worksheet
+
+    def append_frame(self, worksheet, df):
+        for row in _rows(df):
+            worksheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class XlsxWriterWriter:
+    """xlsxwriter in constant_memory mode: each row is flushed once written"""
+
+    name = "xlsxwriter"
+
+    def __init__(self, path):
+        if xlsxwriter is None:
+            raise ImportError("xlsxwriter is not installed")
+        self.path = path
+        self.workbook = xlsxwriter.Workbook(
+            path, {"constant_memory": True, "remove_timezone": True}
+        )
+        self.formats = {
+            datetime.datetime: self.workbook.add_format(
+                {"num_format": "yyyy-mm-dd hh:mm:ss"}
+            ),
+            datetime.date: self.workbook.add_format({"num_format": "yyyy-mm-dd"}),
+            datetime.time: self.workbook.add_format({"num_format": "hh:mm:ss"}),
+        }
+        self.next_row = {}
+
+    def add_sheet(self, sheet_name, columns, widths):
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        for idx, width in enumerate(widths):
+            worksheet.set_column(idx, idx, width)
+        worksheet.write_row(0, 0, list(columns))
+        self.next_row[sheet_name] = 1
+        return worksheet
+
+    def _format(self, value):
+        for value_type in (datetime.datetime, datetime.date, datetime.time):
+            if isinstance(value, value_type):
+                return self.formats[value_type]
+        return None
+
+    def append_frame(self, worksheet, df):
+        row_idx = self.next_row[worksheet.name]
+        for row in _rows(df):
+            for col_idx, value in enumerate(row):
+                if value is None:
+                    continue
+                worksheet.write(row_idx, col_idx, value, self._format(value))
+            row_idx += 1
+        self.next_row[worksheet.name] = row_idx
+
+    def close(self):
+        self.workbook.close()
+
+
+BACKENDS = {
+    OpenpyxlWriter.name: OpenpyxlWriter,
+    XlsxWriterWriter.name: XlsxWriterWriter,
+}
+
+
+def default_backend():
+    return XlsxWriterWriter.name if xlsxwriter is not None else OpenpyxlWriter.name
+
+
+class ExcelReportWriter:
+    """Streaming xlsx writer with a pluggable backend.
+
+    Sheets are written one after another; rows of the current sheet can be
+    appended in chunks with ``append``.
+    """
+
+    def __init__(self, path, backend=None):
+        backend = backend or default_backend()
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown Excel backend: {backend}")
+        self.backend = BACKENDS[backend](path)
+        self.path = path
+        # Rows written per sheet, the header included
+        self.rows = {}
+
+    def add_sheet(self, sheet_name, sample, wide_columns=0):
+        """Start a sheet with the columns of ``sample``, sized from its values"""
+        return self._start_sheet(
+            sheet_name, sample.columns, column_widths(sample, wide_columns)
+        )
+
+    def add_sheet_columns(self, sheet_name, columns):
+        """Start a sheet when no rows are available to size it from"""
+        return self._start_sheet(
+            sheet_name, columns, [len(str(c)) + 2 for c in columns]
+        )
+
+    def _start_sheet(self, sheet_name, columns, widths):
+        sheet = self.backend.add_sheet(sheet_name, columns, widths)
+        self.rows[sheet_name] = 1
+        return sheet
+
+    def append(self, sheet, df):
+        """Append rows to a sheet; raises ValueError past the xlsx row limit"""
+        sheet_name = sheet.name if hasattr(sheet, "name") else sheet.title
+        rows = self.rows[sheet_name] + len(df)
+        if rows > MAX_ROWS:
+            # The backends would drop the extra rows without an error
+            raise ValueError(
+                f"Sheet {sheet_name} would have {rows} rows, "
+                f"over the xlsx limit of {MAX_ROWS}"
+            )
+        self.backend.append_frame(sheet, df)
+        self.rows[sheet_name] = rows
+
+    def write_frame(self, sheet_name, df, wide_columns=0):
+        """Write a whole DataFrame as one sheet"""
+        sheet = self.add_sheet(sheet_name, df, wide_columns)
+        self.append(sheet, df)
+        return sheet
+
+    def close(self):
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,5 +1,12 @@
 import pandas as pd
 
+
+def read_person_groups(excel_file_path):
+    """Read the distinct person groups listed in an Excel file"""
+    person_groups_df = pd.read_excel(excel_file_path, usecols=['person_group'])
+    return list(person_groups_df['person_group'].dropna().unique())
+
+
 class Filter:
     def __init__(self, df):
         self.df = df
@@ -19,20 +26,21 @@ class Filter:
     def filter_by_person_group_from_excel(self, excel_file_path):
         """Filter data by person group from an Excel file"""
         try:
-            person_groups_df = pd.read_excel(excel_file_path, usecols=['person_group'])
-            person_groups = person_groups_df['person_group'].dropna().unique()
+            person_groups = read_person_groups(excel_file_path)
             return self.df[self.df['person_group'].isin(person_groups)]
         except Exception as e:
             print(f"Error reading Excel file: {str(e)}")
             raise
 
     def apply_filters(self, filters):
-        """Apply multiple filters to the data"""
-        filtered_df = self.df
+        """Apply multiple filters to the data, each narrowing the previous result"""
+        current = self
         if 'device_name' in filters:
-            filtered_df = self.filter_by_device(filters['device_name'])
+            current = Filter(current.filter_by_device(filters['device_name']))
         if 'person_group' in filters:
-            filtered_df = self.filter_by_person_group(filters['person_group'])
+            current = Filter(current.filter_by_person_group(filters['person_group']))
         if 'person_group_excel' in filters:
-            filtered_df = self.filter_by_person_group_from_excel(filters['person_group_excel'])
-        return filtered_df
\ No newline at end of file
+            current = Filter(current.filter_by_person_group_from_excel(filters['person_group_excel']))
+        if 'person_groups' in filters:
+            current = Filter(current.df[current.df['person_group'].isin(filters['person_groups'])])
+        return current.df
\ No newline at end of file
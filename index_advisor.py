@@ -0,0 +1,379 @@
+import argparse
+import json
+import re
+import statistics
+import time
+import traceback
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+
+from db import connect, get_engine
+from query_builder import EventQueryBuilder, processed_group_sql
+
+# Days of the default range: the last month of events, like a monthly report
+DEFAULT_RANGE_DAYS = 31
+
+# BRIN only pays off when rows are stored roughly in date_and_time order
+BRIN_MIN_CORRELATION = 0.9
+
+
+def index_proposals(dialect):
+    """Indexes for the report query shapes as (name, definition, reason).
+
+    ``definition`` follows ``ON users``. BRIN and the expression index are
+    Postgres only: SQLite has no BRIN, and last_group_segment is a Python
+    function it cannot index.
+    """
+    proposals = [
+        (
+            "users_date_person_group",
+            "(date, person_group)",
+            "date range with person_group filters; also serves date alone",
+        ),
+        (
+            "users_date_device_name",
+            "(date, device_name)",
+            "date range with a device_name filter",
+        ),
+    ]
+    if dialect == "postgresql":
+        proposals += [
+            (
+                "users_date_processed_group",
+                f"(date, ({processed_group_sql(dialect)}))",
+                "timetable reports: date range with last-'>'-segment group matching",
+            ),
+            (
+                "users_date_and_time_brin",
+                "USING brin (date_and_time)",
+                "date_and_time ranges of the rollup refresh on an append-only table",
+            ),
+        ]
+    return proposals
+
+
+def table_schema(engine):
+    """Columns and existing indexes of ``users``"""
+    inspector = inspect(engine)
+    if not inspector.has_table("users"):
+        raise ValueError("Table users not found")
+    columns = [(c["name"], str(c["type"])) for c in inspector.get_columns("users")]
+    indexes = {}
+    if engine.dialect.name == "postgresql":
+        with connect(engine) as conn:
+            rows = conn.execute(
+                text("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'users'")
+            )
+            indexes = {name: definition for name, definition in rows}
+    else:
+        for index in inspector.get_indexes("users"):
+            columns_of = [c for c in index["column_names"] if c]
+            indexes[index["name"]] = f"({', '.join(columns_of)})"
+    return columns, indexes
+
+
+def _index_key(definition):
+    """(method, column list) of an index definition, lower-cased and unspaced"""
+    match = re.search(r"using (\w+) (\(.*\))\s*$", definition.lower())
+    if match:
+        method, body = match.groups()
+    else:
+        method, body = "btree", definition.lower()
+    return method, "".join(body.split())
+
+
+def existing_index(name, definition, indexes):
+    """Name of an existing index that serves a proposal, or None.
+
+    A btree index counts when the proposal's columns are a prefix of its own.
+    """
+    if name in indexes:
+        return name
+    method, body = _index_key(definition)
+    for existing, existing_definition in indexes.items():
+        existing_method, existing_body = _index_key(existing_definition)
+        if existing_method != method:
+            continue
+        if existing_body == body or (
+            method == "btree" and existing_body.startswith(body[:-1] + ",")
+        ):
+            return existing
+    return None
+
+
+def date_and_time_correlation(engine):
+    """Physical order correlation of date_and_time from pg_stats, or None"""
+    if engine.dialect.name != "postgresql":
+        return None
+    with connect(engine) as conn:
+        return conn.execute(
+            text(
+                "SELECT correlation FROM pg_stats "
+                "WHERE tablename = 'users' AND attname = 'date_and_time'"
+            )
+        ).scalar()
+
+
+def report_range(engine, start_date=None, end_date=None):
+    """The given range, or the last DEFAULT_RANGE_DAYS days with events"""
+    if start_date and end_date:
+        return start_date, end_date
+    with connect(engine) as conn:
+        last = conn.execute(text("SELECT MAX(date) FROM users")).scalar()
+    if last is None:
+        raise ValueError("Table users is empty")
+    last = pd.Timestamp(last).date()
+    return last - timedelta(days=DEFAULT_RANGE_DAYS - 1), last
+
+
+def sample_values(engine, start_date, end_date):
+    """Frequent device, group and processed groups of the range, as filter values"""
+    dialect = engine.dialect.name
+    builder = EventQueryBuilder(start_date, end_date, dialect=dialect)
+
+    def top(expression, limit):
+        query, params = builder.select(
+            f"{expression} AS value, COUNT(*) AS records",
+            group_by="1",
+            order_by="2 DESC",
+            limit=limit,
+        )
+        with connect(engine) as conn:
+            return [row[0] for row in conn.execute(query, params) if row[0] is not None]
+
+    return {
+        "device_name": top("device_name", 1),
+        "person_group": top("person_group", 5),
+        "processed_group": top(processed_group_sql(dialect), 5),
+    }
+
+
+def query_shapes(engine, start_date, end_date, values):
+    """(name, query, params, expanding names) of each query the reports run"""
+    dialect = engine.dialect.name
+
+    def builder():
+        return EventQueryBuilder(start_date, end_date, dialect=dialect)
+
+    shapes = [("events", builder())]
+    if values["device_name"]:
+        shapes.append(
+            ("events_device", builder().where_device(values["device_name"][0]))
+        )
+    if values["person_group"]:
+        shapes.append(
+            ("events_group", builder().where_person_group(values["person_group"][0]))
+        )
+        shapes.append(
+            ("events_groups", builder().where_person_groups(values["person_group"]))
+        )
+    if values["processed_group"]:
+        shapes.append(
+            (
+                "events_timetable",
+                builder().where_processed_groups(values["processed_group"]),
+            )
+        )
+
+    result = [(name, *b.build(), b.expanding) for name, b in shapes]
+    counts = builder()
+    result.append(("group_counts", *counts.build_group_counts(), counts.expanding))
+    version = builder()
+    result.append(
+        (
+            "data_version",
+            *version.select("MAX(id) AS max_id, MAX(date_and_time) AS max_date_and_time"),
+            version.expanding,
+        )
+    )
+    # The scan of a rollup refresh over the last day of the range
+    result.append(
+        (
+            "rollup_delta",
+            text(
+                "SELECT COUNT(*) FROM users "
+                "WHERE date_and_time > :low AND date_and_time <= :high"
+            ),
+            {
+                "low": pd.Timestamp(end_date).to_pydatetime(),
+                "high": (pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_pydatetime(),
+            },
+            [],
+        )
+    )
+    return result
+
+
+def _prefixed(query, prefix, expanding):
+    statement = text(f"{prefix} {query.text}")
+    if expanding:
+        statement = statement.bindparams(
+            *[bindparam(name, expanding=True) for name in expanding]
+        )
+    return statement
+
+
+def _plan_nodes(plan):
+    nodes = []
+    label = plan["Node Type"]
+    if plan.get("Index Name"):
+        label += f" on {plan['Index Name']}"
+    if "Scan" in plan["Node Type"]:
+        nodes.append(label)
+    for child in plan.get("Plans", []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def explain(engine, query, params, expanding):
+    """Scan nodes of the query plan, plus shared buffers on Postgres"""
+    with connect(engine) as conn:
+        if engine.dialect.name == "postgresql":
+            statement = _prefixed(
+                query, "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)", expanding
+            )
+            document = conn.execute(statement, params).scalar()
+            if isinstance(document, str):
+                document = json.loads(document)
+            plan = document[0]["Plan"]
+            buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+            return "; ".join(_plan_nodes(plan)), buffers
+
+        statement = _prefixed(query, "EXPLAIN QUERY PLAN", expanding)
+        rows = conn.execute(statement, params).fetchall()
+        return "; ".join(row[-1] for row in rows), None
+
+
+def time_query(engine, query, params, runs):
+    """Median wall milliseconds to run the query and fetch its rows, and the row count"""
+    timings = []
+    rows = 0
+    for _ in range(runs):
+        with connect(engine) as conn:
+            started = time.perf_counter()
+            rows = len(conn.execute(query, params).fetchall())
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def measure(engine, shapes, runs):
+    """Plan and timing of each query shape, by name"""
+    results = {}
+    for name, query, params, expanding in shapes:
+        plan, buffers = explain(engine, query, params, expanding)
+        milliseconds, rows = time_query(engine, query, params, runs)
+        results[name] = {
+            "rows": rows,
+            "ms": round(milliseconds, 1),
+            "buffers": buffers,
+            "plan": plan,
+        }
+    return results
+
+
+def create_indexes(engine, proposals):
+    """Create the proposed indexes and refresh the planner statistics"""
+    postgres = engine.dialect.name == "postgresql"
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        for name, definition, _ in proposals:
+            # CONCURRENTLY keeps the table writable for the Hikvision sync
+            concurrently = "CONCURRENTLY " if postgres else ""
+            statement = f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON users {definition}"
+            print(statement)
+            started = time.perf_counter()
+            conn.execute(text(statement))
+            print(f"  created in {time.perf_counter() - started:.1f}s")
+        conn.execute(text("ANALYZE users"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Explain the report queries on users and propose (or create) indexes"
+    )
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--start", help="YYYY-MM-DD, defaults to the last month of events")
+    parser.add_argument("--end", help="YYYY-MM-DD")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per query")
+    parser.add_argument(
+        "--create", action="store_true", help="create the missing indexes and time again"
+    )
+    args = parser.parse_args(argv)
+
+    engine = get_engine({"url": args.url})
+    try:
+        start_date = pd.Timestamp(args.start).date() if args.start else None
+        end_date = pd.Timestamp(args.end).date() if args.end else None
+        columns, indexes = table_schema(engine)
+        start_date, end_date = report_range(engine, start_date, end_date)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("users columns: " + ", ".join(f"{name} {kind}" for name, kind in columns))
+    print("Existing indexes:")
+    for name, definition in sorted(indexes.items()):
+        print(f"  {name}: {definition}")
+    if not indexes:
+        print("  none")
+
+    missing = []
+    print("\nProposed indexes:")
+    for name, definition, reason in index_proposals(engine.dialect.name):
+        existing = existing_index(name, definition, indexes)
+        if existing:
+            print(f"  {name}: covered by {existing}")
+            continue
+        if "brin" in definition:
+            correlation = date_and_time_correlation(engine)
+            if correlation is not None and abs(correlation) < BRIN_MIN_CORRELATION:
+                print(
+                    f"  {name}: skipped, date_and_time correlation {correlation:.2f} "
+                    "is too low for BRIN"
+                )
+                continue
+        missing.append((name, definition, reason))
+        print(f"  CREATE INDEX {name} ON users {definition};  -- {reason}")
+    if not missing:
+        print("  none, the report queries are covered")
+
+    print(f"\nQuery shapes over {start_date} to {end_date}, median of {args.runs} runs")
+    try:
+        values = sample_values(engine, start_date, end_date)
+        shapes = query_shapes(engine, start_date, end_date, values)
+        before = measure(engine, shapes, args.runs)
+
+        after = None
+        if args.create and missing:
+            print()
+            create_indexes(engine, missing)
+            after = measure(engine, shapes, args.runs)
+    except Exception as e:
+        print(f"Error explaining report queries: {str(e)}")
+        print(traceback.format_exc())
+        raise
+
+    table = []
+    for name, _, _, _ in shapes:
+        row = {"query": name, "rows": before[name]["rows"], "before_ms": before[name]["ms"]}
+        if after is not None:
+            row["after_ms"] = after[name]["ms"]
+            row["speedup"] = round(before[name]["ms"] / max(after[name]["ms"], 0.1), 1)
+        if engine.dialect.name == "postgresql":
+            row["buffers_before"] = before[name]["buffers"]
+            if after is not None:
+                row["buffers_after"] = after[name]["buffers"]
+        table.append(row)
+    print()
+    print(pd.DataFrame(table).to_string(index=False))
+
+    print("\nPlans:")
+    for name, _, _, _ in shapes:
+        print(f"  {name}: {before[name]['plan']}")
+        if after is not None and after[name]["plan"] != before[name]["plan"]:
+            print(f"  {' ' * len(name)}  -> {after[name]['plan']}")
+
+
+if __name__ == "__main__":
+    main()
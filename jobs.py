@@ -0,0 +1,557 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+from metrics import PROFILE_FILE, PROFILE_TEXT_FILE, profiled
+from pipeline import ReportCancelled, StageTimings
+from report_cache import normalize_params
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Created in a running job's directory to ask its worker to stop
+CANCEL_MARKER = ".cancelled"
+
+
+class JobQueueFull(Exception):
+    """Raised when the pending job limit is reached"""
+
+
+def job_dedupe_key(report_type, start_date, end_date, additional_params):
+    """Identity of a report request, used to merge identical in-flight jobs"""
+    payload = json.dumps(
+        {
+            "report_type": report_type,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "params": normalize_params(additional_params),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryJobStore:
+    """Job records kept in this process; fine for a single app worker"""
+
+    shared = False
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        """Insert the job unless an identical one is active; return the active job"""
+        with self._lock:
+            for existing in self._jobs.values():
+                if (
+                    existing["dedupe_key"] == job["dedupe_key"]
+                    and existing["status"] in ACTIVE_STATUSES
+                ):
+                    return dict(existing)
+            self._jobs[job["id"]] = dict(job)
+            return dict(job)
+
+    def update(self, job_id, from_statuses=None, **fields):
+        """Set fields of a job, only while its status is in from_statuses if given.
+
+        Returns whether the job was updated.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (
+                from_statuses is not None and job["status"] not in from_statuses
+            ):
+                return False
+            job.update(fields)
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def count_active(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j["status"] in ACTIVE_STATUSES)
+
+    def active(self):
+        with self._lock:
+            return [
+                dict(j) for j in self._jobs.values() if j["status"] in ACTIVE_STATUSES
+            ]
+
+    def finished_before(self, timestamp):
+        with self._lock:
+            return [
+                dict(j)
+                for j in self._jobs.values()
+                if j["status"] not in ACTIVE_STATUSES
+                and (j["finished"] or 0) < timestamp
+            ]
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+class SQLiteJobStore:
+    """Job records in a SQLite file, shared by all app worker processes.
+
+    A partial unique index on the dedupe key keeps identical jobs from being
+    queued twice, even when the requests land on different workers.
+    """
+
+    shared = True
+    columns = (
+        "id",
+        "dedupe_key",
+        "status",
+        "request",
+        "created",
+        "started",
+        "finished",
+        "output_file",
+        "error",
+        "owner_pid",
+        "timings",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    dedupe_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    request TEXT,
+                    created REAL,
+                    started REAL,
+                    finished REAL,
+                    output_file TEXT,
+                    error TEXT,
+                    owner_pid INTEGER,
+                    timings TEXT
+                )
+            """
+            )
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "timings" not in existing:
+                # Job files created before stage timings were recorded
+                conn.execute("ALTER TABLE jobs ADD COLUMN timings TEXT")
+            conn.execute(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_dedupe_key
+                ON jobs (dedupe_key) WHERE status IN ('queued', 'running')
+            """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _row(self, row):
+        return dict(row) if row else None
+
+    def create(self, job):
+        """Insert the job unless an identical one is active; return the active job"""
+        while True:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        f"INSERT INTO jobs ({', '.join(self.columns)}) "
+                        f"VALUES ({', '.join('?' for _ in self.columns)})",
+                        [job.get(c) for c in self.columns],
+                    )
+                return dict(job)
+            except sqlite3.IntegrityError:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT * FROM jobs WHERE dedupe_key = ? "
+                        "AND status IN ('queued', 'running')",
+                        (job["dedupe_key"],),
+                    ).fetchone()
+                if row:
+                    return self._row(row)
+                # The active duplicate finished in between, try again
+
+    def update(self, job_id, from_statuses=None, **fields):
+        """Set fields of a job, only while its status is in from_statuses if given.
+
+        The status test is part of the UPDATE, so a concurrent change (e.g. a
+        cancel from another worker) is never overwritten. Returns whether the
+        job was updated.
+        """
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        condition = "id = ?"
+        params = [*fields.values(), job_id]
+        if from_statuses is not None:
+            condition += f" AND status IN ({', '.join('?' for _ in from_statuses)})"
+            params.extend(from_statuses)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE {condition}", params
+            )
+            return cursor.rowcount > 0
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            return self._row(
+                conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            )
+
+    def count_active(self):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+    def active(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            return [self._row(r) for r in rows]
+
+    def finished_before(self, timestamp):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status NOT IN ('queued', 'running') "
+                "AND COALESCE(finished, 0) < ?",
+                (timestamp,),
+            ).fetchall()
+            return [self._row(r) for r in rows]
+
+    def delete(self, job_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Set in each pool process by _init_worker
+_worker_generator = None
+_worker_store = None
+
+
+def _init_worker(report_generator, store):
+    global _worker_generator, _worker_store
+    _worker_generator = report_generator
+    # Jobs own their output files, the generator must not delete them
+    _worker_generator.cleanup_delay = None
+    _worker_store = store
+
+
+def _run_job(
+    job_id,
+    output_dir,
+    report_type,
+    start_date,
+    end_date,
+    additional_params,
+    timings,
+    profile=False,
+):
+    """Pool entry point: generate one report into the job's directory.
+
+    Returns (output_file, timings dict), or None for a cancelled job: one
+    cancelled while queued is never started, a running one stops at its next
+    stage or chunk once CANCEL_MARKER appears in its directory. With
+    ``profile`` the report runs under cProfile and the dump is saved next to
+    it (partition pool workers are not profiled).
+    """
+    if _worker_store is not None and not _worker_store.update(
+        job_id, from_statuses=(QUEUED,), status=RUNNING, started=time.time()
+    ):
+        # Cancelled (or purged) before a worker picked it up
+        return None
+
+    marker = os.path.join(output_dir, CANCEL_MARKER)
+    job_timings = StageTimings(cancelled=lambda: os.path.exists(marker))
+    job_timings.merge(timings or {})
+    _worker_generator.output_dir = output_dir
+    try:
+        with profiled(output_dir) if profile else nullcontext():
+            output_file = _worker_generator.generate_report(
+                report_type, start_date, end_date, additional_params, job_timings
+            )
+    except ReportCancelled:
+        return None
+    return output_file, job_timings.as_dict()
+
+
+class JobManager:
+    """Runs ReportGenerator.generate_report in a bounded process pool.
+
+    ``submit`` returns at once with a job record; identical in-flight
+    requests share one job. Queued jobs can be cancelled outright, running
+    ones stop at their next stage or chunk (see CANCEL_MARKER). Finished jobs
+    are recorded into ``metrics`` (a ReportMetrics), if given.
+    """
+
+    def __init__(
+        self,
+        report_generator,
+        store=None,
+        jobs_dir=None,
+        max_workers=2,
+        max_pending=20,
+        job_ttl=3600,
+        metrics=None,
+    ):
+        self.report_generator = report_generator
+        self.store = store or MemoryJobStore()
+        self.jobs_dir = jobs_dir or os.path.join(os.getcwd(), "reports", "jobs")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # Seconds a finished job and its file stay downloadable
+        self.job_ttl = job_ttl
+        self.metrics = metrics
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Process pool, started on first use (so importing the app stays cheap)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    # Only a shared store is useful (and picklable) in the pool
+                    initargs=(
+                        self.report_generator,
+                        self.store if self.store.shared else None,
+                    ),
+                )
+            return self._executor
+
+    def submit(
+        self,
+        report_type,
+        start_date,
+        end_date,
+        additional_params=None,
+        cleanup_paths=(),
+        timings=None,
+        profile=False,
+    ):
+        """Queue a report; returns (job, created) where created is False for a duplicate.
+
+        ``timings`` (a StageTimings) carries stages already spent on the
+        request, e.g. parsing, into the job's recorded timings. ``profile``
+        runs the job under cProfile (see profile_path).
+        """
+        self.purge()
+        additional_params = dict(additional_params or {})
+        dedupe_key = job_dedupe_key(report_type, start_date, end_date, additional_params)
+        if profile:
+            # A profiled request never joins an unprofiled job
+            dedupe_key += ":profile"
+        job = {
+            "id": uuid.uuid4().hex,
+            "dedupe_key": dedupe_key,
+            "status": QUEUED,
+            "request": json.dumps(
+                {
+                    "report_type": report_type,
+                    "start_date": start_date.isoformat(),
+                    "end_date": end_date.isoformat(),
+                },
+            ),
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "output_file": None,
+            "error": None,
+            "owner_pid": os.getpid(),
+            "timings": None,
+        }
+
+        if self.store.count_active() >= self.max_pending:
+            self._remove_paths(cleanup_paths)
+            raise JobQueueFull(f"Too many pending jobs ({self.max_pending})")
+
+        stored = self.store.create(job)
+        if stored["id"] != job["id"]:
+            # Identical job already in flight
+            self._remove_paths(cleanup_paths)
+            return stored, False
+
+        output_dir = os.path.join(self.jobs_dir, job["id"])
+        future = self.executor.submit(
+            _run_job,
+            job["id"],
+            output_dir,
+            report_type,
+            start_date,
+            end_date,
+            additional_params,
+            timings.as_dict() if timings is not None else None,
+            profile,
+        )
+        with self._lock:
+            self._futures[job["id"]] = future
+        future.add_done_callback(
+            lambda f, job_id=job["id"]: self._finish(job_id, f, cleanup_paths)
+        )
+        return stored, True
+
+    def _finish(self, job_id, future, cleanup_paths):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        self._remove_paths(cleanup_paths)
+
+        if self.store.get(job_id) is None:
+            return
+
+        try:
+            result = future.result()
+        except CancelledError:
+            self.store.update(job_id, status=CANCELLED, finished=time.time())
+            self._observe(CANCELLED)
+            return
+        except Exception as e:
+            print(f"Report job {job_id} failed: {str(e)}")
+            print(traceback.format_exc())
+            self.store.update(
+                job_id, status=FAILED, error=str(e), finished=time.time()
+            )
+            self._observe(FAILED)
+            return
+
+        if result is not None:
+            output_file, timings = result
+            # Only an active job becomes done; one cancelled meanwhile stays so
+            if self.store.update(
+                job_id,
+                from_statuses=ACTIVE_STATUSES,
+                status=DONE,
+                output_file=output_file,
+                timings=json.dumps(timings),
+                finished=time.time(),
+            ):
+                self._observe(DONE, timings)
+                return
+
+        self.store.update(job_id, status=CANCELLED, finished=time.time())
+        shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+        self._observe(CANCELLED)
+
+    def _observe(self, status, timings=None):
+        if self.metrics is not None:
+            self.metrics.observe(status, timings)
+
+    def profile_path(self, job_id, text=True):
+        """The job's profile summary (or pstats dump), or None if it was not profiled"""
+        path = os.path.join(
+            self.jobs_dir, job_id, PROFILE_TEXT_FILE if text else PROFILE_FILE
+        )
+        return path if os.path.exists(path) else None
+
+    def get(self, job_id):
+        """Job record with the status as seen from this process"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            future = self._futures.get(job_id)
+        if job["status"] == QUEUED and future is not None and future.running():
+            job["status"] = RUNNING
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job; returns the updated record or None if unknown"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        # A job that finished meanwhile keeps its result
+        if self.store.update(job_id, from_statuses=ACTIVE_STATUSES, status=CANCELLED):
+            with self._lock:
+                future = self._futures.get(job_id)
+            if future is None or not future.cancel():
+                # Running (possibly in another app process): the worker sees
+                # the marker at its next stage or chunk and frees its slot
+                output_dir = os.path.join(self.jobs_dir, job_id)
+                os.makedirs(output_dir, exist_ok=True)
+                open(os.path.join(output_dir, CANCEL_MARKER), "w").close()
+        return self.get(job_id)
+
+    def purge(self):
+        """Forget finished jobs past their TTL and delete their files.
+
+        Active jobs whose owning app process is gone are marked failed, so
+        they stop blocking identical requests.
+        """
+        for job in self.store.active():
+            if job["owner_pid"] and not _pid_alive(job["owner_pid"]):
+                self.store.update(
+                    job["id"],
+                    status=FAILED,
+                    error="Worker process exited",
+                    finished=time.time(),
+                )
+
+        for job in self.store.finished_before(time.time() - self.job_ttl):
+            shutil.rmtree(os.path.join(self.jobs_dir, job["id"]), ignore_errors=True)
+            self.store.delete(job["id"])
+
+    def _remove_paths(self, paths):
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def describe(self, job):
+        """Public view of a job record for the JSON API"""
+        request = json.loads(job["request"]) if job.get("request") else {}
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "created": job["created"],
+            "started": job["started"],
+            "finished": job["finished"],
+            "error": job["error"],
+            "timings": json.loads(job["timings"]) if job.get("timings") else None,
+            "profiled": self.profile_path(job["id"]) is not None,
+            **request,
+        }
@@ -0,0 +1,449 @@
+import argparse
+import json
+import re
+import select
+import threading
+import time
+import traceback
+from datetime import date, datetime
+
+import pandas as pd
+from sqlalchemy import text
+
+from db import connect, get_engine
+from event_frame import compact_events, concat_events
+from filter import Filter
+from pipeline import count
+from query_builder import FETCH_COLUMNS, EventQueryBuilder
+from sessions import ENTRY, EXIT, reader_directions
+
+# Channel the users insert trigger notifies (see install_notify_trigger)
+NOTIFY_CHANNEL = "users_inserted"
+
+PERSON_COLUMNS = [
+    "person_name",
+    "person_group",
+    "first_in",
+    "last_out",
+    "last_seen",
+    "last_reader",
+    "inside",
+    "records",
+]
+
+
+def person_arrivals(events):
+    """One row per person of the events: first entry, last exit and last scan.
+
+    ``inside`` is True unless the person's last scan was at an exit reader,
+    so scans at readers of unknown direction count as present.
+    """
+    if not len(events):
+        return pd.DataFrame(columns=PERSON_COLUMNS)
+    direction = reader_directions(events["reader_name"])
+    frame = pd.DataFrame(
+        {
+            "person_name": events["person_name"].astype(str).to_numpy(),
+            "person_group": events["person_group"].astype(object).to_numpy(),
+            "date_and_time": events["date_and_time"].to_numpy(),
+            "reader_name": events["reader_name"].astype(object).to_numpy(),
+            "direction": direction,
+        }
+    )
+    frame = frame.sort_values(["person_name", "date_and_time"], kind="stable")
+    people = frame.groupby("person_name", sort=False)
+    last = people.tail(1).set_index("person_name")
+    arrivals = pd.DataFrame(
+        {
+            "person_group": last["person_group"],
+            "first_in": frame[frame["direction"] == ENTRY]
+            .groupby("person_name")["date_and_time"]
+            .min(),
+            "last_out": frame[frame["direction"] == EXIT]
+            .groupby("person_name")["date_and_time"]
+            .max(),
+            "last_seen": last["date_and_time"],
+            "last_reader": last["reader_name"],
+            "inside": last["direction"] != EXIT,
+            "records": people.size(),
+        }
+    )
+    return arrivals.rename_axis("person_name").reset_index()[PERSON_COLUMNS]
+
+
+def _timestamp(value):
+    return None if pd.isna(value) else pd.Timestamp(value).isoformat()
+
+
+class LiveDaily:
+    """Today's events and per-person arrival state, kept current by tailing ``users``.
+
+    ``poll`` fetches only rows with an id above the high-water mark, so a
+    poll after a quiet minute is one indexed query returning nothing. A
+    background thread (``start``) polls every ``poll_interval`` seconds,
+    or as soon as a Postgres NOTIFY on ``notify_channel`` arrives. Rows
+    committed out of id order are caught every ``verify_interval`` seconds
+    by counting the day's rows up to the mark, reloading the day on a
+    mismatch.
+    """
+
+    def __init__(
+        self,
+        db_config,
+        poll_interval=30,
+        batch_size=50000,
+        notify_channel=None,
+        verify_interval=300,
+        today=None,
+    ):
+        self.db_config = db_config
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.notify_channel = notify_channel
+        self.verify_interval = verify_interval
+        # Callable returning the current day; date.today unless testing
+        self.today = today or date.today
+        self.day = None
+        self.high_water_mark = None
+        self.rows = 0
+        self.last_poll = None
+        self.last_verify = None
+        self.last_error = None
+        self._parts = []
+        self._events = None
+        self._people = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listener = None
+
+    @property
+    def engine(self):
+        return get_engine(self.db_config)
+
+    def _reset(self, day):
+        self.day = day
+        self.high_water_mark = None
+        self.rows = 0
+        self.last_verify = None
+        self._parts = []
+        self._events = None
+        self._people = {}
+
+    def _add(self, chunk):
+        """Fold a compact chunk of new events into the frames and the people"""
+        self._parts.append(chunk)
+        self._events = None
+        self.rows += len(chunk)
+        self.high_water_mark = int(chunk["id"].max())
+        for row in person_arrivals(chunk).to_dict("records"):
+            person = self._people.get(row["person_name"])
+            if person is None:
+                self._people[row["person_name"]] = row
+                continue
+            person["records"] += row["records"]
+            if pd.notna(row["first_in"]) and (
+                pd.isna(person["first_in"]) or row["first_in"] < person["first_in"]
+            ):
+                person["first_in"] = row["first_in"]
+            if pd.notna(row["last_out"]) and (
+                pd.isna(person["last_out"]) or row["last_out"] > person["last_out"]
+            ):
+                person["last_out"] = row["last_out"]
+            if row["last_seen"] >= person["last_seen"]:
+                for name in ("person_group", "last_seen", "last_reader", "inside"):
+                    person[name] = row[name]
+
+    def _rows_up_to_mark(self, day):
+        """Rows of the day at or below the high-water mark, held or not"""
+        if self.high_water_mark is None:
+            return 0
+        query, params = (
+            EventQueryBuilder(day, day, dialect=self.engine.dialect.name)
+            .where_up_to_id(self.high_water_mark)
+            .select("COUNT(*)")
+        )
+        with connect(self.engine) as conn:
+            return conn.execute(query, params).scalar()
+
+    def poll(self):
+        """Fetch today's events above the high-water mark; returns the rows added"""
+        try:
+            with self._lock:
+                day = self.today()
+                if day != self.day:
+                    self._reset(day)
+
+                added = self._tail(day)
+                now = time.monotonic()
+                if self.last_verify is None:
+                    self.last_verify = now
+                elif now - self.last_verify >= self.verify_interval:
+                    self.last_verify = now
+                    if self._rows_up_to_mark(day) != self.rows:
+                        print(f"Live daily state of {day} is missing rows, reloading")
+                        self._reset(day)
+                        added = self._tail(day)
+                        self.last_verify = now
+
+                self.last_poll = datetime.now()
+                self.last_error = None
+                count("live_rows", added)
+                return added
+
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error polling live daily events: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def _tail(self, day):
+        """Fetch the day's rows above the high-water mark in id order"""
+        added = 0
+        while True:
+            builder = EventQueryBuilder(day, day, dialect=self.engine.dialect.name)
+            if self.high_water_mark is not None:
+                builder.where_after_id(self.high_water_mark)
+            query, params = builder.select(
+                ", ".join(FETCH_COLUMNS), order_by="id", limit=self.batch_size
+            )
+            with connect(self.engine) as conn:
+                chunk = pd.read_sql_query(query, conn, params=params)
+            count("live_queries")
+            if len(chunk):
+                self._add(compact_events(chunk))
+                added += len(chunk)
+            if len(chunk) < self.batch_size:
+                return added
+
+    def ensure_fresh(self):
+        """Poll now unless the background thread polled within its interval"""
+        with self._lock:
+            fresh = (
+                self.running
+                and self.day == self.today()
+                and self.last_poll is not None
+                and (datetime.now() - self.last_poll).total_seconds()
+                < 2 * self.poll_interval
+            )
+        if not fresh:
+            self.poll()
+
+    def events(self, filters=None):
+        """Today's events in time order, optionally Filter.apply_filters'd"""
+        with self._lock:
+            if self._events is None:
+                events = concat_events(self._parts)
+                # Rows arrive in id order; reports list them by time
+                if not events["date_and_time"].is_monotonic_increasing:
+                    events = events.sort_values("date_and_time", kind="stable")
+                    events = events.reset_index(drop=True)
+                self._events = events
+                self._parts = [self._events] if len(self._events) else []
+            events = self._events
+        if filters:
+            events = Filter(events).apply_filters(filters)
+        return events
+
+    def version(self):
+        """Token that changes whenever today's state does"""
+        with self._lock:
+            return ["live", str(self.day), self.high_water_mark, self.rows]
+
+    def snapshot(self, filters=None):
+        """Arrival state of today as JSON-ready data.
+
+        Person group filters select from the kept state; a device filter
+        needs the scans themselves, so the state is rebuilt from them.
+        """
+        filters = filters or {}
+        if "device_name" in filters:
+            people = person_arrivals(self.events(filters)).to_dict("records")
+        else:
+            with self._lock:
+                people = [dict(p) for p in self._people.values()]
+            if "person_group" in filters:
+                people = [p for p in people if p["person_group"] == filters["person_group"]]
+            if "person_groups" in filters:
+                groups = set(filters["person_groups"])
+                people = [p for p in people if p["person_group"] in groups]
+
+        for person in people:
+            for name in ("first_in", "last_out", "last_seen"):
+                person[name] = _timestamp(person[name])
+            person["inside"] = bool(person["inside"])
+            person["records"] = int(person["records"])
+            if pd.isna(person["person_group"]):
+                person["person_group"] = None
+        # In order of arrival, people without an entry scan last
+        people.sort(key=lambda p: (p["first_in"] is None, p["first_in"] or "", p["person_name"]))
+
+        with self._lock:
+            return {
+                "date": self.day.isoformat() if self.day else None,
+                "high_water_mark": self.high_water_mark,
+                "records": self.rows,
+                "updated_at": self.last_poll.isoformat(timespec="seconds")
+                if self.last_poll
+                else None,
+                "error": self.last_error,
+                "arrived": sum(1 for p in people if p["first_in"] is not None),
+                "inside": sum(1 for p in people if p["inside"]),
+                "people": people,
+            }
+
+    def _listen(self):
+        """psycopg2 connection LISTENing on notify_channel, or None"""
+        if not self.notify_channel or self.engine.dialect.name != "postgresql":
+            return None
+        if self._listener is None:
+            raw = self.engine.raw_connection()
+            driver = raw.driver_connection
+            if not hasattr(driver, "notifies") or not hasattr(driver, "poll"):
+                raw.close()
+                self.notify_channel = None
+                print("Live daily: LISTEN needs psycopg2, falling back to polling")
+                return None
+            # Kept out of the pool: a LISTENing session is not reusable
+            raw.detach()
+            driver.autocommit = True
+            with driver.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.notify_channel}"')
+            self._listener = driver
+        return self._listener
+
+    def _close_listener(self):
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+
+    def wait(self):
+        """Sleep until the next poll is due or a NOTIFY arrives"""
+        try:
+            listener = self._listen()
+        except Exception as e:
+            print(f"Error listening for {self.notify_channel}: {str(e)}")
+            listener = None
+        if listener is None:
+            self._stop.wait(self.poll_interval)
+            return
+        try:
+            if select.select([listener], [], [], self.poll_interval)[0]:
+                listener.poll()
+                listener.notifies.clear()
+        except Exception as e:
+            print(f"Error waiting for {self.notify_channel}: {str(e)}")
+            self._close_listener()
+            self._stop.wait(self.poll_interval)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background polling thread once per process"""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="live-daily", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                added = self.poll()
+                if added:
+                    print(f"Live daily: {added} new events, {self.rows} today")
+            except Exception:
+                # Logged by poll; the next poll retries
+                pass
+            self.wait()
+        self._close_listener()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_interval + 5)
+            self._thread = None
+
+
+def install_notify_trigger(engine, channel=NOTIFY_CHANNEL):
+    """Create a statement-level trigger that NOTIFYs ``channel`` on inserts into users"""
+    if engine.dialect.name != "postgresql":
+        raise ValueError("NOTIFY triggers need PostgreSQL")
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", channel):
+        raise ValueError(f"Invalid channel name: {channel}")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                CREATE OR REPLACE FUNCTION {channel}_notify() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('{channel}', '');
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """
+            )
+        )
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {channel}_notify ON users"))
+        conn.execute(
+            text(
+                f"""
+                CREATE TRIGGER {channel}_notify AFTER INSERT ON users
+                FOR EACH STATEMENT EXECUTE FUNCTION {channel}_notify()
+            """
+            )
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Tail today's access events and print the arrival state"
+    )
+    parser.add_argument("--url", required=True, help="SQLAlchemy database URL")
+    parser.add_argument("--date", help="YYYY-MM-DD to tail instead of today")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between polls")
+    parser.add_argument("--listen", action="store_true", help="wake up on NOTIFY (Postgres)")
+    parser.add_argument(
+        "--install-trigger",
+        action="store_true",
+        help="create the users insert trigger that NOTIFYs the channel, then exit",
+    )
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    args = parser.parse_args(argv)
+
+    db_config = {"url": args.url}
+    if args.install_trigger:
+        install_notify_trigger(get_engine(db_config))
+        print(f"Trigger installed, inserts into users notify {NOTIFY_CHANNEL}")
+        return
+
+    day = pd.Timestamp(args.date).date() if args.date else None
+    live = LiveDaily(
+        db_config,
+        poll_interval=args.interval,
+        notify_channel=NOTIFY_CHANNEL if args.listen else None,
+        today=(lambda: day) if day else None,
+    )
+    while True:
+        started = time.perf_counter()
+        added = live.poll()
+        snapshot = live.snapshot()
+        snapshot.pop("people")
+        snapshot["new_rows"] = added
+        snapshot["poll_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(json.dumps(snapshot, ensure_ascii=False))
+        if args.once:
+            break
+        live.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import cProfile
+import glob
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the report duration histogram buckets
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+PROFILE_FILE = "profile.prof"
+PROFILE_TEXT_FILE = "profile.txt"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS (Linux); returns whether it was reset"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process since start or reset_peak_rss"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and cannot be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def profiled(directory):
+    """cProfile the block into ``directory``: a pstats dump plus a text summary"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, PROFILE_FILE))
+        with open(os.path.join(directory, PROFILE_TEXT_FILE), "w") as f:
+            stats = pstats.Stats(profiler, stream=f)
+            stats.sort_stats("cumulative").print_stats(60)
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class ReportMetrics:
+    """Report pipeline metrics in Prometheus text format.
+
+    Jobs run in worker processes and hand their StageTimings back to the
+    app, which records them here (see JobManager._finish). With several app
+    worker processes (``uvicorn --workers 4``) a scrape reaches just one of
+    them, so given a ``directory`` shared by the workers each one writes its
+    totals to ``<pid>.json`` there and ``render`` adds up every file. Files
+    of processes no longer running are removed on start, so the totals
+    restart with the server. Without a directory the totals are this
+    process's only.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS, directory=None):
+        self.buckets = tuple(buckets)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.reports = {}
+        self.duration_buckets = [0] * len(self.buckets)
+        self.duration_count = 0
+        self.duration_sum = 0.0
+        self.stage_seconds = {}
+        self.stage_count = {}
+        self.counters = {}
+        self.peak_rss = 0
+        self.last_peak_rss = 0
+        self.last_observed = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._remove_stale_files()
+
+    def _path(self, pid=None):
+        return os.path.join(self.directory, f"{pid or os.getpid()}.json")
+
+    def _remove_stale_files(self):
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                pid = int(os.path.basename(path)[: -len(".json")])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os.remove(path)
+            except (ValueError, OSError):
+                continue
+
+    def _state(self):
+        return {
+            "reports": [[*key, n] for key, n in self.reports.items()],
+            "duration_buckets": self.duration_buckets,
+            "duration_count": self.duration_count,
+            "duration_sum": self.duration_sum,
+            "stage_seconds": self.stage_seconds,
+            "stage_count": self.stage_count,
+            "counters": self.counters,
+            "peak_rss": self.peak_rss,
+            "last_peak_rss": self.last_peak_rss,
+            "last_observed": self.last_observed,
+        }
+
+    def _write_state(self):
+        path = self._path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            # Counters may be numpy scalars
+            json.dump(self._state(), f, default=lambda value: value.item())
+        os.replace(tmp_path, path)
+
+    def _states(self):
+        """This process's totals plus those other workers wrote to the directory"""
+        states = [self._state()]
+        if not self.directory:
+            return states
+        own = self._path()
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    states.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return states
+
+    def _totals(self):
+        """The counters of every process, added up"""
+        totals = {
+            "reports": {},
+            "duration_buckets": [0] * len(self.buckets),
+            "duration_count": 0,
+            "duration_sum": 0.0,
+            "stage_seconds": {},
+            "stage_count": {},
+            "counters": {},
+            "peak_rss": 0,
+            "last_peak_rss": 0,
+        }
+        last_observed = -1.0
+        for state in self._states():
+            for mode, status, n in state["reports"]:
+                key = (mode, status)
+                totals["reports"][key] = totals["reports"].get(key, 0) + n
+            totals["duration_buckets"] = [
+                a + b
+                for a, b in zip(totals["duration_buckets"], state["duration_buckets"])
+            ]
+            totals["duration_count"] += state["duration_count"]
+            totals["duration_sum"] += state["duration_sum"]
+            for field in ("stage_seconds", "stage_count", "counters"):
+                for name, value in state[field].items():
+                    totals[field][name] = totals[field].get(name, 0) + value
+            totals["peak_rss"] = max(totals["peak_rss"], state["peak_rss"])
+            if state["last_observed"] > last_observed:
+                last_observed = state["last_observed"]
+                totals["last_peak_rss"] = state["last_peak_rss"]
+        return totals
+
+    def observe(self, status, timings=None, mode="job"):
+        """Record one finished report; ``timings`` is a StageTimings.as_dict().
+
+        ``mode`` is "job" for queued reports, "stream" for streamed CSV and
+        "live" for daily reports answered from the live event tail.
+        """
+        with self._lock:
+            key = (mode, status)
+            self.reports[key] = self.reports.get(key, 0) + 1
+            if timings:
+                self._observe_timings(timings)
+            if self.directory:
+                self._write_state()
+
+    def _observe_timings(self, timings):
+        total = timings.get("total", 0.0)
+        self.duration_count += 1
+        self.duration_sum += total
+        for i, bound in enumerate(self.buckets):
+            if total <= bound:
+                self.duration_buckets[i] += 1
+
+        for name, seconds in timings.get("stages", {}).items():
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_count[name] = self.stage_count.get(name, 0) + 1
+
+        for name, value in timings.get("counters", {}).items():
+            if name == "peak_rss_bytes":
+                self.last_peak_rss = value
+                self.last_observed = time.time()
+                self.peak_rss = max(self.peak_rss, value)
+            else:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def render(self, db_status=None):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_labels(**labels)} {_value(value)}")
+
+        with self._lock:
+            totals = self._totals()
+        metric(
+            "report_requests_total",
+            "counter",
+            "Finished reports by mode (job, stream or live) and status",
+            [
+                ("", {"mode": mode, "status": status}, n)
+                for (mode, status), n in sorted(totals["reports"].items())
+            ],
+        )
+        buckets = [
+            ("_bucket", {"le": str(bound)}, n)
+            for bound, n in zip(self.buckets, totals["duration_buckets"])
+        ]
+        buckets.append(("_bucket", {"le": "+Inf"}, totals["duration_count"]))
+        metric(
+            "report_duration_seconds",
+            "histogram",
+            "Wall time of finished reports, all stages",
+            buckets
+            + [
+                ("_sum", {}, round(totals["duration_sum"], 6)),
+                ("_count", {}, totals["duration_count"]),
+            ],
+        )
+        metric(
+            "report_stage_seconds",
+            "summary",
+            "Time spent per pipeline stage",
+            [
+                sample
+                for name in sorted(totals["stage_seconds"])
+                for sample in (
+                    ("_sum", {"stage": name}, round(totals["stage_seconds"][name], 6)),
+                    ("_count", {"stage": name}, totals["stage_count"][name]),
+                )
+            ],
+        )
+        metric(
+            "report_pipeline_total",
+            "counter",
+            "Pipeline counters (queries, rows fetched, output bytes, ...)",
+            [("", {"name": name}, v) for name, v in sorted(totals["counters"].items())],
+        )
+        metric(
+            "report_peak_rss_bytes",
+            "gauge",
+            "Highest peak RSS of a report process",
+            [("", {}, totals["peak_rss"])],
+        )
+        metric(
+            "report_last_peak_rss_bytes",
+            "gauge",
+            "Peak RSS of the last finished report",
+            [("", {}, totals["last_peak_rss"])],
+        )
+
+        if db_status:
+            # Pools are per process: a scrape sees the worker that answered it
+            pid = os.getpid()
+            metric(
+                "report_db_pool_connections",
+                "gauge",
+                "Connection pool of this process",
+                [
+                    ("", {"state": name, "pid": pid}, db_status[name])
+                    for name in ("size", "checkedin", "checkedout", "overflow")
+                    if name in db_status
+                ],
+            )
+            metric(
+                "report_db_queries_total",
+                "counter",
+                "Queries run by this process",
+                [("", {"pid": pid}, db_status.get("queries", 0))],
+            )
+            metric(
+                "report_db_query_seconds_total",
+                "counter",
+                "Query time of this process",
+                [("", {"pid": pid}, db_status.get("query_time_total", 0.0))],
+            )
+            metric(
+                "report_db_checkout_wait_seconds_total",
+                "counter",
+                "Time this process waited for pooled connections",
+                [("", {"pid": pid}, db_status.get("checkout_wait_total", 0.0))],
+            )
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,107 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from pipeline import StageTimings, current_timings
+
+# Days per partition of a parallel report
+PARTITION_DAYS = 7
+
+
+def date_partitions(start_date, end_date, days=PARTITION_DAYS):
+    """Consecutive (start, end) ranges of at most ``days`` days covering the range"""
+    partitions = []
+    start = start_date
+    while start <= end_date:
+        end = min(start + timedelta(days=days - 1), end_date)
+        partitions.append((start, end))
+        start = end + timedelta(days=1)
+    return partitions
+
+
+# Set in each pool process by _init_worker
+_worker_generator = None
+
+
+def _init_worker(report_generator):
+    global _worker_generator
+    _worker_generator = report_generator
+    # Files written by workers are handed back, never deleted on a timer
+    _worker_generator.cleanup_delay = None
+
+
+def _run_partition(method, args, kwargs):
+    """Pool entry point: one ReportGenerator method call plus its timings"""
+    timings = StageTimings()
+    with timings.activate():
+        partial = getattr(_worker_generator, method)(*args, **kwargs)
+    return partial, timings.as_dict()
+
+
+class PartitionPool:
+    """Process pool fetching and pre-aggregating report partitions.
+
+    Each worker holds its own copy of the ReportGenerator, so it opens its
+    own pooled database connections (or reads the event store directly).
+    """
+
+    def __init__(self, report_generator, max_workers):
+        self.report_generator = report_generator
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Process pool, started on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.report_generator,),
+                )
+            return self._executor
+
+    def map(self, method, partitions, **kwargs):
+        """Partials of each (start, end) partition, yielded in partition order"""
+        return self.starmap(method, partitions, **kwargs)
+
+    def starmap(self, method, arguments, **kwargs):
+        """Results of ``method(*args, **kwargs)`` per args tuple, yielded in order.
+
+        Worker stage times are recorded into the active timings under
+        ``partition_<stage>`` (summed CPU-side time, not wall time) and
+        their counters are added as they are.
+        """
+        futures = [
+            self.executor.submit(_run_partition, method, tuple(args), kwargs)
+            for args in arguments
+        ]
+        timings = current_timings()
+        try:
+            for future in futures:
+                partial, partition_timings = future.result()
+                if timings is not None:
+                    timings.merge(
+                        {
+                            "stages": {
+                                f"partition_{name}": seconds
+                                for name, seconds in partition_timings["stages"].items()
+                            },
+                            "counters": partition_timings["counters"],
+                        }
+                    )
+                    timings.count("partitions")
+                yield partial
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
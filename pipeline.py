@@ -0,0 +1,242 @@
+import contextvars
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from report_formats import check_output_format
+from sessions import SESSION_PADDING
+
+REPORT_TYPES = ("daily", "weekly", "monthly", "quarterly", "custom")
+
+# Timings of the report being produced in the current thread/task
+_current_timings = contextvars.ContextVar("report_timings", default=None)
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report whose job was cancelled while it ran"""
+
+
+class StageTimings:
+    """Wall time per pipeline stage plus counters (queries, rendered files, rows).
+
+    ``cancelled``, if set, is a callable checked at the start of every stage
+    and before every chunk of a ``timed`` iterable; once it returns True the
+    report stops with ReportCancelled.
+    """
+
+    def __init__(self, cancelled=None):
+        self.stages = {}
+        self.counters = {}
+        self.cancelled = cancelled
+
+    def check_cancelled(self):
+        if self.cancelled is not None and self.cancelled():
+            raise ReportCancelled("Report cancelled")
+
+    @contextmanager
+    def stage(self, name):
+        self.check_cancelled()
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def maximum(self, name, value):
+        """Keep the largest value seen for a counter (e.g. peak memory)"""
+        self.counters[name] = max(self.counters.get(name, 0), value)
+
+    def timed(self, name, iterable):
+        """Yield from iterable, charging the time spent producing items to a stage"""
+        iterator = iter(iterable)
+        while True:
+            self.check_cancelled()
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - started)
+                return
+            self.add(name, time.perf_counter() - started)
+            yield item
+
+    @contextmanager
+    def activate(self):
+        """Make these the timings that stage()/count() record into"""
+        token = _current_timings.set(self)
+        try:
+            yield self
+        finally:
+            _current_timings.reset(token)
+
+    def merge(self, other):
+        for name, seconds in other.get("stages", {}).items():
+            self.add(name, seconds)
+        for name, value in other.get("counters", {}).items():
+            self.count(name, value)
+
+    def as_dict(self):
+        return {
+            "stages": {name: round(s, 4) for name, s in self.stages.items()},
+            "total": round(sum(self.stages.values()), 4),
+            "counters": dict(self.counters),
+        }
+
+
+def current_timings():
+    return _current_timings.get()
+
+
+def stage(name):
+    """Time a block against the active report, if any"""
+    timings = _current_timings.get()
+    return timings.stage(name) if timings is not None else nullcontext()
+
+
+def count(name, value=1):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.count(name, value)
+
+
+def timed(name, iterable):
+    timings = _current_timings.get()
+    return timings.timed(name, iterable) if timings is not None else iterable
+
+
+def report_date_range(report_type, today, start_str=None, end_str=None):
+    """Resolve the date range of a report type; raises ValueError with a user message"""
+    if report_type == "custom":
+        if not start_str or not end_str:
+            raise ValueError(
+                "Для пользовательских отчетов необходимы дата начала и окончания."
+            )
+        try:
+            start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_str, "%Y-%m-%d").date()
+        except ValueError as e:
+            raise ValueError(f"Неверный формат даты: {str(e)}")
+
+        if start_date > end_date:
+            raise ValueError(
+                "Неверный формат даты: Дата начала не может быть позже даты окончания."
+            )
+        return start_date, end_date
+
+    if report_type == "daily":
+        return today, today
+    if report_type == "weekly":
+        start_date = today - timedelta(days=today.weekday())
+        return start_date, start_date + timedelta(days=6)
+    if report_type == "monthly":
+        start_date = today.replace(day=1)
+        return start_date, start_date + relativedelta(months=1, days=-1)
+    if report_type == "quarterly":
+        current_quarter = (today.month - 1) // 3
+        quarter_month = current_quarter * 3 + 1
+        start_date = today.replace(month=quarter_month, day=1)
+        return start_date, start_date + relativedelta(months=3, days=-1)
+
+    raise ValueError(f"Неверный тип отчета: {report_type}")
+
+
+class ReportPlan:
+    """How one report is produced, decided once before anything is fetched.
+
+    ``source`` is "events" (raw rows) or "rollup" (summary-only), ``kind`` is
+    "standard", "custom" (timetable matching) or "batch" (one standard
+    report per filter set from a single fetch). ``filters`` and
+    ``timetable_groups`` are pushed into the single events query.
+    ``output_format`` other than "xlsx" writes only the detailed rows.
+    """
+
+    def __init__(self, report_type, start_date, end_date, additional_params=None):
+        self.report_type = report_type
+        self.start_date = start_date
+        self.end_date = end_date
+        self.params = dict(additional_params or {})
+        self.source = "rollup" if self.params.get("summary_only") else "events"
+        if "batch" in self.params:
+            self.kind = "batch"
+            self.source = "events"
+        elif "work_timetable" in self.params or "timetable_sha256" in self.params:
+            self.kind = "custom"
+        else:
+            self.kind = "standard"
+        check_output_format(
+            self.output_format,
+            summary_only=self.source == "rollup",
+            batch=self.kind == "batch",
+        )
+        self.filters = self.params if self.kind == "standard" else None
+        self.timetable_groups = None
+        # Shift times for the Attendance sheet (see attendance.read_shifts)
+        self.shifts = None
+        self.chunksize = None
+        # Date partitions generated in parallel (see partitions.date_partitions)
+        self.partitions = None
+
+    @property
+    def work_timetable(self):
+        return self.params.get("work_timetable")
+
+    @property
+    def timetable_sha256(self):
+        """Content hash of a timetable already in the TimetableCache"""
+        return self.params.get("timetable_sha256")
+
+    @property
+    def batch(self):
+        """Filter sets of a batch report (see batch.filter_sets)"""
+        return self.params.get("batch")
+
+    @property
+    def batch_layout(self):
+        return self.params.get("batch_layout", "zip")
+
+    @property
+    def output_format(self):
+        """One of report_formats.OUTPUT_FORMATS"""
+        return self.params.get("output_format") or "xlsx"
+
+    @property
+    def flat(self):
+        """Whether the report is the detailed rows alone (CSV or Parquet)"""
+        return self.output_format != "xlsx"
+
+    @property
+    def fetch_start(self):
+        """First day of events to fetch; padded when sessions are paired"""
+        if self.shifts is not None and self.source == "events":
+            return self.start_date - SESSION_PADDING
+        return self.start_date
+
+    @property
+    def fetch_end(self):
+        if self.shifts is not None and self.source == "events":
+            return self.end_date + SESSION_PADDING
+        return self.end_date
+
+    def describe(self):
+        return {
+            "report_type": self.report_type,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "fetch_start": self.fetch_start.isoformat(),
+            "fetch_end": self.fetch_end.isoformat(),
+            "source": self.source,
+            "kind": self.kind,
+            "output_format": self.output_format,
+            "streaming": bool(self.chunksize),
+            "partitions": len(self.partitions or ()),
+            "timetable_groups": len(self.timetable_groups or ()),
+            "attendance": self.shifts is not None,
+        }
@@ -0,0 +1,142 @@
+from sqlalchemy import bindparam, text
+
+from filter import read_person_groups
+from utils import GROUP_WHITESPACE
+
+# Columns selected for report events, in order
+EVENT_COLUMNS = [
+    "id",
+    "date_and_time",
+    "date",
+    "time",
+    "device_name",
+    "reader_name",
+    "person_name",
+    "person_group",
+]
+
+# Columns actually fetched; date and time are derived from date_and_time
+FETCH_COLUMNS = [c for c in EVENT_COLUMNS if c not in ("date", "time")]
+
+
+# Regex class of GROUP_WHITESPACE; Postgres \s follows the server locale instead
+_WHITESPACE_CLASS = "[" + "".join(f"\\u{ord(c):04x}" for c in GROUP_WHITESPACE) + "]"
+
+
+def processed_group_sql(dialect, column="person_group"):
+    """SQL for ReportGenerator.process_person_group: last segment after '>', stripped"""
+    if dialect == "postgresql":
+        segment = f"regexp_replace({column}, '^.*>', '')"
+        return (
+            f"regexp_replace({segment}, "
+            f"'^{_WHITESPACE_CLASS}+|{_WHITESPACE_CLASS}+$', '', 'g')"
+        )
+    # Other dialects (the SQLite stand-in) get the function registered by db.py
+    return f"last_group_segment({column})"
+
+
+class EventQueryBuilder:
+    """Build the parameterized events query with report filters pushed into SQL"""
+
+    def __init__(self, start_date, end_date, dialect="postgresql"):
+        self.dialect = dialect
+        self.conditions = ["date BETWEEN :start_date AND :end_date"]
+        self.params = {
+            "start_date": start_date.strftime("%Y-%m-%d"),
+            "end_date": end_date.strftime("%Y-%m-%d"),
+        }
+        self.expanding = []
+
+    def _in_list(self, expression, name, values):
+        """Membership test: ANY(:array) on Postgres, expanding IN elsewhere"""
+        self.params[name] = list(values)
+        if self.dialect == "postgresql":
+            return f"{expression} = ANY(:{name})"
+        self.expanding.append(name)
+        return f"{expression} IN :{name}"
+
+    def where_after_id(self, high_water_mark):
+        """Keep rows inserted after the row with id ``high_water_mark``"""
+        self.conditions.append("id > :after_id")
+        self.params["after_id"] = high_water_mark
+        return self
+
+    def where_up_to_id(self, high_water_mark):
+        """Keep rows up to and including the row with id ``high_water_mark``"""
+        self.conditions.append("id <= :up_to_id")
+        self.params["up_to_id"] = high_water_mark
+        return self
+
+    def where_device(self, device_name):
+        self.conditions.append("device_name = :device_name")
+        self.params["device_name"] = device_name
+        return self
+
+    def where_person_group(self, person_group):
+        self.conditions.append("person_group = :person_group")
+        self.params["person_group"] = person_group
+        return self
+
+    def where_person_groups(self, person_groups):
+        self.conditions.append(
+            self._in_list("person_group", "person_groups", person_groups)
+        )
+        return self
+
+    def where_processed_groups(self, groups):
+        """Keep rows whose processed group (last '>' segment) is in groups"""
+        self.conditions.append(
+            self._in_list(processed_group_sql(self.dialect), "processed_groups", groups)
+        )
+        return self
+
+    def apply_filters(self, filters):
+        """Translate Filter.apply_filters parameters into WHERE clauses"""
+        if "device_name" in filters:
+            self.where_device(filters["device_name"])
+        if "person_group" in filters:
+            self.where_person_group(filters["person_group"])
+        if "person_group_excel" in filters:
+            self.where_person_groups(read_person_groups(filters["person_group_excel"]))
+        if "person_groups" in filters:
+            self.where_person_groups(filters["person_groups"])
+        return self
+
+    def where_clause(self):
+        return " AND ".join(self.conditions)
+
+    def _text(self, sql):
+        query = text(sql)
+        if self.expanding:
+            query = query.bindparams(
+                *[bindparam(name, expanding=True) for name in self.expanding]
+            )
+        return query
+
+    def select(self, columns, table="users", group_by=None, order_by=None, limit=None):
+        """Return a SELECT over ``table`` with the accumulated WHERE clause"""
+        sql = f"""
+            SELECT
+                {columns}
+            FROM {table}
+            WHERE {self.where_clause()}
+        """
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._text(sql), dict(self.params)
+
+    def build(self):
+        """Return the events query and its parameters"""
+        return self.select(", ".join(FETCH_COLUMNS), order_by="date_and_time")
+
+    def build_group_counts(self, table="users", count="COUNT(*)"):
+        """Return a query counting events per processed group"""
+        return self.select(
+            f"{processed_group_sql(self.dialect)} AS processed_group, {count} AS records",
+            table=table,
+            group_by="1",
+        )
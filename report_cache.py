@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+# Bump when report contents change so old entries stop matching
+CACHE_VERSION = 4
+
+# Form fields that never change the generated file
+IGNORED_PARAMS = {"report_type", "start_date", "end_date", "use_timetable"}
+
+# Params holding server-side file paths; their content hash goes into the key
+FILE_PARAMS = {"work_timetable", "person_group_excel"}
+
+
+def file_sha256(path, block_size=1 << 20):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_params(additional_params):
+    """Params that affect the report, with file paths replaced by content hashes"""
+    normalized = {}
+    for key, value in sorted((additional_params or {}).items()):
+        if key in IGNORED_PARAMS:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ("", None):
+            continue
+        if key in FILE_PARAMS:
+            value = file_sha256(value)
+        normalized[key] = value
+    return normalized
+
+
+class ReportCache:
+    """On-disk cache of generated report files.
+
+    Entries live in ``<directory>/<key>/<report file name>`` so the download
+    keeps its original name. The file's mtime is its creation time and the
+    directory's mtime its last use: entries older than ``max_age`` seconds are
+    dropped, and the least recently used ones go once the cache grows past
+    ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_bytes=2 * 1024**3,
+        max_age=7 * 24 * 3600,
+        closed_after_days=1,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Ranges ending this many days before today no longer receive events
+        self.closed_after_days = closed_after_days
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def is_closed(self, end_date, today=None):
+        """Whether no more events are expected for a range ending on end_date"""
+        today = today or date.today()
+        return end_date <= today - timedelta(days=self.closed_after_days)
+
+    def make_key(
+        self, report_type, start_date, end_date, additional_params, data_version
+    ):
+        """Cache key for a report request at a given data version"""
+        payload = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "report_type": report_type,
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+                "params": normalize_params(additional_params),
+                "data_version": data_version,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Path of the cached report, or None"""
+        entry_dir = self._entry_dir(key)
+        try:
+            names = os.listdir(entry_dir)
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+
+        path = os.path.join(entry_dir, names[0])
+        if time.time() - os.path.getmtime(path) > self.max_age:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # Touch the entry so LRU eviction sees it as recently used
+        os.utime(entry_dir)
+        return path
+
+    def put(self, key, report_path):
+        """Copy a generated report into the cache and return the cached path"""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        # copy2 keeps the report's mtime, which dates the entry for max_age
+        shutil.copy2(report_path, os.path.join(tmp_dir, os.path.basename(report_path)))
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another worker stored the same report first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+        return self.get(key)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith(".tmp-"):
+                continue
+            entry_dir = os.path.join(self.directory, name)
+            try:
+                paths = [os.path.join(entry_dir, f) for f in os.listdir(entry_dir)]
+                created = min((os.path.getmtime(p) for p in paths), default=0)
+                size = sum(os.path.getsize(p) for p in paths)
+                entries.append(
+                    (os.path.getmtime(entry_dir), created, size, entry_dir)
+                )
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over the size limit"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for last_used, created, size, entry_dir in self._entries():
+                if now - created > self.max_age:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                else:
+                    entries.append((last_used, size, entry_dir))
+
+            total = sum(size for _, size, _ in entries)
+            for last_used, size, entry_dir in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
@@ -0,0 +1,144 @@
+import csv
+import io
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only the Parquet format needs it
+    pa = None
+
+from query_builder import EVENT_COLUMNS
+
+OUTPUT_FORMATS = ("xlsx", "csv", "csv.gz", "parquet")
+
+# Formats sent to the client as they are produced, without a report file
+STREAMED_FORMATS = ("csv", "csv.gz")
+
+CONTENT_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "csv.gz": "application/gzip",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def check_output_format(output_format, summary_only=False, batch=False):
+    """Raise ValueError with a user message for an unusable output format"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Неверный формат отчета: {output_format}")
+    if output_format != "xlsx" and (summary_only or batch):
+        raise ValueError(
+            f"Формат {output_format} доступен только для подробных данных, "
+            "сводки и пакеты формируются в xlsx."
+        )
+    if output_format == "parquet" and pa is None:
+        raise ValueError("Формат parquet недоступен: не установлен pyarrow.")
+
+
+def content_type(path):
+    """Content type of a report file by its extension, or None"""
+    for output_format in sorted(CONTENT_TYPES, key=len, reverse=True):
+        if path.endswith(f".{output_format}"):
+            return CONTENT_TYPES[output_format]
+    return None
+
+
+class CsvEncoder:
+    """Detailed Data rows as CSV bytes, optionally one gzip stream"""
+
+    def __init__(self, compress=False):
+        self.compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def _encode(self, text):
+        data = text.encode("utf-8")
+        return self.compressor.compress(data) if self.compressor else data
+
+    def header(self):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(EVENT_COLUMNS)
+        return self._encode(buffer.getvalue())
+
+    def encode(self, frame):
+        if not len(frame):
+            return b""
+        return self._encode(frame[EVENT_COLUMNS].to_csv(index=False, header=False))
+
+    def flush(self):
+        return self.compressor.flush() if self.compressor else b""
+
+
+def csv_chunks(frames, compress=False):
+    """CSV bytes of event frames, one block per frame after the header.
+
+    The header is sent even without rows, so an empty report is a
+    header-only file rather than an empty response.
+    """
+    encoder = CsvEncoder(compress)
+    yield encoder.header()
+    for frame in frames:
+        block = encoder.encode(frame)
+        if block:
+            yield block
+    tail = encoder.flush()
+    if tail:
+        yield tail
+
+
+def parquet_schema():
+    """Columns of the Detailed Data sheet as Parquet types"""
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("date_and_time", pa.timestamp("us")),
+            ("date", pa.date32()),
+            ("time", pa.time64("us")),
+            ("device_name", pa.string()),
+            ("reader_name", pa.string()),
+            ("person_name", pa.string()),
+            ("person_group", pa.string()),
+        ]
+    )
+
+
+class FlatReportWriter:
+    """Write event frames to a CSV, gzipped CSV or Parquet report file.
+
+    Frames are written as they are passed in (a Parquet row group each),
+    so memory is bounded by one frame. Use as a context manager.
+    """
+
+    def __init__(self, path, output_format):
+        self.path = path
+        self.output_format = output_format
+        if output_format == "parquet":
+            self.schema = parquet_schema()
+            self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self.encoder = CsvEncoder(compress=output_format == "csv.gz")
+            self.writer = open(path, "wb")
+            self.writer.write(self.encoder.header())
+
+    def write(self, frame):
+        if not len(frame):
+            return
+        if self.output_format != "parquet":
+            self.writer.write(self.encoder.encode(frame))
+            return
+        # Categories differ per frame, so each column is cast to the schema
+        columns = [
+            pa.array(frame[name], from_pandas=True).cast(field.type)
+            for name, field in zip(self.schema.names, self.schema)
+        ]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        if self.output_format != "parquet":
+            self.writer.write(self.encoder.flush())
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
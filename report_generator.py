@@ -1,58 +1,337 @@
+import asyncio
 import pandas as pd
-from sqlalchemy import create_engine, text
-from datetime import datetime
+from datetime import timedelta
 import os
-from openpyxl.utils import get_column_letter
+import shutil
+import tempfile
 import traceback
+import zipfile
 from filter import Filter
+from db import get_async_engine, get_engine, connect, pool_status
+from query_builder import EVENT_COLUMNS, EventQueryBuilder
+from utils import group_value_counts, process_person_group, process_person_groups
+from rollup import DailyRollup
+from sessions import (
+    SESSION_EVENT_COLUMNS,
+    SESSION_PADDING,
+    SessionPairer,
+    build_sessions,
+    match_shifts,
+    session_presence,
+    sessions_in_range,
+    sessions_sheet,
+)
+from attendance import attendance_sheet, crosses_midnight, read_shifts
+from excel_writer import ExcelReportWriter
+from event_frame import compact_events, concat_events, events_in_range, expand_events
+from pipeline import ReportPlan, StageTimings, count, stage, timed
+from partitions import PARTITION_DAYS, PartitionPool, date_partitions
+from batch import fetch_filters, unique_titles
+from report_formats import CsvEncoder, FlatReportWriter, csv_chunks
+from metrics import peak_rss_bytes, reset_peak_rss
 import threading, time
+from collections import Counter
+
+
+async def _in_executor(iterator):
+    """Advance a blocking iterator in the default thread executor"""
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def _compact_rows(rows, columns):
+    return compact_events(pd.DataFrame.from_records(rows, columns=columns))
+
+
+def _encode_events(encoder, chunk):
+    return encoder.encode(expand_events(chunk))
+
 
 class ReportGenerator:
-    def __init__(self, db_config):
+    def __init__(
+        self,
+        db_config,
+        excel_backend=None,
+        cache=None,
+        timetable_cache=None,
+        event_store=None,
+        parallel_workers=None,
+        partition_days=PARTITION_DAYS,
+    ):
         self.db_config = db_config
+        # "xlsxwriter" or "openpyxl"; None picks xlsxwriter when installed
+        self.excel_backend = excel_backend
+        # Optional ReportCache for finished report files
+        self.cache = cache
+        # Optional TimetableCache of parsed work timetables
+        self.timetable_cache = timetable_cache
+        # Optional EventStore serving closed days instead of the database
+        self.event_store = event_store
+        # Processes for generate_parallel; None or 1 keeps reports in-process
+        self.parallel_workers = parallel_workers
+        self.partition_days = partition_days
+        # Where reports are written; None means "reports" under the cwd
+        self.output_dir = None
+        # Seconds before a written report is deleted; None keeps it
+        self.cleanup_delay = 5
+        # Rows per streamed chunk; None keeps the single-DataFrame fetch
+        self.chunksize = db_config.get("fetch_chunksize")
+        # Rows per chunk of CSV and Parquet reports, which are always streamed
+        self.flat_chunksize = self.chunksize or 50000
+
+    def __getstate__(self):
+        # Picklable for worker processes; the rollup is rebuilt on demand
+        state = self.__dict__.copy()
+        state.pop("_rollup", None)
+        state.pop("_partition_pool", None)
+        return state
+
+    @property
+    def engine(self):
+        """Process-wide pooled engine, created on first use"""
+        return get_engine(self.db_config)
+
+    @property
+    def async_engine(self):
+        """Process-wide async engine for the ASGI entry point, created on first use"""
+        return get_async_engine(self.db_config)
 
     def get_db_connection(self):
-        """Create database connection"""
-        connection_string = f"postgresql://{self.db_config['user']}:{self.db_config['password']}@{self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}"
-        return create_engine(connection_string)
+        """Return the shared pooled engine"""
+        return self.engine
+
+    @property
+    def rollup(self):
+        """Daily rollup bound to the pooled engine"""
+        if getattr(self, "_rollup", None) is None or self._rollup.engine is not self.engine:
+            self._rollup = DailyRollup(self.engine)
+        return self._rollup
+
+    def partition_pool(self):
+        """Pool for parallel reports, created on first use"""
+        if getattr(self, "_partition_pool", None) is None:
+            self._partition_pool = PartitionPool(self, self.parallel_workers)
+        return self._partition_pool
+
+    def db_metrics(self):
+        """Pool usage plus checkout-wait and query-time metrics"""
+        return pool_status(self.engine)
+
+    def query_builder(self, start_date, end_date):
+        """Events query builder for this engine's SQL dialect"""
+        return EventQueryBuilder(start_date, end_date, dialect=self.engine.dialect.name)
+
+    def build_events_query(
+        self, start_date, end_date, filters=None, timetable_groups=None
+    ):
+        """Build the access events query and its parameters.
+
+        ``filters`` takes the same keys as Filter.apply_filters and
+        ``timetable_groups`` the processed groups of a work timetable; both
+        become WHERE clauses so only matching rows leave the database.
+        """
+        builder = self.query_builder(start_date, end_date)
+        if filters:
+            builder.apply_filters(filters)
+        if timetable_groups:
+            builder.where_processed_groups(sorted(timetable_groups))
+        return builder.build()
+
+    def split_fetch_range(self, start_date, end_date):
+        """(event store range, database range) of a fetch; either may be None"""
+        stored = None
+        if self.event_store is not None:
+            stored = self.event_store.stored_range(start_date, end_date)
+        if stored is None:
+            return None, (start_date, end_date)
+        if stored[1] >= end_date:
+            return stored, None
+        return stored, (stored[1] + timedelta(days=1), end_date)
+
+    def sync_event_store(self):
+        """Mirror newly closed days into the event store, if one is configured"""
+        if self.event_store is not None:
+            self.event_store.sync(self.engine)
+
+    def fetch_data(
+        self,
+        start_date,
+        end_date,
+        chunksize=None,
+        filters=None,
+        timetable_groups=None,
+    ):
+        """Fetch data from the event store and/or the database.
+
+        Closed days held by the event store are read from it; only the rest
+        of the range is queried. With ``chunksize`` the rows are streamed and
+        an iterator of DataFrames is returned instead of a single DataFrame.
+        """
+        if chunksize:
+            return self.fetch_data_chunks(
+                start_date, end_date, chunksize, filters, timetable_groups
+            )
 
-    def fetch_data(self, start_date, end_date):
-        """Fetch data from the database"""
         try:
-            engine = self.get_db_connection()
-
-            # Convert dates to strings for SQL query
-            start_date_str = start_date.strftime("%Y-%m-%d")
-            end_date_str = end_date.strftime("%Y-%m-%d")
-
-            query = text(
-                """
-                SELECT 
-                    id,
-                    date_and_time,
-                    date,
-                    time,
-                    device_name,
-                    reader_name,
-                    person_name,
-                    person_group
-                FROM users
-                WHERE date BETWEEN :start_date AND :end_date
-                ORDER BY date_and_time
-            """
+            stored, queried = self.split_fetch_range(start_date, end_date)
+            parts = []
+            if stored:
+                with stage("fetch"):
+                    parts.append(
+                        self.event_store.read(*stored, filters, timetable_groups)
+                    )
+                count("store_reads")
+                count("rows_from_store", len(parts[-1]))
+
+            if queried:
+                query, params = self.build_events_query(
+                    *queried, filters, timetable_groups
+                )
+                with stage("fetch"), connect(self.engine) as conn:
+                    parts.append(
+                        compact_events(pd.read_sql_query(query, conn, params=params))
+                    )
+                count("events_queries")
+                count("rows_fetched", len(parts[-1]))
+
+            return parts[0] if len(parts) == 1 else concat_events(parts)
+
+        except Exception as e:
+            print(f"Error fetching data: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def fetch_data_chunks(
+        self, start_date, end_date, chunksize, filters=None, timetable_groups=None
+    ):
+        """Stream data from the event store, then the database (server-side cursor)"""
+        try:
+            stored, queried = self.split_fetch_range(start_date, end_date)
+            if stored:
+                count("store_reads")
+                for chunk in self.event_store.read_chunks(
+                    *stored, chunksize, filters, timetable_groups
+                ):
+                    count("rows_from_store", len(chunk))
+                    yield chunk
+
+            if not queried:
+                return
+            query, params = self.build_events_query(
+                *queried, filters, timetable_groups
             )
 
-            # Create parameters dictionary
-            params = {"start_date": start_date_str, "end_date": end_date_str}
+            with connect(self.engine) as conn:
+                # stream_results makes psycopg2 use a named (server-side) cursor
+                conn = conn.execution_options(
+                    stream_results=True, max_row_buffer=chunksize
+                )
+                count("events_queries")
+                for chunk in pd.read_sql_query(
+                    query, conn, params=params, chunksize=chunksize
+                ):
+                    count("rows_fetched", len(chunk))
+                    yield compact_events(chunk)
+
+        except Exception as e:
+            print(f"Error fetching data: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    async def fetch_data_chunks_async(
+        self, start_date, end_date, chunksize, filters=None, timetable_groups=None
+    ):
+        """fetch_data_chunks for an event loop, querying through the async engine.
 
-            df = pd.read_sql_query(query, engine, params=params)
-            return df
+        Event store reads and building frames from the fetched rows run in
+        the default thread executor, so the loop itself only waits.
+        """
+        try:
+            stored, queried = self.split_fetch_range(start_date, end_date)
+            if stored:
+                count("store_reads")
+                chunks = self.event_store.read_chunks(
+                    *stored, chunksize, filters, timetable_groups
+                )
+                async for chunk in _in_executor(chunks):
+                    count("rows_from_store", len(chunk))
+                    yield chunk
+
+            if not queried:
+                return
+            query, params = self.build_events_query(
+                *queried, filters, timetable_groups
+            )
+
+            async with self.async_engine.connect() as conn:
+                # stream() reads through a server-side cursor on asyncpg
+                result = await conn.stream(query, params)
+                count("events_queries")
+                columns = list(result.keys())
+                async for rows in result.partitions(chunksize):
+                    count("rows_fetched", len(rows))
+                    yield await asyncio.to_thread(_compact_rows, rows, columns)
 
         except Exception as e:
             print(f"Error fetching data: {str(e)}")
             print(traceback.format_exc())
             raise
 
+    def fetch_group_counts(self, start_date, end_date):
+        """Events per processed group in the range, counted by the store and/or database"""
+        try:
+            stored, queried = self.split_fetch_range(start_date, end_date)
+            group_counts = Counter()
+            if stored:
+                with stage("fetch"):
+                    group_counts.update(self.event_store.group_counts(*stored))
+                count("store_reads")
+            if not queried:
+                return group_counts
+
+            query, params = self.query_builder(*queried).build_group_counts()
+
+            with stage("fetch"), connect(self.engine) as conn:
+                counts = pd.read_sql_query(query, conn, params=params)
+            count("aggregate_queries")
+
+            # NULL groups process to "" just like process_person_group does
+            counts["processed_group"] = counts["processed_group"].fillna("")
+            group_counts.update(
+                counts.groupby("processed_group")["records"].sum().to_dict()
+            )
+            return group_counts
+
+        except Exception as e:
+            print(f"Error fetching group counts: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def data_version(self, start_date, end_date):
+        """Token that changes whenever events arrive in the date range"""
+        query, params = self.query_builder(start_date, end_date).select(
+            "MAX(id) AS max_id, MAX(date_and_time) AS max_date_and_time"
+        )
+        with connect(self.engine) as conn:
+            row = conn.execute(query, params).one()
+        return [row.max_id, str(row.max_date_and_time)]
+
+    def output_path(self, filename):
+        """Path for a report file in the output directory"""
+        output_dir = self.output_dir or os.path.join(os.getcwd(), "reports")
+        os.makedirs(output_dir, exist_ok=True)
+        return os.path.join(output_dir, filename)
+
+    def schedule_cleanup(self, output_file):
+        """Delete a written report after cleanup_delay seconds, if set"""
+        if self.cleanup_delay is not None:
+            self.delete_file_after_delay(output_file, self.cleanup_delay)
+
     def delete_file_after_delay(self, file_path, delay):
         """Delete the file after a specified delay"""
         def delete_file():
@@ -63,61 +342,71 @@ class ReportGenerator:
 
         threading.Thread(target=delete_file).start()
 
-    def generate_excel(self, df, report_type, start_date, end_date, additional_params):
-        """Generate Excel file from DataFrame"""
+    def render_sheets(self, filename, sheets, output_dir=None):
+        """Write the report sheets in order; each sheet is (name, frame, wide_columns).
+
+        With ``output_dir`` the file is written there and not scheduled for
+        cleanup; the caller owns the directory.
+        """
+        if output_dir is None:
+            output_file = self.output_path(filename)
+        else:
+            output_file = os.path.join(output_dir, filename)
+        with stage("render"):
+            with ExcelReportWriter(output_file, self.excel_backend) as writer:
+                for sheet_name, frame, wide_columns in sheets:
+                    writer.write_frame(sheet_name, frame, wide_columns)
+        count("rendered_files")
+        if output_dir is None:
+            self.schedule_cleanup(output_file)
+        return output_file
+
+    def report_filename(
+        self,
+        report_type,
+        start_date,
+        end_date,
+        prefix="",
+        suffix="report",
+        extension="xlsx",
+    ):
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+        return f"{prefix}{report_type}_{suffix}_{start_date_str}_{end_date_str}.{extension}"
+
+    def standard_sheets(self, df, report_type, start_date, end_date):
+        """Sheets of the standard report for already filtered events"""
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+
+        summary = pd.DataFrame(
+            {
+                "Total Records": [len(df)],
+                "Unique Devices": [df["device_name"].nunique()],
+                "Unique Groups": [df["person_group"].nunique()],
+                "Date Range": [f"{start_date_str} to {end_date_str}"],
+                "Report Type": [report_type.capitalize()],
+            }
+        )
+        return [("Detailed Data", expand_events(df), 3), ("Summary", summary, 3)]
+
+    def generate_excel(
+        self, df, report_type, start_date, end_date, additional_params, output_dir=None
+    ):
+        """Generate Excel file from DataFrame, into output_dir if given"""
         try:
-            if additional_params:
-                filter_obj = Filter(df)
-                df = filter_obj.apply_filters(additional_params)
-
-            start_date_str = start_date.strftime("%Y-%m-%d")
-            end_date_str = end_date.strftime("%Y-%m-%d")
-
-            # Generate Excel file
-            output_file = os.path.join(
-                os.getcwd(),
-                "reports",
-                f"{report_type}_report_{start_date_str}_{end_date_str}.xlsx",
-            )
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            with stage("transform"):
+                if additional_params:
+                    filter_obj = Filter(df)
+                    df = filter_obj.apply_filters(additional_params)
 
-            with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-                df.to_excel(writer, sheet_name="Detailed Data", index=False)
+                sheets = self.standard_sheets(df, report_type, start_date, end_date)
 
-                summary = pd.DataFrame(
-                    {
-                        "Total Records": [len(df)],
-                        "Unique Devices": [df["device_name"].nunique()],
-                        "Unique Groups": [df["person_group"].nunique()],
-                        "Date Range": [f"{start_date_str} to {end_date_str}"],
-                        "Report Type": [report_type.capitalize()],
-                    }
-                )
-                summary.to_excel(writer, sheet_name="Summary", index=False)
-
-                # Adjust column widths
-                for sheet_name in writer.sheets:
-                    worksheet = writer.sheets[sheet_name]
-                    for col in worksheet.columns:
-                        max_length = 0
-                        column = col[0].column_letter  # Get the column name
-                        for cell in col:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(cell.value)
-                            except:
-                                pass
-                        adjusted_width = max_length + 2
-                        if column in [
-                            "A",
-                            "B",
-                            "C",
-                        ]:  # Adjust the first three columns more
-                            adjusted_width += 5
-                        worksheet.column_dimensions[column].width = adjusted_width
-
-            self.delete_file_after_delay(output_file, 5)
-            return output_file
+            return self.render_sheets(
+                self.report_filename(report_type, start_date, end_date),
+                sheets,
+                output_dir,
+            )
 
         except Exception as e:
             print(f"Error generating Excel file: {str(e)}")
@@ -126,175 +415,1072 @@ class ReportGenerator:
 
     def process_person_group(self, person_group):
         """Process person group by taking last value after '>' and stripping whitespace"""
-        # Handle NaN/None values
-        if pd.isna(person_group):
-            return ""
+        return process_person_group(person_group)
+
+    def read_timetable_groups(self, work_timetable_path):
+        """Read the work timetable and return its set of processed groups"""
+        timetable_df = pd.read_excel(work_timetable_path)
+
+        # Ensure person_group column exists in timetable
+        if "person_group" not in timetable_df.columns:
+            raise ValueError("Work timetable must contain a 'person_group' column")
+
+        timetable_df["processed_group"] = process_person_groups(
+            timetable_df["person_group"]
+        ).astype(str)
+
+        # Remove empty groups from timetable
+        timetable_df = timetable_df[timetable_df["processed_group"] != ""]
+
+        # Get unique processed groups from timetable
+        timetable_groups = set(timetable_df["processed_group"].unique())
+
+        if not timetable_groups:
+            raise ValueError("No valid person groups found in work timetable")
+
+        return timetable_groups
+
+    def read_shifts(self, work_timetable_path):
+        """Shift times of the work timetable, or None when it has no start/end times"""
+        try:
+            return read_shifts(work_timetable_path)
+        except ValueError as e:
+            print(f"Warning: no attendance sheet, {str(e)}")
+            return None
+
+    def parse_timetable(self, work_timetable_path):
+        """Processed groups and shift times of a work timetable file"""
+        return (
+            self.read_timetable_groups(work_timetable_path),
+            self.read_shifts(work_timetable_path),
+        )
+
+    def load_timetable(self, additional_params):
+        """(timetable_groups, shifts) of the request's timetable.
+
+        ``timetable_sha256`` names a timetable in the timetable cache;
+        ``work_timetable`` is a file path, parsed only when its content is
+        not cached yet.
+        """
+        sha256 = additional_params.get("timetable_sha256")
+        if sha256:
+            entry = (
+                self.timetable_cache.get(sha256)
+                if self.timetable_cache is not None
+                else None
+            )
+            if entry is None:
+                raise ValueError(f"Timetable {sha256} is not in the timetable cache")
+        elif self.timetable_cache is not None:
+            entry = self.timetable_cache.load(
+                additional_params["work_timetable"], self.parse_timetable
+            )
+        else:
+            return self.parse_timetable(additional_params["work_timetable"])
+        return entry["groups"], entry["shifts"]
 
-        # Convert to string to handle any numeric values
-        person_group = str(person_group)
+    def pair_sessions(self, events, shifts, start_date, end_date):
+        """Sessions of timetable-matched events whose shift date is in the range.
 
-        if ">" in person_group:
-            return person_group.split(">")[-1].strip()
-        return person_group.strip()
+        ``events`` should cover a window padded by sessions.SESSION_PADDING so
+        shifts crossing midnight at the range edges are paired whole; each
+        session counts toward the day of the shift it was matched to.
+        """
+        return sessions_in_range(
+            match_shifts(build_sessions(events), shifts), start_date, end_date
+        )
+
+    def session_sheets(self, sessions, shifts):
+        """Attendance and Sessions sheets of paired sessions"""
+        return [
+            ("Attendance", attendance_sheet(session_presence(sessions), shifts), 0),
+            ("Sessions", sessions_sheet(sessions), 0),
+        ]
+
+    def attendance_sheets(self, events, shifts, start_date, end_date):
+        """Attendance and Sessions sheets from timetable-matched events (see pair_sessions)"""
+        return self.session_sheets(
+            self.pair_sessions(events, shifts, start_date, end_date), shifts
+        )
+
+    def custom_sheets(
+        self,
+        df,
+        timetable_groups,
+        report_type,
+        start_date,
+        end_date,
+        group_counts=None,
+        shifts=None,
+    ):
+        """Sheets of the timetable-matched report; with ``shifts`` attendance sheets too.
+
+        ``df`` may hold a padded window around the range (see plan_report);
+        only events inside the range go into the detail and summary sheets.
+        """
+        # Process person groups in the event data
+        df["processed_group"] = process_person_groups(df["person_group"])
+        matched_window = df[df["processed_group"].isin(timetable_groups)]
+        df = events_in_range(df, start_date, end_date)
+
+        # Filter main dataframe to only include matching groups
+        matched_df = events_in_range(matched_window, start_date, end_date)
+
+        if matched_df.empty:
+            print("Warning: No matching records found with the provided work timetable")
+
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+
+        # Detailed Data sheet - drop the temporary processed_group column
+        sheets = [
+            ("Detailed Data", expand_events(matched_df.drop("processed_group", axis=1)), 0)
+        ]
+
+        # Summary sheet
+        summary = pd.DataFrame(
+            {
+                "Total Records": [len(matched_df)],
+                "Matched Groups": [len(matched_df["processed_group"].unique())],
+                "Total Groups in Timetable": [len(timetable_groups)],
+                "Date Range": [f"{start_date_str} to {end_date_str}"],
+                "Report Type": [f"Custom {report_type.capitalize()}"],
+            }
+        )
+        sheets.append(("Summary", summary, 0))
+
+        # Group Summary sheet
+        if not matched_df.empty:
+            group_summary = (
+                matched_df.groupby("person_group", observed=True)
+                .agg(
+                    {
+                        "id": "count",
+                        "device_name": "nunique",
+                        "person_name": "nunique",
+                    }
+                )
+                .rename(
+                    columns={
+                        "id": "Total Records",
+                        "device_name": "Unique Devices",
+                        "person_name": "Unique Persons",
+                    }
+                )
+                .reset_index()
+            )
+        else:
+            group_summary = pd.DataFrame(
+                columns=[
+                    "person_group",
+                    "Total Records",
+                    "Unique Devices",
+                    "Unique Persons",
+                ]
+            )
+        sheets.append(("Group Summary", group_summary, 0))
+
+        # Attendance and Sessions sheets
+        if shifts is not None:
+            sheets.extend(
+                self.attendance_sheets(matched_window, shifts, start_date, end_date)
+            )
+
+        # Unmatched Groups sheet
+        if group_counts is None:
+            group_counts = Counter(group_value_counts(df["processed_group"]).to_dict())
+        unmatched_groups = sorted(set(group_counts) - timetable_groups)
+        if unmatched_groups:
+            unmatched_df = pd.DataFrame(
+                {
+                    "Unmatched Group": unmatched_groups,
+                    "Records Count": [group_counts[group] for group in unmatched_groups],
+                }
+            )
+            sheets.append(("Unmatched Groups", unmatched_df, 0))
+
+        print(
+            f"Custom Excel file generated successfully with {len(matched_df)} matching records"
+        )
+        return sheets
 
     def generate_custom_excel(
-        self, df, work_timetable_path, report_type, start_date, end_date
+        self,
+        df,
+        work_timetable_path,
+        report_type,
+        start_date,
+        end_date,
+        timetable_groups=None,
+        group_counts=None,
+        shifts=None,
     ):
-        """Generate custom Excel file based on work timetable matching"""
+        """Generate custom Excel file based on work timetable matching.
+
+        When the rows were already narrowed to the timetable groups in SQL,
+        ``group_counts`` (see fetch_group_counts) supplies the per-group totals
+        for the "Unmatched Groups" sheet.
+        """
         try:
-            # Read work timetable
-            timetable_df = pd.read_excel(work_timetable_path)
+            if timetable_groups is None:
+                timetable_groups = self.read_timetable_groups(work_timetable_path)
+            if shifts is None:
+                shifts = self.read_shifts(work_timetable_path)
 
-            # Ensure person_group column exists in timetable
-            if "person_group" not in timetable_df.columns:
-                raise ValueError("Work timetable must contain a 'person_group' column")
+            with stage("transform"):
+                sheets = self.custom_sheets(
+                    df,
+                    timetable_groups,
+                    report_type,
+                    start_date,
+                    end_date,
+                    group_counts,
+                    shifts,
+                )
 
-            # Process person groups in both dataframes
-            df["processed_group"] = df["person_group"].apply(self.process_person_group)
-            timetable_df["processed_group"] = timetable_df["person_group"].apply(
-                self.process_person_group
+            return self.render_sheets(
+                self.report_filename(report_type, start_date, end_date, prefix="custom_"),
+                sheets,
             )
 
-            # Remove empty groups from timetable
-            timetable_df = timetable_df[timetable_df["processed_group"] != ""]
+        except Exception as e:
+            print(f"Error generating custom Excel file: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def standard_partial(self, chunk):
+        """Pre-aggregates of one chunk (or partition) of standard report events"""
+        return {
+            "events": chunk,
+            "records": len(chunk),
+            "devices": set(chunk["device_name"].dropna().unique()),
+            "groups": set(chunk["person_group"].dropna().unique()),
+        }
+
+    def standard_partials(self, chunks, additional_params=None):
+        """standard_partial of each fetched chunk, in order"""
+        for chunk in timed("fetch", chunks):
+            with stage("transform"):
+                if additional_params:
+                    chunk = Filter(chunk).apply_filters(additional_params)
+                partial = self.standard_partial(chunk)
+            yield partial
+
+    def write_standard_report(self, partials, report_type, start_date, end_date):
+        """Stream the rows of standard partials to a workbook and merge their summaries"""
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+
+        output_file = self.output_path(
+            self.report_filename(report_type, start_date, end_date)
+        )
 
-            # Get unique processed groups from timetable
-            timetable_groups = set(timetable_df["processed_group"].unique())
+        writer = ExcelReportWriter(output_file, self.excel_backend)
+        worksheet = None
+        total_records = 0
+        devices = set()
+        groups = set()
 
-            if not timetable_groups:
-                raise ValueError("No valid person groups found in work timetable")
+        for partial in partials:
+            total_records += partial["records"]
+            devices.update(partial["devices"])
+            groups.update(partial["groups"])
 
-            # Filter main dataframe to only include matching groups
-            matched_df = df[df["processed_group"].isin(timetable_groups)]
+            with stage("render"):
+                detail = expand_events(partial["events"])
+                if worksheet is None:
+                    # Columns are sized from the first chunk
+                    worksheet = writer.add_sheet("Detailed Data", detail, wide_columns=3)
+                writer.append(worksheet, detail)
 
-            if matched_df.empty:
-                print(
-                    "Warning: No matching records found with the provided work timetable"
+        if worksheet is None:
+            writer.add_sheet_columns("Detailed Data", EVENT_COLUMNS)
+
+        summary = pd.DataFrame(
+            {
+                "Total Records": [total_records],
+                "Unique Devices": [len(devices)],
+                "Unique Groups": [len(groups)],
+                "Date Range": [f"{start_date_str} to {end_date_str}"],
+                "Report Type": [report_type.capitalize()],
+            }
+        )
+        with stage("render"):
+            writer.write_frame("Summary", summary, wide_columns=3)
+            writer.close()
+        count("rendered_files")
+
+        self.schedule_cleanup(output_file)
+        return output_file
+
+    def generate_excel_chunked(
+        self, chunks, report_type, start_date, end_date, additional_params
+    ):
+        """Generate Excel file from an iterator of DataFrame chunks.
+
+        Rows go straight to a streaming workbook and the summary is
+        accumulated per chunk, so memory is bounded by the chunk size.
+        """
+        try:
+            return self.write_standard_report(
+                self.standard_partials(chunks, additional_params),
+                report_type,
+                start_date,
+                end_date,
+            )
+
+        except Exception as e:
+            print(f"Error generating Excel file: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def custom_partial(
+        self, chunk, timetable_groups, start_date, end_date, shifts=None, count_groups=True
+    ):
+        """Pre-aggregates of one chunk (or partition) of custom report events.
+
+        Rows outside start_date..end_date (the padding of a session fetch)
+        only go into ``session_events``. ``group_counts`` is left empty unless
+        ``count_groups``, i.e. when the rows were not narrowed in SQL.
+        """
+        chunk["processed_group"] = process_person_groups(chunk["person_group"])
+        partial = {"session_events": None, "group_counts": Counter()}
+        if shifts is not None:
+            # Padding rows only feed the session pairing
+            partial["session_events"] = chunk.loc[
+                chunk["processed_group"].isin(timetable_groups), SESSION_EVENT_COLUMNS
+            ]
+            chunk = events_in_range(chunk, start_date, end_date)
+        if count_groups:
+            partial["group_counts"].update(
+                group_value_counts(chunk["processed_group"]).to_dict()
+            )
+
+        matched = chunk[chunk["processed_group"].isin(timetable_groups)]
+        # person_group -> [records, devices, persons]
+        group_stats = {}
+        for group, part in matched.groupby("person_group", observed=True):
+            group_stats[group] = [
+                len(part),
+                set(part["device_name"].dropna()),
+                set(part["person_name"].dropna()),
+            ]
+
+        partial.update(
+            events=matched.drop("processed_group", axis=1),
+            records=len(matched),
+            matched_groups=set(matched["processed_group"].unique()),
+            group_stats=group_stats,
+        )
+        return partial
+
+    def custom_partials(
+        self, chunks, timetable_groups, start_date, end_date, shifts=None, count_groups=True
+    ):
+        """custom_partial of each fetched chunk, in order"""
+        for chunk in timed("fetch", chunks):
+            with stage("transform"):
+                partial = self.custom_partial(
+                    chunk, timetable_groups, start_date, end_date, shifts, count_groups
                 )
+            yield partial
+
+    def write_custom_report(
+        self,
+        partials,
+        timetable_groups,
+        report_type,
+        start_date,
+        end_date,
+        group_counts=None,
+        shifts=None,
+    ):
+        """Stream the matched rows of custom partials to a workbook and merge the rest.
+
+        Partials carry either ``session_events`` (paired here chunk by chunk,
+        carrying only the open sessions across chunks, since sessions can
+        span them) or ready ``sessions`` of their own date range.
+        """
+        pairer = SessionPairer()
+        session_parts = []
+        merged_counts = Counter()
+
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+
+        output_file = self.output_path(
+            self.report_filename(report_type, start_date, end_date, prefix="custom_")
+        )
+
+        writer = ExcelReportWriter(output_file, self.excel_backend)
+        worksheet = None
+        total_records = 0
+        matched_groups = set()
+        # person_group -> [records, devices, persons]
+        group_stats = {}
+
+        for partial in partials:
+            total_records += partial["records"]
+            matched_groups.update(partial["matched_groups"])
+            merged_counts.update(partial["group_counts"])
+            if partial.get("sessions") is not None:
+                session_parts.append(partial["sessions"])
+            elif partial["session_events"] is not None:
+                with stage("transform"):
+                    pairer.add(partial["session_events"])
+            for group, (records, devices, persons) in partial["group_stats"].items():
+                stats = group_stats.setdefault(group, [0, set(), set()])
+                stats[0] += records
+                stats[1].update(devices)
+                stats[2].update(persons)
+
+            with stage("render"):
+                detail = expand_events(partial["events"])
+                if worksheet is None:
+                    worksheet = writer.add_sheet("Detailed Data", detail)
+                writer.append(worksheet, detail)
+
+        if worksheet is None:
+            writer.add_sheet_columns("Detailed Data", EVENT_COLUMNS)
+
+        if total_records == 0:
+            print("Warning: No matching records found with the provided work timetable")
+
+        # Summary sheet
+        summary = pd.DataFrame(
+            {
+                "Total Records": [total_records],
+                "Matched Groups": [len(matched_groups)],
+                "Total Groups in Timetable": [len(timetable_groups)],
+                "Date Range": [f"{start_date_str} to {end_date_str}"],
+                "Report Type": [f"Custom {report_type.capitalize()}"],
+            }
+        )
+        sheets = [("Summary", summary, 0)]
+
+        # Group Summary sheet
+        group_summary = pd.DataFrame(
+            [
+                [group, stats[0], len(stats[1]), len(stats[2])]
+                for group, stats in sorted(group_stats.items())
+            ],
+            columns=[
+                "person_group",
+                "Total Records",
+                "Unique Devices",
+                "Unique Persons",
+            ],
+        )
+        sheets.append(("Group Summary", group_summary, 0))
 
-            # Generate Excel file
-            start_date_str = start_date.strftime("%Y-%m-%d")
-            end_date_str = end_date.strftime("%Y-%m-%d")
+        # Attendance and Sessions sheets
+        if shifts is not None:
+            with stage("transform"):
+                if session_parts:
+                    sessions = pd.concat(session_parts, ignore_index=True)
+                else:
+                    sessions = sessions_in_range(
+                        match_shifts(pairer.sessions(), shifts), start_date, end_date
+                    )
+                sheets.extend(self.session_sheets(sessions, shifts))
 
-            output_file = os.path.join(
-                os.getcwd(),
-                "reports",
-                f"custom_{report_type}_report_{start_date_str}_{end_date_str}.xlsx",
+        # Unmatched Groups sheet
+        if group_counts is None:
+            group_counts = merged_counts
+        unmatched_groups = sorted(set(group_counts) - timetable_groups)
+        if unmatched_groups:
+            unmatched_df = pd.DataFrame(
+                {
+                    "Unmatched Group": unmatched_groups,
+                    "Records Count": [group_counts[g] for g in unmatched_groups],
+                }
             )
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            sheets.append(("Unmatched Groups", unmatched_df, 0))
+
+        with stage("render"):
+            for sheet_name, frame, wide_columns in sheets:
+                writer.write_frame(sheet_name, frame, wide_columns)
+            writer.close()
+        count("rendered_files")
+        print(
+            f"Custom Excel file generated successfully with {total_records} matching records"
+        )
+        self.schedule_cleanup(output_file)
+        return output_file
+
+    def generate_custom_excel_chunked(
+        self,
+        chunks,
+        work_timetable_path,
+        report_type,
+        start_date,
+        end_date,
+        timetable_groups=None,
+        group_counts=None,
+        shifts=None,
+    ):
+        """Generate custom Excel file from an iterator of DataFrame chunks"""
+        try:
+            if timetable_groups is None:
+                timetable_groups = self.read_timetable_groups(work_timetable_path)
+            if shifts is None:
+                shifts = self.read_shifts(work_timetable_path)
 
-            with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-                # Detailed Data sheet - drop the temporary processed_group column
-                matched_df.drop("processed_group", axis=1).to_excel(
-                    writer, sheet_name="Detailed Data", index=False
+            return self.write_custom_report(
+                self.custom_partials(
+                    chunks,
+                    timetable_groups,
+                    start_date,
+                    end_date,
+                    shifts,
+                    count_groups=group_counts is None,
+                ),
+                timetable_groups,
+                report_type,
+                start_date,
+                end_date,
+                group_counts,
+                shifts,
+            )
+
+        except Exception as e:
+            print(f"Error generating custom Excel file: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def standard_partition(self, start_date, end_date, filters=None):
+        """Fetch and pre-aggregate one partition of a parallel standard report"""
+        df = self.fetch_data(start_date, end_date, filters=filters)
+        with stage("transform"):
+            return self.standard_partial(df)
+
+    def custom_partition(self, start_date, end_date, timetable_groups, shifts=None):
+        """Fetch and pre-aggregate one partition of a parallel custom report.
+
+        With ``shifts`` the fetch is padded and sessions are paired here;
+        only sessions whose shift date falls in the partition are kept, so
+        each session is counted by exactly one partition.
+        """
+        fetch_start, fetch_end = start_date, end_date
+        if shifts is not None:
+            fetch_start -= SESSION_PADDING
+            fetch_end += SESSION_PADDING
+        group_counts = self.fetch_group_counts(start_date, end_date)
+        df = self.fetch_data(fetch_start, fetch_end, timetable_groups=timetable_groups)
+
+        with stage("transform"):
+            partial = self.custom_partial(
+                df, timetable_groups, start_date, end_date, shifts, count_groups=False
+            )
+            partial["group_counts"] = group_counts
+            session_events = partial.pop("session_events")
+            if shifts is not None:
+                partial["sessions"] = self.pair_sessions(
+                    session_events, shifts, start_date, end_date
                 )
+        return partial
 
-                # Summary sheet
-                summary = pd.DataFrame(
-                    {
-                        "Total Records": [len(matched_df)],
-                        "Matched Groups": [len(matched_df["processed_group"].unique())],
-                        "Total Groups in Timetable": [len(timetable_groups)],
-                        "Date Range": [f"{start_date_str} to {end_date_str}"],
-                        "Report Type": [f"Custom {report_type.capitalize()}"],
-                    }
+    def generate_parallel(self, plan):
+        """Generate a report from date partitions fetched and aggregated in parallel.
+
+        Workers fetch and pre-aggregate the partitions of ``plan.partitions``;
+        this process merges the partials in date order and writes the
+        workbook while later partitions are still being worked on.
+        """
+        try:
+            pool = self.partition_pool()
+            if plan.kind == "custom":
+                partials = pool.map(
+                    "custom_partition",
+                    plan.partitions,
+                    timetable_groups=plan.timetable_groups,
+                    shifts=plan.shifts,
                 )
-                summary.to_excel(writer, sheet_name="Summary", index=False)
-
-                # Group Summary sheet
-                if not matched_df.empty:
-                    group_summary = (
-                        matched_df.groupby("person_group")
-                        .agg(
-                            {
-                                "id": "count",
-                                "device_name": "nunique",
-                                "person_name": "nunique",
-                            }
-                        )
-                        .rename(
-                            columns={
-                                "id": "Total Records",
-                                "device_name": "Unique Devices",
-                                "person_name": "Unique Persons",
-                            }
-                        )
-                        .reset_index()
+                return self.write_custom_report(
+                    partials,
+                    plan.timetable_groups,
+                    plan.report_type,
+                    plan.start_date,
+                    plan.end_date,
+                    shifts=plan.shifts,
+                )
+
+            partials = pool.map(
+                "standard_partition", plan.partitions, filters=plan.filters
+            )
+            return self.write_standard_report(
+                partials, plan.report_type, plan.start_date, plan.end_date
+            )
+
+        except Exception as e:
+            print(f"Error generating parallel report: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def batch_events(self, events, filter_sets):
+        """Events of each filter set; plain person_group sets share one groupby pass"""
+        if all(set(f) == {"name", "person_group"} for f in filter_sets):
+            by_group = dict(
+                iter(events.groupby("person_group", observed=True, sort=False))
+            )
+            empty = events.iloc[:0]
+            return [by_group.get(f["person_group"], empty) for f in filter_sets]
+        return [Filter(events).apply_filters(f) for f in filter_sets]
+
+    def render_standard_workbook(self, output_file, events, report_type, start_date, end_date):
+        """Write a standard report of already filtered events to ``output_file``"""
+        with stage("transform"):
+            sheets = self.standard_sheets(events, report_type, start_date, end_date)
+        with stage("render"):
+            with ExcelReportWriter(output_file, self.excel_backend) as writer:
+                for sheet_name, frame, wide_columns in sheets:
+                    writer.write_frame(sheet_name, frame, wide_columns)
+        count("rendered_files")
+        return output_file
+
+    def batch_sheets(self, names, parts, report_type, start_date, end_date):
+        """One workbook's sheets: a per-set summary, then the rows of each set"""
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+        summary = pd.DataFrame(
+            {
+                "Department": names,
+                "Total Records": [len(p) for p in parts],
+                "Unique Devices": [p["device_name"].nunique() for p in parts],
+                "Unique Groups": [p["person_group"].nunique() for p in parts],
+                "Date Range": f"{start_date_str} to {end_date_str}",
+                "Report Type": report_type.capitalize(),
+            }
+        )
+        sheets = [("Summary", summary, 1)]
+        titles = unique_titles(names, reserved=["Summary"])
+        for title, part in zip(titles, parts):
+            sheets.append((title, expand_events(part), 3))
+        return sheets
+
+    def generate_batch(self, plan):
+        """One standard report per filter set of ``plan.batch`` from a single fetch.
+
+        The range is fetched once (narrowed to the union of the sets when
+        they are plain departments) and split with one groupby. The
+        "zip" layout renders a workbook per set, in the partition pool when
+        parallel_workers is set; "sheets" writes one workbook with a sheet
+        per set.
+        """
+        try:
+            filter_sets = plan.batch
+            names = [f["name"] for f in filter_sets]
+            events = self.fetch_data(
+                plan.start_date, plan.end_date, filters=fetch_filters(filter_sets)
+            )
+            with stage("transform"):
+                parts = self.batch_events(events, filter_sets)
+            count("batch_reports", len(parts))
+
+            if plan.batch_layout == "sheets":
+                return self.render_sheets(
+                    self.report_filename(
+                        plan.report_type, plan.start_date, plan.end_date, prefix="batch_"
+                    ),
+                    self.batch_sheets(
+                        names, parts, plan.report_type, plan.start_date, plan.end_date
+                    ),
+                )
+
+            output_file = self.output_path(
+                self.report_filename(
+                    plan.report_type,
+                    plan.start_date,
+                    plan.end_date,
+                    prefix="batch_",
+                    extension="zip",
+                )
+            )
+            work_dir = tempfile.mkdtemp(dir=os.path.dirname(output_file))
+            try:
+                arguments = [
+                    (
+                        os.path.join(work_dir, f"{stem}.xlsx"),
+                        part,
+                        plan.report_type,
+                        plan.start_date,
+                        plan.end_date,
                     )
-                    group_summary.to_excel(
-                        writer, sheet_name="Group Summary", index=False
+                    for stem, part in zip(unique_titles(names, max_length=100), parts)
+                ]
+                if self.parallel_workers and self.parallel_workers > 1 and len(parts) > 1:
+                    written = list(
+                        self.partition_pool().starmap(
+                            "render_standard_workbook", arguments
+                        )
                     )
                 else:
-                    pd.DataFrame(
-                        columns=[
-                            "person_group",
-                            "Total Records",
-                            "Unique Devices",
-                            "Unique Persons",
-                        ]
-                    ).to_excel(writer, sheet_name="Group Summary", index=False)
-
-                # Unmatched Groups sheet
-                unmatched_groups = (
-                    set(df["processed_group"].unique()) - timetable_groups
-                )
-                if unmatched_groups:
-                    unmatched_df = pd.DataFrame(
-                        {
-                            "Unmatched Group": sorted(list(unmatched_groups)),
-                            "Records Count": [
-                                len(df[df["processed_group"] == group])
-                                for group in sorted(list(unmatched_groups))
-                            ],
-                        }
+                    written = [self.render_standard_workbook(*a) for a in arguments]
+
+                # Workbooks are already deflated, so they are stored as they are
+                with stage("render"), zipfile.ZipFile(output_file, "w") as archive:
+                    for path in written:
+                        archive.write(path, os.path.basename(path))
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+            self.schedule_cleanup(output_file)
+            return output_file
+
+        except Exception as e:
+            print(f"Error generating batch report: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def flat_filename(self, plan):
+        """File name of a CSV or Parquet report"""
+        return self.report_filename(
+            plan.report_type,
+            plan.start_date,
+            plan.end_date,
+            prefix="custom_" if plan.kind == "custom" else "",
+            extension=plan.output_format,
+        )
+
+    def flat_frames(self, plan):
+        """Detailed Data rows of a report as frames of at most flat_chunksize rows.
+
+        Filters and timetable groups are pushed into the fetch, so the
+        rows come out of the event store or the database cursor already
+        matched and only need their date and time columns.
+        """
+        chunks = self.fetch_data_chunks(
+            plan.start_date,
+            plan.end_date,
+            plan.chunksize or self.flat_chunksize,
+            filters=plan.filters,
+            timetable_groups=plan.timetable_groups,
+        )
+        for chunk in chunks:
+            yield expand_events(chunk)
+
+    def stream_report(self, plan):
+        """CSV bytes of a report, produced while the rows are fetched.
+
+        Nothing is written to disk, and the event store is read as it is
+        rather than synced first so the first bytes go out right away.
+        """
+        return csv_chunks(self.flat_frames(plan), compress=plan.output_format == "csv.gz")
+
+    async def stream_report_async(self, plan):
+        """stream_report for an event loop; each chunk is encoded in the executor"""
+        encoder = CsvEncoder(compress=plan.output_format == "csv.gz")
+        yield encoder.header()
+        chunks = self.fetch_data_chunks_async(
+            plan.start_date,
+            plan.end_date,
+            plan.chunksize or self.flat_chunksize,
+            filters=plan.filters,
+            timetable_groups=plan.timetable_groups,
+        )
+        async for chunk in chunks:
+            block = await asyncio.to_thread(_encode_events, encoder, chunk)
+            if block:
+                yield block
+        tail = encoder.flush()
+        if tail:
+            yield tail
+
+    def generate_flat(self, plan):
+        """Write the Detailed Data rows of a report as CSV, gzipped CSV or Parquet"""
+        try:
+            output_file = self.output_path(self.flat_filename(plan))
+            with FlatReportWriter(output_file, plan.output_format) as writer:
+                for frame in timed("fetch", self.flat_frames(plan)):
+                    with stage("render"):
+                        writer.write(frame)
+            count("rendered_files")
+            self.schedule_cleanup(output_file)
+            return output_file
+
+        except Exception as e:
+            print(f"Error generating {plan.output_format} report: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def summary_sheets(
+        self,
+        report_type,
+        start_date,
+        end_date,
+        timetable_groups=None,
+        filters=None,
+        shifts=None,
+    ):
+        """Summary sheets aggregated from the daily rollup.
+
+        No raw events are read, except for the Attendance sheet of a
+        timetable with shifts crossing midnight: the rollup holds calendar
+        days, so those scans are paired into sessions like the full report.
+        """
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+
+        if timetable_groups is not None:
+            matched = self.query_builder(start_date, end_date).where_processed_groups(
+                sorted(timetable_groups)
+            )
+            group_counts = self.rollup.group_counts(
+                self.query_builder(start_date, end_date)
+            )
+            totals = self.rollup.totals(matched)
+            count("aggregate_queries", 2)
+
+            summary = pd.DataFrame(
+                {
+                    "Total Records": [int(totals["total_records"])],
+                    "Matched Groups": [
+                        len([g for g in timetable_groups if group_counts.get(g)])
+                    ],
+                    "Total Groups in Timetable": [len(timetable_groups)],
+                    "Date Range": [f"{start_date_str} to {end_date_str}"],
+                    "Report Type": [f"Custom {report_type.capitalize()}"],
+                }
+            )
+            sheets = [
+                ("Summary", summary, 0),
+                ("Group Summary", self.rollup.group_summary(matched), 0),
+                ("Daily Summary", self.rollup.daily_summary(matched), 0),
+            ]
+            count("aggregate_queries", 2)
+            if shifts is not None:
+                if crosses_midnight(shifts):
+                    events = self.fetch_data(
+                        start_date - SESSION_PADDING,
+                        end_date + SESSION_PADDING,
+                        timetable_groups=timetable_groups,
                     )
-                    unmatched_df.to_excel(
-                        writer, sheet_name="Unmatched Groups", index=False
+                    presence = session_presence(
+                        self.pair_sessions(events, shifts, start_date, end_date)
                     )
+                else:
+                    presence = self.rollup.person_days(matched)
+                    count("aggregate_queries")
+                sheets.append(("Attendance", attendance_sheet(presence, shifts), 0))
+
+            unmatched_groups = sorted(set(group_counts) - timetable_groups)
+            if unmatched_groups:
+                unmatched_df = pd.DataFrame(
+                    {
+                        "Unmatched Group": unmatched_groups,
+                        "Records Count": [group_counts[g] for g in unmatched_groups],
+                    }
+                )
+                sheets.append(("Unmatched Groups", unmatched_df, 0))
+            return sheets
+
+        builder = self.query_builder(start_date, end_date).apply_filters(filters or {})
+        totals = self.rollup.totals(builder)
+
+        summary = pd.DataFrame(
+            {
+                "Total Records": [int(totals["total_records"])],
+                "Unique Devices": [int(totals["unique_devices"])],
+                "Unique Groups": [int(totals["unique_groups"])],
+                "Date Range": [f"{start_date_str} to {end_date_str}"],
+                "Report Type": [report_type.capitalize()],
+            }
+        )
+        sheets = [
+            ("Summary", summary, 3),
+            ("Group Summary", self.rollup.group_summary(builder), 0),
+            ("Daily Summary", self.rollup.daily_summary(builder), 0),
+        ]
+        count("aggregate_queries", 3)
+        return sheets
 
-                # Adjust column widths
-                for sheet_name in writer.sheets:
-                    worksheet = writer.sheets[sheet_name]
-                    for col in worksheet.columns:
-                        max_length = 0
-                        column = col[0].column_letter
-                        for cell in col:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(cell.value)
-                            except:
-                                pass
-                        adjusted_width = max_length + 2
-                        worksheet.column_dimensions[column].width = adjusted_width
-
-            print(
-                f"Custom Excel file generated successfully with {len(matched_df)} matching records"
+    def generate_summary_report(
+        self,
+        report_type,
+        start_date,
+        end_date,
+        additional_params=None,
+        timetable_groups=None,
+        shifts=None,
+    ):
+        """Generate a summary-only report from the daily rollup.
+
+        The rollup is brought up to date and the summary sheets are
+        aggregated from it (see summary_sheets for the one exception).
+        """
+        try:
+            additional_params = additional_params or {}
+            with stage("fetch"):
+                self.rollup.refresh()
+
+                custom = timetable_groups is not None or (
+                    ReportPlan(report_type, start_date, end_date, additional_params).kind
+                    == "custom"
+                )
+                if custom and timetable_groups is None:
+                    timetable_groups, shifts = self.load_timetable(additional_params)
+                sheets = self.summary_sheets(
+                    report_type,
+                    start_date,
+                    end_date,
+                    timetable_groups=timetable_groups if custom else None,
+                    filters=None if custom else additional_params,
+                    shifts=shifts,
+                )
+
+            return self.render_sheets(
+                self.report_filename(
+                    report_type,
+                    start_date,
+                    end_date,
+                    prefix="custom_" if custom else "",
+                    suffix="summary",
+                ),
+                sheets,
             )
-            self.delete_file_after_delay(output_file, 5)
-            return output_file
 
         except Exception as e:
-            print(f"Error generating custom Excel file: {str(e)}")
+            print(f"Error generating summary report: {str(e)}")
             print(traceback.format_exc())
             raise
 
     def generate_report(
-        self, report_type, start_date, end_date, additional_params=None
+        self, report_type, start_date, end_date, additional_params=None, timings=None
     ):
-        """Generate report based on type and additional parameters"""
-        df = self.fetch_data(start_date, end_date)
-
-        # Check if custom timetable report is requested
-        if additional_params and "work_timetable" in additional_params:
-            return self.generate_custom_excel(
-                df,
-                additional_params["work_timetable"],
-                report_type,
-                start_date,
-                end_date,
+        """Generate report based on type and additional parameters.
+
+        With a cache configured, closed ranges are served from it directly and
+        open ranges are reused until new events arrive in the range. Stage
+        times and counters are recorded into ``timings`` (a StageTimings),
+        along with the output size and the peak RSS of this process.
+        """
+        timings = timings if timings is not None else StageTimings()
+        reset_peak_rss()
+        output_file = self.cached_report(
+            report_type, start_date, end_date, additional_params, timings
+        )
+        timings.count("output_bytes", os.path.getsize(output_file))
+        timings.maximum("peak_rss_bytes", peak_rss_bytes())
+        return output_file
+
+    def cached_report(
+        self, report_type, start_date, end_date, additional_params, timings
+    ):
+        """The report from the cache, or built and then stored in it"""
+        if self.cache is None:
+            return self.build_report(
+                report_type, start_date, end_date, additional_params, timings
+            )
+
+        with timings.activate(), stage("cache"):
+            if self.cache.is_closed(end_date):
+                data_version = "closed"
+            else:
+                data_version = self.data_version(start_date, end_date)
+
+            key = self.cache.make_key(
+                report_type, start_date, end_date, additional_params, data_version
             )
+            cached_file = self.cache.get(key)
+        if cached_file:
+            timings.count("cache_hits")
+            print(f"Serving cached report {cached_file}")
+            return cached_file
 
-        # Default Excel generation
-        return self.generate_excel(
-            df, report_type, start_date, end_date, additional_params
+        output_file = self.build_report(
+            report_type, start_date, end_date, additional_params, timings
         )
+        with timings.activate(), stage("cache"):
+            return self.cache.put(key, output_file) or output_file
+
+    def plan_report(self, report_type, start_date, end_date, additional_params=None):
+        """Decide the data source, query pushdowns and fetch mode of a report"""
+        plan = ReportPlan(report_type, start_date, end_date, additional_params)
+        if plan.kind == "custom":
+            plan.timetable_groups, plan.shifts = self.load_timetable(plan.params)
+        if plan.flat:
+            # Flat formats hold the matched rows only, no attendance sheets
+            plan.shifts = None
+            return plan
+        if plan.source == "events":
+            plan.chunksize = self.chunksize
+            if plan.kind != "batch" and self.parallel_workers and self.parallel_workers > 1:
+                partitions = date_partitions(start_date, end_date, self.partition_days)
+                if len(partitions) > 1:
+                    plan.partitions = partitions
+        return plan
+
+    def build_report(
+        self, report_type, start_date, end_date, additional_params=None, timings=None
+    ):
+        """Plan, fetch, transform and render a report, bypassing the cache.
+
+        Every report makes one events query: filters and timetable groups are
+        pushed down into it, so the database only returns the rows the report
+        keeps. Summary-only reports are answered from the daily rollup
+        without reading events.
+        """
+        timings = timings if timings is not None else StageTimings()
+        with timings.activate():
+            with stage("plan"):
+                plan = self.plan_report(
+                    report_type, start_date, end_date, additional_params
+                )
+            print(f"Report plan: {plan.describe()}")
+
+            if plan.source == "events":
+                with stage("sync"):
+                    self.sync_event_store()
+
+            if plan.kind == "batch":
+                return self.generate_batch(plan)
+
+            if plan.flat:
+                return self.generate_flat(plan)
+
+            if plan.partitions:
+                return self.generate_parallel(plan)
+
+            if plan.source == "rollup":
+                return self.generate_summary_report(
+                    report_type,
+                    start_date,
+                    end_date,
+                    plan.params,
+                    timetable_groups=plan.timetable_groups,
+                    shifts=plan.shifts,
+                )
+
+            if plan.kind == "custom":
+                group_counts = self.fetch_group_counts(start_date, end_date)
+                data = self.fetch_data(
+                    plan.fetch_start,
+                    plan.fetch_end,
+                    chunksize=plan.chunksize,
+                    timetable_groups=plan.timetable_groups,
+                )
+                generate = (
+                    self.generate_custom_excel_chunked
+                    if plan.chunksize
+                    else self.generate_custom_excel
+                )
+                return generate(
+                    data,
+                    plan.work_timetable,
+                    report_type,
+                    start_date,
+                    end_date,
+                    timetable_groups=plan.timetable_groups,
+                    group_counts=group_counts,
+                    shifts=plan.shifts,
+                )
+
+            # Rows arrive already filtered, so the writers skip the pandas filter
+            data = self.fetch_data(
+                start_date, end_date, chunksize=plan.chunksize, filters=plan.filters
+            )
+            if plan.chunksize:
+                return self.generate_excel_chunked(
+                    data, report_type, start_date, end_date, None
+                )
+            return self.generate_excel(data, report_type, start_date, end_date, None)
@@ -0,0 +1,284 @@
+import threading
+import traceback
+from collections import Counter
+
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+
+from db import connect
+
+ROLLUP_TABLE = "users_daily_rollup"
+STATE_TABLE = "users_rollup_state"
+
+# Arbitrary key for pg_advisory_xact_lock, serializes concurrent refreshes
+ROLLUP_LOCK_KEY = 48151623
+
+
+class DailyRollup:
+    """Daily per-person/per-group/per-device event summary kept next to ``users``.
+
+    Rows hold the event count and the first/last event time of one person on
+    one device for one day. ``refresh`` folds in rows with an ``id`` above the
+    stored high-water mark, so only new rows are scanned, whatever their
+    ``date_and_time`` (a device uploading its offline buffer sends old
+    timestamps). Rows committed out of id order are caught by comparing the
+    row count up to the mark with the rollup's total; on a mismatch the days
+    that differ are aggregated again. NULL names and groups are stored as ''
+    to keep the primary key usable.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def ensure_schema(self):
+        """Create the rollup and state tables if they do not exist"""
+        if self._schema_ready:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+                        date DATE NOT NULL,
+                        person_group TEXT NOT NULL,
+                        person_name TEXT NOT NULL,
+                        device_name TEXT NOT NULL,
+                        records INTEGER NOT NULL,
+                        first_in TIMESTAMP,
+                        last_out TIMESTAMP,
+                        PRIMARY KEY (date, person_group, person_name, device_name)
+                    )
+                """
+                )
+            )
+            conn.execute(
+                text(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                        name TEXT PRIMARY KEY,
+                        high_water_mark TIMESTAMP,
+                        high_water_id BIGINT
+                    )
+                """
+                )
+            )
+            existing = {c["name"] for c in inspect(conn).get_columns(STATE_TABLE)}
+            if "high_water_id" not in existing:
+                # State written when the mark was on date_and_time; with no id
+                # mark the next refresh rebuilds the rollup
+                conn.execute(
+                    text(f"ALTER TABLE {STATE_TABLE} ADD COLUMN high_water_id BIGINT")
+                )
+        self._schema_ready = True
+
+    def _upsert_sql(self, has_low, has_days=False):
+        least, greatest = ("LEAST", "GREATEST")
+        if self.dialect != "postgresql":
+            least, greatest = ("MIN", "MAX")
+
+        conditions = ["id <= :high"]
+        if has_low:
+            conditions.insert(0, "id > :low")
+        if has_days:
+            conditions.append("date IN :days")
+        return f"""
+            INSERT INTO {ROLLUP_TABLE}
+                (date, person_group, person_name, device_name, records, first_in, last_out)
+            SELECT
+                date,
+                COALESCE(person_group, ''),
+                COALESCE(person_name, ''),
+                COALESCE(device_name, ''),
+                COUNT(*),
+                MIN(date_and_time),
+                MAX(date_and_time)
+            FROM users
+            WHERE {" AND ".join(conditions)}
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (date, person_group, person_name, device_name) DO UPDATE SET
+                records = {ROLLUP_TABLE}.records + excluded.records,
+                first_in = {least}({ROLLUP_TABLE}.first_in, excluded.first_in),
+                last_out = {greatest}({ROLLUP_TABLE}.last_out, excluded.last_out)
+        """
+
+    def high_water_mark(self):
+        """Highest ``users.id`` already folded into the rollup"""
+        self.ensure_schema()
+        with connect(self.engine) as conn:
+            return conn.execute(
+                text(f"SELECT high_water_id FROM {STATE_TABLE} WHERE name = 'users'")
+            ).scalar()
+
+    def _stale_days(self, conn, low):
+        """Days whose rows up to id ``low`` differ in count from the rollup"""
+        folded = conn.execute(
+            text(f"SELECT COALESCE(SUM(records), 0) FROM {ROLLUP_TABLE}")
+        ).scalar()
+        rows = conn.execute(
+            text("SELECT COUNT(*) FROM users WHERE id <= :low"), {"low": low}
+        ).scalar()
+        if rows == folded:
+            return []
+
+        users = pd.read_sql_query(
+            text("SELECT date, COUNT(*) AS records FROM users WHERE id <= :low GROUP BY date"),
+            conn,
+            params={"low": low},
+        )
+        rollup = pd.read_sql_query(
+            text(f"SELECT date, SUM(records) AS records FROM {ROLLUP_TABLE} GROUP BY date"),
+            conn,
+        )
+        # Compared as text, SQLite returns dates as strings and Postgres as dates
+        days = {}
+        for frame in (rollup, users):
+            days.update(zip(frame["date"].astype(str), frame["date"]))
+        counts = pd.merge(
+            users.assign(key=users["date"].astype(str)),
+            rollup.assign(key=rollup["date"].astype(str)),
+            on="key",
+            how="outer",
+            suffixes=("_users", "_rollup"),
+        ).fillna({"records_users": 0, "records_rollup": 0})
+        stale = counts["records_users"] != counts["records_rollup"]
+        return [days[key] for key in counts.loc[stale, "key"]]
+
+    def refresh(self):
+        """Fold rows above the high-water mark into the rollup.
+
+        Days that lost or gained rows at or below the mark (rows committed
+        out of id order, deleted rows) are aggregated again first. Returns the
+        number of rollup rows inserted or updated.
+        """
+        try:
+            self.ensure_schema()
+            with self._lock, self.engine.begin() as conn:
+                if self.dialect == "postgresql":
+                    conn.execute(
+                        text("SELECT pg_advisory_xact_lock(:key)"),
+                        {"key": ROLLUP_LOCK_KEY},
+                    )
+
+                low = conn.execute(
+                    text(f"SELECT high_water_id FROM {STATE_TABLE} WHERE name = 'users'")
+                ).scalar()
+                high = conn.execute(text("SELECT MAX(id) FROM users")).scalar()
+
+                updated = 0
+                if low is None:
+                    # First refresh, or a rollup kept by date_and_time: rebuild
+                    conn.execute(text(f"DELETE FROM {ROLLUP_TABLE}"))
+                else:
+                    stale = self._stale_days(conn, low)
+                    if stale:
+                        print(f"Rollup aggregating {len(stale)} changed days again")
+                        delete = text(
+                            f"DELETE FROM {ROLLUP_TABLE} WHERE date IN :days"
+                        ).bindparams(bindparam("days", expanding=True))
+                        conn.execute(delete, {"days": stale})
+                        refold = text(
+                            self._upsert_sql(False, has_days=True)
+                        ).bindparams(bindparam("days", expanding=True))
+                        updated += conn.execute(
+                            refold, {"high": low, "days": stale}
+                        ).rowcount
+
+                if high is None or (low is not None and high <= low):
+                    return updated
+
+                params = {"high": high}
+                if low is not None:
+                    params["low"] = low
+                result = conn.execute(text(self._upsert_sql(low is not None)), params)
+                updated += result.rowcount
+
+                conn.execute(
+                    text(
+                        f"""
+                        INSERT INTO {STATE_TABLE} (name, high_water_id)
+                        VALUES ('users', :high)
+                        ON CONFLICT (name) DO UPDATE SET
+                            high_water_id = excluded.high_water_id
+                    """
+                    ),
+                    {"high": high},
+                )
+                print(f"Rollup refreshed up to id {high}: {updated} rows")
+                return updated
+
+        except Exception as e:
+            print(f"Error refreshing rollup: {str(e)}")
+            print(traceback.format_exc())
+            raise
+
+    def _read(self, query, params):
+        with connect(self.engine) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def totals(self, builder):
+        """Total records, unique devices and unique groups for the builder's range"""
+        query, params = builder.select(
+            "COALESCE(SUM(records), 0) AS total_records, "
+            "COUNT(DISTINCT NULLIF(device_name, '')) AS unique_devices, "
+            "COUNT(DISTINCT NULLIF(person_group, '')) AS unique_groups",
+            table=ROLLUP_TABLE,
+        )
+        return self._read(query, params).iloc[0].to_dict()
+
+    def group_summary(self, builder):
+        """Per person_group records, unique devices and unique persons"""
+        query, params = builder.select(
+            'person_group, SUM(records) AS "Total Records", '
+            "COUNT(DISTINCT NULLIF(device_name, '')) AS \"Unique Devices\", "
+            "COUNT(DISTINCT NULLIF(person_name, '')) AS \"Unique Persons\"",
+            table=ROLLUP_TABLE,
+            group_by="person_group",
+            order_by="person_group",
+        )
+        df = self._read(query, params)
+        return df[df["person_group"] != ""].reset_index(drop=True)
+
+    def daily_summary(self, builder):
+        """Per day and person_group records, persons and first-in/last-out times"""
+        query, params = builder.select(
+            'date, person_group, SUM(records) AS "Total Records", '
+            "COUNT(DISTINCT NULLIF(person_name, '')) AS \"Unique Persons\", "
+            'MIN(first_in) AS "First In", MAX(last_out) AS "Last Out"',
+            table=ROLLUP_TABLE,
+            group_by="date, person_group",
+            order_by="date, person_group",
+        )
+        return self._read(query, params)
+
+    def person_days(self, builder):
+        """First-in/last-out and records per person and day (attendance.PRESENCE_COLUMNS)"""
+        query, params = builder.select(
+            "date, person_name, MIN(person_group) AS person_group, "
+            "MIN(first_in) AS first_in, MAX(last_out) AS last_out, "
+            "SUM(records) AS records",
+            table=ROLLUP_TABLE,
+            group_by="date, person_name",
+            order_by="date, person_name",
+        )
+        df = self._read(query, params)
+        return df[df["person_name"] != ""].reset_index(drop=True)
+
+    def group_counts(self, builder):
+        """Records per processed group, like ReportGenerator.fetch_group_counts"""
+        query, params = builder.build_group_counts(
+            table=ROLLUP_TABLE, count="SUM(records)"
+        )
+        counts = self._read(query, params)
+        counts["processed_group"] = counts["processed_group"].fillna("")
+        return Counter(counts.groupby("processed_group")["records"].sum().to_dict())
+
+
+if __name__ == "__main__":
+    # Run from cron to keep the rollup warm between reports
+    from app import DB_CONFIG
+    from db import get_engine
+
+    DailyRollup(get_engine(DB_CONFIG)).refresh()
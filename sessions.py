@@ -0,0 +1,296 @@
+import re
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from attendance import PRESENCE_COLUMNS
+from event_frame import concat_events
+from utils import process_person_groups
+
+# Reader names are matched case-insensitively to tell entries from exits
+ENTRY_PATTERN = re.compile(r"(\bin\b|entr|вход)", re.IGNORECASE)
+EXIT_PATTERN = re.compile(r"(\bout\b|exit|выход)", re.IGNORECASE)
+
+ENTRY, EXIT, UNKNOWN = 1, -1, 0
+
+# An open session (last scan was an entry) never runs longer than this
+MAX_SHIFT_LENGTH = pd.Timedelta(hours=16)
+# Without an open entry, a pause this long ends the session
+REST_GAP = pd.Timedelta(hours=6)
+# Sessions are matched to the nearest planned shift start within this
+SHIFT_MATCH_TOLERANCE = pd.Timedelta(hours=12)
+# Days fetched on both sides of the report range so cross-midnight shifts are whole
+SESSION_PADDING = timedelta(days=1)
+
+# Event columns build_sessions needs
+SESSION_EVENT_COLUMNS = ["date_and_time", "person_name", "person_group", "reader_name"]
+
+SESSION_COLUMNS = [
+    "Person",
+    "person_group",
+    "Shift Date",
+    "Session Start",
+    "Session End",
+    "Duration (h)",
+    "Complete",
+    "Records",
+]
+
+
+def reader_directions(reader_names):
+    """ENTRY, EXIT or UNKNOWN per event, classified once per distinct reader name"""
+    readers = reader_names.astype("category")
+    labels = []
+    for name in readers.cat.categories.astype(str):
+        if ENTRY_PATTERN.search(name):
+            labels.append(ENTRY)
+        elif EXIT_PATTERN.search(name):
+            labels.append(EXIT)
+        else:
+            labels.append(UNKNOWN)
+    labels = np.array(labels + [UNKNOWN], dtype=np.int8)
+    # Missing readers have code -1, which picks the trailing UNKNOWN
+    return labels[readers.cat.codes.to_numpy()]
+
+
+SESSION_FRAME_COLUMNS = ["person_name", "person_group", "start", "end", "records", "complete"]
+
+
+def _pair_events(events, last_directions=None):
+    """build_sessions, with what a chunked pairing needs to carry on.
+
+    ``last_directions`` maps a person to the direction of their last known
+    scan before ``events``. Returns the sessions, the session number of each
+    row of ``events``, each session's last event time (int64 ns) and the
+    person's last known direction after each session.
+    """
+    people = events["person_name"].astype("category")
+    times = events["date_and_time"].to_numpy().astype("datetime64[ns]")
+    stamps = times.view(np.int64)
+    order = np.lexsort((stamps, people.cat.codes.to_numpy()))
+
+    person = people.cat.codes.to_numpy()[order]
+    stamps = stamps[order]
+    direction = reader_directions(events["reader_name"])[order]
+    positions = np.arange(len(order))
+
+    initial = np.full(len(people.cat.categories), UNKNOWN, dtype=np.int8)
+    if last_directions:
+        known = people.cat.categories.get_indexer(list(last_directions))
+        initial[known[known >= 0]] = np.array(
+            list(last_directions.values()), dtype=np.int8
+        )[known >= 0]
+
+    new_person = np.r_[True, person[1:] != person[:-1]]
+    gap = np.r_[0, np.diff(stamps)]
+
+    # Direction of the person's last known scan before each event
+    person_start = np.maximum.accumulate(np.where(new_person, positions, 0))
+    known_at = np.maximum.accumulate(np.where(direction != UNKNOWN, positions, -1))
+    previous = np.r_[-1, known_at[:-1]]
+    last_known = np.where(
+        previous >= person_start, direction[np.maximum(previous, 0)], initial[person]
+    )
+    known_after = np.where(
+        known_at >= person_start, direction[np.maximum(known_at, 0)], initial[person]
+    )
+
+    # Only an exit closing an open entry may follow a long pause (a night shift)
+    closes_entry = (last_known == ENTRY) & (direction == EXIT)
+    starts = (
+        new_person
+        | ((direction == ENTRY) & (last_known == EXIT))
+        | (gap > MAX_SHIFT_LENGTH.value)
+        | (~closes_entry & (gap > REST_GAP.value))
+    )
+    bounds = np.flatnonzero(starts)
+    last = np.r_[bounds[1:] - 1, len(order) - 1]
+
+    nat = np.iinfo(np.int64)
+    first_entry = np.minimum.reduceat(
+        np.where(direction == ENTRY, stamps, nat.max), bounds
+    )
+    last_exit = np.maximum.reduceat(
+        np.where(direction == EXIT, stamps, nat.min), bounds
+    )
+    has_entry = first_entry != nat.max
+    has_exit = last_exit != nat.min
+
+    start = np.where(has_entry, first_entry, stamps[bounds])
+    end = np.where(has_exit, last_exit, stamps[last])
+
+    sessions = pd.DataFrame(
+        {
+            "person_name": pd.Categorical.from_codes(
+                person[bounds], categories=people.cat.categories
+            ),
+            "person_group": events["person_group"].iloc[order[bounds]].array,
+            "start": start.astype("datetime64[ns]"),
+            "end": end.astype("datetime64[ns]"),
+            "records": np.diff(np.r_[bounds, len(order)]),
+            "complete": has_entry & has_exit,
+        }
+    )
+    session_of_row = np.empty(len(order), dtype=np.int64)
+    session_of_row[order] = np.cumsum(starts) - 1
+    return sessions, session_of_row, stamps[last], known_after[last]
+
+
+def build_sessions(events):
+    """Pair entry/exit scans into per-person sessions, across midnight if needed.
+
+    Events are sorted by person and time; a new session starts at a person's
+    first event, at an entry following an exit, after a REST_GAP pause unless
+    an exit closes an open entry, or after MAX_SHIFT_LENGTH in any case.
+    Runs in O(n log n).
+    """
+    events = events[events["person_name"].notna()]
+    if events.empty:
+        return pd.DataFrame(columns=SESSION_FRAME_COLUMNS)
+    return _pair_events(events)[0]
+
+
+class SessionPairer:
+    """build_sessions over events fed chunk by chunk in date_and_time order.
+
+    A session whose last event is more than MAX_SHIFT_LENGTH before the
+    newest event seen can not grow any more and is set aside. Only the
+    events of the other (open) sessions are carried into the next chunk,
+    along with each person's last known scan direction, so memory is
+    bounded by a chunk plus the open sessions rather than the whole range.
+    ``sessions`` returns the same frame build_sessions would for all the
+    events at once.
+    """
+
+    def __init__(self):
+        self.open_events = None
+        # person -> direction of the last scan before open_events
+        self.directions = {}
+        self.newest = None
+        self.closed = []
+
+    def add(self, events):
+        events = events.loc[events["person_name"].notna(), SESSION_EVENT_COLUMNS]
+        if self.open_events is not None:
+            events = concat_events([self.open_events, events])
+        if events.empty:
+            return
+
+        sessions, session_of_row, last_seen, known_after = _pair_events(
+            events, self.directions
+        )
+        newest = int(last_seen.max())
+        self.newest = newest if self.newest is None else max(self.newest, newest)
+
+        # Later events are newer still, so they start sessions of their own
+        closed = (self.newest - last_seen) > MAX_SHIFT_LENGTH.value
+        if closed.any():
+            self.closed.append(sessions[closed])
+            # Sessions are in person and time order, so the last one wins
+            self.directions.update(
+                zip(sessions["person_name"][closed].astype(str), known_after[closed])
+            )
+        self.open_events = events[~closed[session_of_row]]
+
+    def sessions(self):
+        """All sessions of the events added so far"""
+        parts = list(self.closed)
+        if self.open_events is not None and len(self.open_events):
+            parts.append(_pair_events(self.open_events, self.directions)[0])
+        if not parts:
+            return pd.DataFrame(columns=SESSION_FRAME_COLUMNS)
+        sessions = pd.concat(parts, ignore_index=True)
+        sessions["person_name"] = sessions["person_name"].astype(str).astype("category")
+        return sessions.sort_values(["person_name", "start", "end"], ignore_index=True)
+
+
+def match_shifts(sessions, shifts):
+    """Add ``shift_date``: the day of the nearest planned shift start of the group.
+
+    Planned starts are laid out per group and day, then joined with
+    ``merge_asof`` by processed group. Sessions with no planned start within
+    SHIFT_MATCH_TOLERANCE (or no shift in the timetable) keep the date they
+    started on.
+    """
+    sessions = sessions.assign(shift_date=sessions["start"].dt.normalize())
+    if sessions.empty or shifts is None or shifts.empty:
+        return sessions
+
+    # Join on the timetable row number of each group instead of the group string
+    groups = process_person_groups(pd.Series(sessions["person_group"]))
+    shift_rows = shifts.index.get_indexer(groups.cat.categories)
+    sessions["shift_row"] = shift_rows[groups.cat.codes.to_numpy()]
+
+    days = pd.date_range(
+        sessions["start"].min().normalize() - pd.Timedelta(days=1),
+        sessions["start"].max().normalize() + pd.Timedelta(days=1),
+        freq="D",
+    )
+    planned = pd.DataFrame(
+        {
+            "shift_row": np.repeat(np.arange(len(shifts)), len(days)),
+            "planned_start": (
+                np.tile(days.to_numpy(), len(shifts))
+                + np.repeat(shifts["start"].to_numpy(), len(days))
+            ),
+        }
+    ).sort_values("planned_start", ignore_index=True)
+
+    matched = pd.merge_asof(
+        sessions.sort_values("start"),
+        planned,
+        left_on="start",
+        right_on="planned_start",
+        by="shift_row",
+        direction="nearest",
+        tolerance=SHIFT_MATCH_TOLERANCE,
+    )
+    matched["shift_date"] = matched["planned_start"].dt.normalize().fillna(
+        matched["shift_date"]
+    )
+    return matched.drop(columns=["shift_row", "planned_start"])
+
+
+def sessions_in_range(sessions, start_date, end_date):
+    """Sessions whose shift date falls in the report range"""
+    shift_dates = sessions["shift_date"].dt.date
+    return sessions[(shift_dates >= start_date) & (shift_dates <= end_date)]
+
+
+def session_presence(sessions):
+    """Per person and shift date presence, in the attendance.PRESENCE_COLUMNS layout"""
+    if sessions.empty:
+        return pd.DataFrame(columns=PRESENCE_COLUMNS)
+    return (
+        sessions.groupby(["shift_date", "person_name"], observed=True, sort=False)
+        .agg(
+            person_group=("person_group", "first"),
+            first_in=("start", "min"),
+            last_out=("end", "max"),
+            records=("records", "sum"),
+        )
+        .reset_index()
+        .rename(columns={"shift_date": "date"})[PRESENCE_COLUMNS]
+    )
+
+
+def sessions_sheet(sessions):
+    """Rows of the Sessions sheet"""
+    if sessions.empty:
+        return pd.DataFrame(columns=SESSION_COLUMNS)
+    sessions = sessions.sort_values(["shift_date", "person_name", "start"])
+    return pd.DataFrame(
+        {
+            "Person": sessions["person_name"].astype(str),
+            "person_group": sessions["person_group"].astype(str),
+            "Shift Date": sessions["shift_date"].dt.date,
+            "Session Start": sessions["start"],
+            "Session End": sessions["end"],
+            "Duration (h)": (
+                (sessions["end"] - sessions["start"]) / pd.Timedelta(hours=1)
+            ).round(2),
+            "Complete": sessions["complete"],
+            "Records": sessions["records"],
+        }
+    )
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import get_engine  # noqa: E402
+
+USERS_COLUMNS = [
+    "id",
+    "date_and_time",
+    "date",
+    "time",
+    "device_name",
+    "reader_name",
+    "person_name",
+    "person_group",
+]
+
+
+def event_rows(events, first_id=1):
+    """users rows from (timestamp, person_name, person_group, reader_name) tuples"""
+    rows = []
+    for offset, (stamp, person, group, reader) in enumerate(events):
+        stamp = pd.Timestamp(stamp)
+        rows.append(
+            {
+                "id": first_id + offset,
+                "date_and_time": stamp.strftime("%Y-%m-%d %H:%M:%S"),
+                "date": stamp.strftime("%Y-%m-%d"),
+                "time": stamp.strftime("%H:%M:%S"),
+                "device_name": "Entrance",
+                "reader_name": reader,
+                "person_name": person,
+                "person_group": group,
+            }
+        )
+    return rows
+
+
+def insert_users(engine, rows):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"INSERT INTO users ({', '.join(USERS_COLUMNS)}) "
+                f"VALUES ({', '.join(':' + c for c in USERS_COLUMNS)})"
+            ),
+            rows,
+        )
+
+
+@pytest.fixture
+def users_engine(tmp_path):
+    """SQLite engine with an empty users table in the layout of the events table"""
+    engine = get_engine({"url": f"sqlite:///{tmp_path / 'events.sqlite3'}"})
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE users (id INTEGER, date_and_time TEXT, date TEXT, "
+                "time TEXT, device_name TEXT, reader_name TEXT, person_name TEXT, "
+                "person_group TEXT)"
+            )
+        )
+    yield engine
+    engine.dispose()
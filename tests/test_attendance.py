@@ -0,0 +1,83 @@
+from datetime import date, time
+
+import pandas as pd
+
+from attendance import (
+    ATTENDANCE_COLUMNS,
+    PRESENCE_COLUMNS,
+    attendance_sheet,
+    crosses_midnight,
+)
+
+SHIFTS = pd.DataFrame(
+    {
+        "start": pd.to_timedelta(["20:00:00", "08:00:00"]),
+        "end": pd.to_timedelta(["32:00:00", "17:00:00"]),
+    },
+    index=["Охрана", "Склад"],
+)
+
+
+def presence(*rows):
+    """Presence rows on 2025-01-06 from (person, group, first_in, last_out, records)"""
+    frame = pd.DataFrame(
+        [(date(2025, 1, 6), *row) for row in rows], columns=PRESENCE_COLUMNS
+    )
+    for column in ("first_in", "last_out"):
+        frame[column] = pd.to_datetime(frame[column])
+    return frame
+
+
+def test_lateness_and_early_departure_in_minutes():
+    sheet = attendance_sheet(
+        presence(
+            ("Опоздавший", "Склад", "2025-01-06 08:20", "2025-01-06 17:05", 4),
+            ("Ранний", "Склад", "2025-01-06 07:45", "2025-01-06 16:30", 2),
+        ),
+        SHIFTS,
+    )
+    assert list(sheet.columns) == ATTENDANCE_COLUMNS
+    rows = sheet.set_index(sheet["Person"].astype(str))
+
+    assert rows.loc["Опоздавший", "Late (min)"] == 20
+    assert rows.loc["Опоздавший", "Early Departure (min)"] == 0
+    assert rows.loc["Ранний", "Late (min)"] == 0
+    assert rows.loc["Ранний", "Early Departure (min)"] == 30
+    assert rows.loc["Ранний", "Presence (h)"] == 8.75
+    assert rows.loc["Ранний", "Shift Start"] == time(8, 0)
+    assert rows.loc["Ранний", "Records"] == 2
+
+
+def test_night_shift_ends_on_the_next_day():
+    sheet = attendance_sheet(
+        presence(
+            ("Ночной", "Компания > Охрана", "2025-01-06 20:10", "2025-01-07 07:00", 3),
+        ),
+        SHIFTS,
+    )
+    row = sheet.iloc[0]
+    assert row["Shift Start"] == time(20, 0)
+    assert row["Shift End"] == time(8, 0)
+    assert row["Late (min)"] == 10
+    assert row["Early Departure (min)"] == 60
+    assert row["Presence (h)"] == 10.83
+    assert crosses_midnight(SHIFTS)
+    assert not crosses_midnight(SHIFTS.loc[["Склад"]])
+
+
+def test_groups_without_a_shift_get_presence_only():
+    sheet = attendance_sheet(
+        presence(
+            ("Гость", "Компания > Гости", "2025-01-06 10:00", "2025-01-06 12:30", 2),
+        ),
+        SHIFTS,
+    )
+    row = sheet.iloc[0]
+    assert row["Presence (h)"] == 2.5
+    assert pd.isna(row["Shift Start"])
+    assert pd.isna(row["Late (min)"]) and pd.isna(row["Early Departure (min)"])
+
+
+def test_no_presence_gives_an_empty_sheet():
+    sheet = attendance_sheet(pd.DataFrame(columns=PRESENCE_COLUMNS), SHIFTS)
+    assert sheet.empty and list(sheet.columns) == ATTENDANCE_COLUMNS
@@ -0,0 +1,16 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from db import connect
+
+
+def test_failed_statements_do_not_leak_query_timers(users_engine):
+    users_engine.metrics.reset()
+    with connect(users_engine) as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+        conn.execute(text("SELECT COUNT(*) FROM users"))
+        assert not conn.info.get("query_start")
+    assert users_engine.metrics.snapshot()["queries"] == 4
@@ -0,0 +1,63 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+
+from event_frame import compact_events, events_in_range
+from event_store import EventStore
+
+MSK = timezone(timedelta(hours=3))
+EET = timezone(timedelta(hours=2))
+
+
+def events(times):
+    return pd.DataFrame(
+        {
+            "id": range(1, len(times) + 1),
+            "date_and_time": times,
+            "device_name": "Entrance",
+            "reader_name": "Reader In",
+            "person_name": "Иванов",
+            "person_group": "Компания > Охрана",
+        }
+    )
+
+
+def test_compact_events_keeps_wall_clock_of_timestamptz():
+    df = compact_events(
+        events([datetime(2025, 3, 1, 8, tzinfo=MSK), datetime(2025, 3, 1, 23, 30, tzinfo=MSK)])
+    )
+    assert df["date_and_time"].dt.tz is None
+    assert list(df["date_and_time"].dt.strftime("%H:%M")) == ["08:00", "23:30"]
+
+
+def test_compact_events_accepts_mixed_offsets():
+    # A range across a DST change arrives with two offsets
+    df = compact_events(
+        events([datetime(2025, 3, 29, 8, tzinfo=EET), datetime(2025, 3, 31, 8, tzinfo=MSK)])
+    )
+    assert list(df["date_and_time"]) == [
+        pd.Timestamp("2025-03-29 08:00"),
+        pd.Timestamp("2025-03-31 08:00"),
+    ]
+
+
+def test_events_in_range_on_timestamptz():
+    df = compact_events(
+        events(
+            [
+                datetime(2025, 3, 1, 23, 30, tzinfo=MSK),
+                datetime(2025, 3, 2, 0, 30, tzinfo=MSK),
+            ]
+        )
+    )
+    assert len(events_in_range(df, date(2025, 3, 2), date(2025, 3, 2))) == 1
+
+
+def test_event_store_writes_timestamptz_day(tmp_path):
+    store = EventStore(str(tmp_path))
+    store._write_day(
+        date(2025, 3, 1),
+        events([datetime(2025, 3, 1, 8, tzinfo=MSK), datetime(2025, 3, 1, 17, tzinfo=MSK)]),
+    )
+    stored = store.read(date(2025, 3, 1), date(2025, 3, 1))
+    assert list(stored["date_and_time"].dt.strftime("%H:%M")) == ["08:00", "17:00"]
@@ -0,0 +1,48 @@
+from datetime import date
+
+from conftest import event_rows, insert_users
+from event_store import EventStore
+
+GROUP = "Компания > Охрана"
+
+
+def day_events(day, count, first_id):
+    return event_rows(
+        [(f"{day} {8 + i:02d}:00:00", f"Сотрудник {i}", GROUP, "Reader In") for i in range(count)],
+        first_id=first_id,
+    )
+
+
+def stored_rows(store, day):
+    return len(store.read(day, day))
+
+
+def test_sync_copies_late_rows_of_a_stored_day(users_engine, tmp_path):
+    insert_users(users_engine, day_events("2025-01-06", 3, 1) + day_events("2025-01-07", 2, 4))
+    store = EventStore(str(tmp_path / "store"), recheck_interval=0)
+    store.sync(users_engine, today=date(2025, 1, 9))
+    assert stored_rows(store, date(2025, 1, 6)) == 3
+
+    # A device uploads its buffer for a day the store already holds
+    insert_users(users_engine, day_events("2025-01-06", 2, 100))
+    store.sync(users_engine, today=date(2025, 1, 9))
+
+    assert stored_rows(store, date(2025, 1, 6)) == 5
+    assert stored_rows(store, date(2025, 1, 7)) == 2
+
+
+def test_verify_finds_late_rows_outside_the_recheck_window(users_engine, tmp_path):
+    insert_users(users_engine, day_events("2025-01-06", 3, 1) + day_events("2025-01-20", 1, 4))
+    store = EventStore(str(tmp_path / "store"), recheck_days=3, recheck_interval=0)
+    store.sync(users_engine, today=date(2025, 1, 22))
+    insert_users(users_engine, day_events("2025-01-06", 1, 100))
+
+    store.sync(users_engine, today=date(2025, 1, 22))
+    assert stored_rows(store, date(2025, 1, 6)) == 3
+    assert store.stale_days(users_engine, date(2025, 1, 6), date(2025, 1, 21)) == [
+        date(2025, 1, 6)
+    ]
+
+    assert store.verify(users_engine) == [date(2025, 1, 6)]
+    assert stored_rows(store, date(2025, 1, 6)) == 4
+    assert store.stale_days(users_engine, date(2025, 1, 6), date(2025, 1, 21)) == []
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+from metrics import ReportMetrics
+
+TIMINGS = {
+    "stages": {"fetch": 1.5, "render": 0.5},
+    "total": 2.0,
+    "counters": {"rows_fetched": np.int64(100), "peak_rss_bytes": 1000},
+}
+
+
+def sample(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[-1])
+    return None
+
+
+def test_render_adds_up_the_totals_of_every_worker(tmp_path):
+    other = ReportMetrics(directory=str(tmp_path))
+    other.observe("done", TIMINGS)
+    other.observe("failed")
+    # Stand in for a second live worker process
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / f"{os.getppid()}.json")
+
+    metrics = ReportMetrics(directory=str(tmp_path))
+    metrics.observe("done", TIMINGS)
+    text = metrics.render()
+
+    assert sample(text, 'report_requests_total{mode="job",status="done"}') == 2
+    assert sample(text, 'report_requests_total{mode="job",status="failed"}') == 1
+    assert sample(text, "report_duration_seconds_count") == 2
+    assert sample(text, 'report_stage_seconds_sum{stage="fetch"}') == 3.0
+    assert sample(text, 'report_pipeline_total{name="rows_fetched"}') == 200
+
+
+def test_files_of_exited_workers_are_removed_on_start(tmp_path):
+    stale = tmp_path / "4194305.json"
+    stale.write_text("{}")
+    ReportMetrics(directory=str(tmp_path))
+    assert not stale.exists()
+
+
+def test_without_a_directory_totals_are_per_process():
+    metrics = ReportMetrics()
+    metrics.observe("done", TIMINGS)
+    assert sample(metrics.render(), "report_duration_seconds_count") == 1
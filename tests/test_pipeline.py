@@ -0,0 +1,28 @@
+import pytest
+
+from pipeline import ReportCancelled, StageTimings
+
+
+def test_timed_stops_between_chunks_once_cancelled():
+    cancelled = []
+    timings = StageTimings(cancelled=lambda: bool(cancelled))
+    seen = []
+    with pytest.raises(ReportCancelled):
+        for chunk in timings.timed("fetch", range(10)):
+            seen.append(chunk)
+            if chunk == 2:
+                cancelled.append(True)
+    assert seen == [0, 1, 2]
+
+
+def test_stage_does_not_start_once_cancelled():
+    timings = StageTimings(cancelled=lambda: True)
+    with pytest.raises(ReportCancelled):
+        with timings.stage("render"):
+            pytest.fail("the stage ran")
+    assert "render" not in timings.stages
+
+
+def test_timings_without_cancel_check_run_to_the_end():
+    timings = StageTimings()
+    assert list(timings.timed("fetch", range(3))) == [0, 1, 2]
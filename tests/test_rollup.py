@@ -0,0 +1,83 @@
+from conftest import event_rows, insert_users
+from rollup import DailyRollup
+from sqlalchemy import text
+
+GROUP = "Компания > Отдел > Оператор"
+
+
+def rollup_records(engine):
+    with engine.connect() as conn:
+        return dict(
+            conn.execute(
+                text("SELECT date, SUM(records) FROM users_daily_rollup GROUP BY date")
+            ).fetchall()
+        )
+
+
+def test_refresh_folds_new_rows(users_engine):
+    insert_users(
+        users_engine,
+        event_rows(
+            [
+                ("2025-01-06 08:00:00", "Иванов", GROUP, "In"),
+                ("2025-01-06 17:00:00", "Иванов", GROUP, "Out"),
+            ]
+        ),
+    )
+    rollup = DailyRollup(users_engine)
+    rollup.refresh()
+    insert_users(
+        users_engine,
+        event_rows([("2025-01-07 08:00:00", "Иванов", GROUP, "In")], first_id=3),
+    )
+    rollup.refresh()
+
+    assert rollup_records(users_engine) == {"2025-01-06": 2, "2025-01-07": 1}
+    assert rollup.high_water_mark() == 3
+
+
+def test_refresh_counts_late_row_with_old_timestamp(users_engine):
+    insert_users(
+        users_engine,
+        event_rows(
+            [
+                ("2025-01-06 08:00:00", "Иванов", GROUP, "In"),
+                ("2025-01-07 08:00:00", "Иванов", GROUP, "In"),
+            ]
+        ),
+    )
+    rollup = DailyRollup(users_engine)
+    rollup.refresh()
+    # A device uploads its offline buffer: new ids, timestamps below the newest
+    insert_users(
+        users_engine,
+        event_rows(
+            [
+                ("2025-01-06 17:00:00", "Иванов", GROUP, "Out"),
+                ("2025-01-07 08:00:00", "Петров", GROUP, "In"),
+            ],
+            first_id=3,
+        ),
+    )
+    rollup.refresh()
+
+    assert rollup_records(users_engine) == {"2025-01-06": 2, "2025-01-07": 2}
+
+
+def test_refresh_counts_row_committed_below_the_mark(users_engine):
+    insert_users(
+        users_engine,
+        event_rows([("2025-01-06 08:00:00", "Иванов", GROUP, "In")], first_id=1)
+        + event_rows([("2025-01-07 09:00:00", "Петров", GROUP, "In")], first_id=3),
+    )
+    rollup = DailyRollup(users_engine)
+    rollup.refresh()
+    # Id 2 was taken before id 3 but committed after the refresh
+    insert_users(
+        users_engine,
+        event_rows([("2025-01-06 08:00:00", "Петров", GROUP, "In")], first_id=2),
+    )
+    rollup.refresh()
+
+    assert rollup_records(users_engine) == {"2025-01-06": 2, "2025-01-07": 1}
+    assert rollup.high_water_mark() == 3
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sessions import SessionPairer, build_sessions, match_shifts
+
+
+def random_events(seed=1, rows=20000, people=40, days=30):
+    """Scans spread over the days, with gaps, unknown readers and night hours"""
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(0, days * 86400, rows))
+    events = pd.DataFrame(
+        {
+            "date_and_time": pd.Timestamp("2025-01-01")
+            + pd.to_timedelta(seconds, unit="s"),
+            "person_name": pd.Categorical(
+                rng.choice([f"Сотрудник {i}" for i in range(people)], rows)
+            ),
+            "person_group": pd.Categorical(
+                rng.choice(["Компания > Охрана", "Компания > Склад"], rows)
+            ),
+            "reader_name": pd.Categorical(
+                rng.choice(["Reader In", "Reader Out", "Lobby"], rows, p=[0.45, 0.45, 0.1])
+            ),
+        }
+    )
+    return events[rng.random(rows) < 0.3].reset_index(drop=True)
+
+
+def normalized(sessions):
+    sessions = sessions.assign(
+        person_name=sessions["person_name"].astype(str),
+        person_group=sessions["person_group"].astype(str),
+    )
+    return sessions.sort_values(["person_name", "start", "end"], ignore_index=True)
+
+
+@pytest.mark.parametrize("chunk_size", [37, 500, 100000])
+def test_session_pairer_matches_build_sessions(chunk_size):
+    events = random_events()
+    pairer = SessionPairer()
+    for start in range(0, len(events), chunk_size):
+        pairer.add(events.iloc[start : start + chunk_size])
+
+    pd.testing.assert_frame_equal(
+        normalized(pairer.sessions()),
+        normalized(build_sessions(events)),
+        check_dtype=False,
+    )
+
+
+def test_session_pairer_carries_only_open_sessions():
+    events = random_events()
+    pairer = SessionPairer()
+    for start in range(0, len(events), 500):
+        pairer.add(events.iloc[start : start + 500])
+
+    newest = events["date_and_time"].max()
+    assert len(pairer.open_events) < 500 + len(events) // 100
+    assert pairer.open_events["date_and_time"].min() >= newest - pd.Timedelta(days=2)
+
+
+def scans(*events):
+    """Events from (timestamp, person_name, person_group, reader_name) tuples"""
+    return pd.DataFrame(
+        events, columns=["date_and_time", "person_name", "person_group", "reader_name"]
+    ).assign(date_and_time=lambda df: pd.to_datetime(df["date_and_time"]))
+
+
+SHIFTS = pd.DataFrame(
+    {
+        "start": pd.to_timedelta(["20:00:00", "08:00:00"]),
+        "end": pd.to_timedelta(["32:00:00", "17:00:00"]),
+    },
+    index=["Охрана", "Склад"],
+)
+
+
+def test_night_shift_is_one_session_on_the_day_it_starts():
+    events = scans(
+        ("2025-01-06 19:55", "Ночной", "Компания > Охрана", "Reader In"),
+        ("2025-01-07 01:10", "Ночной", "Компания > Охрана", "Lobby"),
+        ("2025-01-07 08:05", "Ночной", "Компания > Охрана", "Reader Out"),
+        ("2025-01-07 07:58", "Дневной", "Компания > Склад", "Reader In"),
+        ("2025-01-07 17:02", "Дневной", "Компания > Склад", "Reader Out"),
+    )
+    sessions = normalized(match_shifts(build_sessions(events), SHIFTS))
+
+    night = sessions[sessions["person_name"] == "Ночной"].iloc[0]
+    assert (sessions["person_name"] == "Ночной").sum() == 1
+    assert night["start"] == pd.Timestamp("2025-01-06 19:55")
+    assert night["end"] == pd.Timestamp("2025-01-07 08:05")
+    assert night["complete"] and night["records"] == 3
+    assert night["shift_date"] == pd.Timestamp("2025-01-06")
+
+    day = sessions[sessions["person_name"] == "Дневной"].iloc[0]
+    assert day["shift_date"] == pd.Timestamp("2025-01-07")
+
+
+def test_sessions_split_after_an_exit_and_after_max_shift_length():
+    events = scans(
+        # Two night shifts in a row: the entry after an exit starts a new one
+        ("2025-01-06 20:00", "Ночной", "Компания > Охрана", "Reader In"),
+        ("2025-01-07 08:00", "Ночной", "Компания > Охрана", "Reader Out"),
+        ("2025-01-07 19:50", "Ночной", "Компания > Охрана", "Reader In"),
+        ("2025-01-08 08:10", "Ночной", "Компания > Охрана", "Reader Out"),
+        # An entry never closed: the exit 17 hours later is another session
+        ("2025-01-06 23:50", "Забывчивый", "Компания > Охрана", "Reader In"),
+        ("2025-01-07 16:50", "Забывчивый", "Компания > Охрана", "Reader Out"),
+    )
+    sessions = normalized(match_shifts(build_sessions(events), SHIFTS))
+
+    night = sessions[sessions["person_name"] == "Ночной"]
+    shift_dates = pd.to_datetime(["2025-01-06", "2025-01-07"])
+    assert list(night["shift_date"]) == list(shift_dates)
+    assert night["complete"].all()
+
+    forgetful = sessions[sessions["person_name"] == "Забывчивый"]
+    assert len(forgetful) == 2
+    assert not forgetful["complete"].any()
+
+
+def test_sessions_of_groups_without_a_shift_keep_their_start_date():
+    events = scans(
+        ("2025-01-06 22:00", "Гость", "Компания > Гости", "Reader In"),
+        ("2025-01-07 02:00", "Гость", "Компания > Гости", "Reader Out"),
+    )
+    sessions = match_shifts(build_sessions(events), SHIFTS)
+    assert list(sessions["shift_date"]) == [pd.Timestamp("2025-01-06")]
@@ -0,0 +1,34 @@
+import sys
+
+import pandas as pd
+from sqlalchemy import text
+
+from db import connect
+from query_builder import processed_group_sql
+from utils import GROUP_WHITESPACE, process_person_group, process_person_groups
+
+GROUPS = [
+    "Компания > Охрана",
+    "Компания >\xa0Охрана　",
+    "Компания >\x0cОхрана\x0b",
+    "Компания> Склад  ",
+    "  Склад\t\r\n",
+    "A > B > \x85C\x1f",
+    None,
+]
+
+
+def test_group_whitespace_is_what_str_strip_removes():
+    spaces = {chr(c) for c in range(sys.maxunicode + 1) if chr(c).isspace()}
+    assert set(GROUP_WHITESPACE) == spaces
+
+
+def test_processed_groups_agree_in_python_pandas_and_sql(users_engine):
+    expected = [process_person_group(g) for g in GROUPS]
+    assert expected == ["Охрана", "Охрана", "Охрана", "Склад", "Склад", "C", ""]
+    assert list(process_person_groups(pd.Series(GROUPS))) == expected
+
+    sql = processed_group_sql(users_engine.dialect.name, ":group")
+    with connect(users_engine) as conn:
+        in_sql = [conn.execute(text(f"SELECT {sql}"), {"group": g}).scalar() for g in GROUPS]
+    assert [g or "" for g in in_sql] == expected
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from work_shift_separator import separate_shifts, split_shifts, split_shifts_streaming
+
+
+def timetable(rows=200, seed=3):
+    """Timetable rows where about a third are shift 2 continuations"""
+    rng = np.random.default_rng(seed)
+    shift2 = rng.random(rows) < 0.35
+    groups = np.array([f"Должность {i % 17}" for i in range(rows)], dtype=object)
+    groups[shift2] = None
+    numbers = np.arange(1, rows + 1, dtype=float)
+    numbers[shift2] = np.nan
+    return pd.DataFrame(
+        {
+            "number": numbers,
+            "person_group": groups,
+            "start_time": rng.choice(["8-00", "20-00"], rows),
+            "end_time": rng.choice(["17-00", "8-00"], rows),
+        }
+    )
+
+
+def test_shift2_rows_take_number_and_group_from_the_shift1_row_above():
+    df = pd.DataFrame(
+        {
+            "number": [1, np.nan, 2, np.nan, np.nan],
+            "person_group": ["Охрана", None, "Склад", None, None],
+            "start_time": ["8-00", "20-00", "9-00", "21-00", "22-00"],
+        }
+    )
+    shift1, shift2, previous = separate_shifts(df)
+    assert list(shift1["person_group"]) == ["Охрана", "Склад"]
+    assert list(shift2["person_group"]) == ["Охрана", "Склад", "Склад"]
+    assert list(shift2["number"]) == [1, 2, 2]
+    assert list(shift2["start_time"]) == ["20-00", "21-00", "22-00"]
+    assert previous["person_group"] == "Склад"
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 64])
+def test_chained_batches_match_one_pass(batch_size):
+    df = timetable()
+    expected1, expected2, _ = separate_shifts(df)
+
+    parts1, parts2, previous = [], [], None
+    for start in range(0, len(df), batch_size):
+        shift1, shift2, previous = separate_shifts(
+            df.iloc[start : start + batch_size], previous
+        )
+        parts1.append(shift1)
+        parts2.append(shift2)
+
+    pd.testing.assert_frame_equal(
+        pd.concat(parts1, ignore_index=True), expected1.reset_index(drop=True)
+    )
+    pd.testing.assert_frame_equal(
+        pd.concat(parts2, ignore_index=True).infer_objects(),
+        expected2.reset_index(drop=True),
+    )
+
+
+def test_streaming_split_writes_the_same_sheets(tmp_path):
+    input_file = tmp_path / "input.xlsx"
+    timetable().to_excel(input_file, index=False)
+
+    in_memory = split_shifts(str(input_file), str(tmp_path / "memory.xlsx"))
+    streamed = split_shifts_streaming(
+        str(input_file), str(tmp_path / "streamed.xlsx"), batch_size=23
+    )
+    assert in_memory == streamed
+
+    for sheet in ("Shift 1", "Shift 2"):
+        pd.testing.assert_frame_equal(
+            pd.read_excel(tmp_path / "streamed.xlsx", sheet_name=sheet),
+            pd.read_excel(tmp_path / "memory.xlsx", sheet_name=sheet),
+        )
@@ -0,0 +1,164 @@
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+
+from report_cache import file_sha256
+
+# Bump when the parsed form changes so old entries are parsed again
+TIMETABLE_FORMAT = 1
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class TimetableCache:
+    """Parsed work timetables keyed by the SHA-256 of the uploaded file.
+
+    Each entry is ``<directory>/<sha256>.pkl``, a pickled dict with the
+    processed timetable groups and shift times, so a repeat upload (or a
+    request naming the hash) skips Excel parsing. The file's mtime is its
+    last use; the least recently used entries go once there are more than
+    ``max_entries`` or they take more than ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_entries=200, max_bytes=256 * 1024**2):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _path(self, sha256):
+        if not SHA256_PATTERN.fullmatch(sha256 or ""):
+            raise ValueError(f"Invalid timetable hash: {sha256}")
+        return os.path.join(self.directory, f"{sha256}.pkl")
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Warning: dropping unreadable timetable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+        if entry.get("format") != TIMETABLE_FORMAT:
+            self._remove(path)
+            return None
+        return entry
+
+    def get(self, sha256):
+        """Parsed timetable entry for a content hash, or None"""
+        path = self._path(sha256)
+        entry = self._read(path)
+        if entry is None:
+            return None
+
+        # Touch the entry so LRU eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, sha256, groups, shifts, filename=None):
+        """Store a parsed timetable and return its entry"""
+        entry = {
+            "format": TIMETABLE_FORMAT,
+            "sha256": sha256,
+            "filename": filename,
+            "created": time.time(),
+            "groups": groups,
+            "shifts": shifts,
+        }
+        path = self._path(sha256)
+        tmp_path = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        self.evict()
+        return entry
+
+    def load(self, path, parse, filename=None):
+        """Entry for the timetable file at ``path``, parsing it only on a miss.
+
+        ``parse(path)`` returns (groups, shifts).
+        """
+        sha256 = file_sha256(path)
+        entry = self.get(sha256)
+        if entry is None:
+            groups, shifts = parse(path)
+            entry = self.put(
+                sha256, groups, shifts, filename or os.path.basename(path)
+            )
+        return entry
+
+    def entries(self):
+        """Cached entries, most recently used first"""
+        entries = []
+        for last_used, _, path in sorted(self._files(), reverse=True):
+            entry = self._read(path)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        return files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Drop least recently used entries over the count or size limit"""
+        with self._lock:
+            entries = self._files()
+            total = sum(size for _, size, _ in entries)
+            remaining = len(entries)
+            for last_used, size, path in sorted(entries):
+                if remaining <= self.max_entries and total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                remaining -= 1
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                self._remove(os.path.join(self.directory, name))
+
+
+def describe_timetable(entry):
+    """JSON-friendly summary of a cached timetable entry"""
+    shifts = entry["shifts"]
+    return {
+        "sha256": entry["sha256"],
+        "filename": entry["filename"],
+        "created": entry["created"],
+        "groups": len(entry["groups"]),
+        "shifts": 0 if shifts is None else len(shifts),
+    }
@@ -1,6 +1,66 @@
+import numpy as np
 import pandas as pd
 import re
 from datetime import datetime
+from functools import lru_cache
+
+# Whitespace stripped around a group segment: exactly what str.strip() removes
+# (str.isspace), spelled out so the Postgres expression in query_builder can match it
+GROUP_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680"
+    "\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
+    "\u2028\u2029\u202f\u205f\u3000"
+)
+
+
+def process_person_group(person_group):
+    """Process person group by taking last value after '>' and stripping whitespace"""
+    # Handle NaN/None values
+    if pd.isna(person_group):
+        return ""
+
+    # Convert to string to handle any numeric values
+    person_group = str(person_group)
+
+    if ">" in person_group:
+        return person_group.split(">")[-1].strip(GROUP_WHITESPACE)
+    return person_group.strip(GROUP_WHITESPACE)
+
+
+# Distinct group strings number in the hundreds, so per-row callers (the SQLite
+# last_group_segment function) hit the cache almost every time
+cached_process_person_group = lru_cache(maxsize=4096)(process_person_group)
+
+
+def process_person_groups(person_groups):
+    """Vectorized process_person_group over a Series, returned as a categorical.
+
+    The series is categorical-encoded first, so the string ops run once per
+    distinct group rather than once per row; missing values become "".
+    """
+    groups = person_groups.astype("category")
+    segments = groups.cat.categories.astype(str).str.rsplit(">", n=1).str[-1]
+    processed = segments.str.strip(GROUP_WHITESPACE)
+    # Different full paths can share a last segment, so re-encode
+    new_codes, categories = pd.factorize(processed)
+    categories = list(categories)
+    if "" not in categories:
+        categories.append("")
+    empty_code = categories.index("")
+
+    codes = groups.cat.codes.to_numpy()
+    mapped = np.where(codes >= 0, new_codes[codes] if len(new_codes) else 0, empty_code)
+    return pd.Series(
+        pd.Categorical.from_codes(mapped, categories=categories),
+        index=person_groups.index,
+        name=person_groups.name,
+    )
+
+
+def group_value_counts(processed_groups):
+    """Records per processed group, without the zero counts of unused categories"""
+    counts = processed_groups.value_counts(sort=False)
+    return counts[counts > 0]
 
 
 def load_work_timetable(filepath: str):
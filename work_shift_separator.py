@@ -1,50 +1,149 @@
+import argparse
+
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+
+from excel_writer import ExcelReportWriter
+
+# Input rows handled at a time by split_shifts_streaming
+BATCH_SIZE = 50000
+
+
+def separate_shifts(df, previous=None):
+    """Split rows into shift 1 and shift 2 without a per-row loop.
+
+    A row with an empty person_group belongs to shift 2 and takes ``number``
+    and ``person_group`` from the nearest shift 1 row above it. ``previous``
+    is the last shift 1 row of an earlier batch, so batches can be chained;
+    without it the very first row is always shift 1.
+
+    Returns (shift1_df, shift2_df, last shift 1 row or ``previous``).
+    """
+    df = df.reset_index(drop=True)
+    is_shift2 = df["person_group"].isna().to_numpy().copy()
+    if previous is None and len(df):
+        is_shift2[0] = False
+
+    # Position of the shift 1 row each row belongs to; -1 means an earlier batch
+    positions = np.arange(len(df))
+    source = np.maximum.accumulate(np.where(~is_shift2, positions, -1))
+
+    shift2_df = df[is_shift2].copy()
+    shift2_source = source[is_shift2]
+    from_batch = shift2_source >= 0
+    for column in ("number", "person_group"):
+        values = df[column].to_numpy(dtype=object)[np.maximum(shift2_source, 0)]
+        if previous is not None:
+            values[~from_batch] = previous[column]
+        shift2_df[column] = values
+    shift2_df = shift2_df.infer_objects()
+
+    shift1_df = df[~is_shift2]
+    if len(shift1_df):
+        previous = shift1_df.iloc[-1]
+    return shift1_df, shift2_df, previous
 
-def split_shifts(input_file, output_file):
+
+def split_shifts(input_file, output_file, backend=None):
     """
     Split Excel data into two shifts while preserving all row information.
-    
+
     Args:
         input_file (str): Path to input Excel file
         output_file (str): Path to output Excel file
+        backend (str): Excel writer backend, see excel_writer.BACKENDS
     """
-    # Read the Excel file
     df = pd.read_excel(input_file)
-    
-    # Initialize lists for shift1 and shift2
-    shift1_records = []
-    shift2_records = []
-    
-    # Keep track of previous row for handling shift2
-    prev_row = None
-    
-    for idx, row in df.iterrows():
-        # If person_group is empty and we have a previous row, this is a shift2 record
-        if pd.isna(row['person_group']) and prev_row is not None:
-            # Create shift2 record with number and person_group from previous row
-            shift2_row = row.copy()
-            shift2_row['number'] = prev_row['number']
-            shift2_row['person_group'] = prev_row['person_group']
-            shift2_records.append(shift2_row)
-        else:
-            # This is a shift1 record
-            shift1_records.append(row)
-            prev_row = row
-    
-    # Create DataFrames
-    shift1_df = pd.DataFrame(shift1_records)
-    shift2_df = pd.DataFrame(shift2_records)
-    
-    # Write to Excel
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        shift1_df.to_excel(writer, sheet_name='Shift 1', index=False)
+    shift1_df, shift2_df, _ = separate_shifts(df)
+
+    with ExcelReportWriter(output_file, backend) as writer:
+        writer.write_frame("Shift 1", shift1_df)
         if not shift2_df.empty:
-            shift2_df.to_excel(writer, sheet_name='Shift 2', index=False)
-            
-    # Print summary
+            writer.write_frame("Shift 2", shift2_df)
+
     print(f"Shift 1 records: {len(shift1_df)}")
     print(f"Shift 2 records: {len(shift2_df)}")
+    return len(shift1_df), len(shift2_df)
+
+
+def read_batches(input_file, batch_size=BATCH_SIZE):
+    """DataFrames of ``batch_size`` rows from the first sheet, read in read-only mode"""
+    workbook = load_workbook(input_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def split_shifts_streaming(
+    input_file, output_file, batch_size=BATCH_SIZE, backend=None
+):
+    """split_shifts for inputs too large to load at once.
+
+    Rows are read in batches and appended to both sheets as they are split,
+    so memory stays bounded by ``batch_size``. Column widths are sized from
+    the first batch of each sheet.
+    """
+    previous = None
+    sheets = {}
+    counts = {"Shift 1": 0, "Shift 2": 0}
+
+    with ExcelReportWriter(output_file, backend) as writer:
+        for batch in read_batches(input_file, batch_size):
+            shift1_df, shift2_df, previous = separate_shifts(batch, previous)
+            for sheet_name, part in (("Shift 1", shift1_df), ("Shift 2", shift2_df)):
+                if part.empty:
+                    continue
+                if sheet_name not in sheets:
+                    sheets[sheet_name] = writer.add_sheet(sheet_name, part)
+                writer.append(sheets[sheet_name], part)
+                counts[sheet_name] += len(part)
+
+    print(f"Shift 1 records: {counts['Shift 1']}")
+    print(f"Shift 2 records: {counts['Shift 2']}")
+    return counts["Shift 1"], counts["Shift 2"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Split a work timetable into Shift 1 and Shift 2 sheets"
+    )
+    parser.add_argument("input_file", nargs="?", default="input.xlsx")
+    parser.add_argument("output_file", nargs="?", default="output.xlsx")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="rows per batch when streaming",
+    )
+    parser.add_argument("--backend", help="xlsxwriter or openpyxl")
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        help="load the whole input with pandas instead of streaming it",
+    )
+    args = parser.parse_args(argv)
+
+    if args.in_memory:
+        split_shifts(args.input_file, args.output_file, args.backend)
+    else:
+        split_shifts_streaming(
+            args.input_file, args.output_file, args.batch_size, args.backend
+        )
+
 
 # Example usage
 if __name__ == "__main__":
-    split_shifts('input.xlsx', 'output.xlsx')
\ No newline at end of file
+    main()